@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose entries are not shared between processes or may be culled
+# at any time; carts kept there never reach flush_carts or get lost.
+UNSHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+)
+
+
+@register(Tags.caches)
+def check_cart_store_cache(app_configs, **kwargs):
+    """
+    Refuse to keep carts in a cache the other processes cannot see.
+    """
+    if settings.CART_STORE != 'carts.storage.CacheCartStore':
+        return []
+    backend = settings.CACHES.get(settings.CART_STORE_CACHE, {}).get('BACKEND')
+    if backend in UNSHARED_CACHE_BACKENDS:
+        return [Error(
+            "CacheCartStore needs a shared, non-evicting cache, but CART_STORE_CACHE "
+            "%r uses %s." % (settings.CART_STORE_CACHE, backend),
+            hint = "Point CART_STORE_CACHE at a Redis or Memcached cache, or use DatabaseCartStore.",
+            id = 'carts.E001',
+        )]
+    return []
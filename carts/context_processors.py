@@ -1,21 +1,58 @@
-from carts.views import _cart_id
-from .models import Cart, CartItem
+from shipshop.cache import aget_version, get_version
+from .storage import get_cart_store
+
+CART_COUNT_SESSION_KEY = 'cart_count'
 
 
 def counter(request):
+    """
+    Expose the number of items in the visitor's cart as ``cart_count``.
+
+    The count is stored in the session together with the cart version it
+    was computed at, and recomputed once the version has moved. Every cart
+    write bumps the version, so drawing the navbar badge costs no cart
+    query until the cart changes, and a count can never drift from the
+    cart, however many requests change it concurrently.
+    """
+    if 'admin' in request.path:
+        return {}
+
+    session = request.session
+    if not session.session_key:
+        return dict(cart_count = 0)
+
+    # Read the version before counting: a change made in between bumps it
+    # again, so the count is recomputed on the next page view.
+    version = get_version('cart:%s' % session.session_key)
+    stored = session.get(CART_COUNT_SESSION_KEY)
+    if isinstance(stored, list) and stored[1] == version:
+        return dict(cart_count = stored[0])
+
+    cart_count = get_cart_store().count(session.session_key)
+    session[CART_COUNT_SESSION_KEY] = [cart_count, version]
+    return dict(cart_count = cart_count)
+
+
+async def acounter(request):
+    """
+    Async version of ``counter``.
+
+    Async views await it before rendering: it loads the session and stores
+    the count in it with the async APIs, so that ``counter`` then runs no
+    query inside the event loop.
+    """
     if 'admin' in request.path:
         return {}
-    else:
-        try:
-            cart = Cart.objects.filter(cart_id = _cart_id(request))
-            cart_items = CartItem.objects.filter(cart = cart[:1])
-            
-            cart_count = 0
-
-            for cart_item in cart_items:
-                cart_count += cart_item.quantity
-
-        except Cart.DoesNotExist:
-            cart_count = 0
-    
+
+    session = request.session
+    if not session.session_key:
+        return dict(cart_count = 0)
+
+    version = await aget_version('cart:%s' % session.session_key)
+    stored = await session.aget(CART_COUNT_SESSION_KEY)
+    if isinstance(stored, list) and stored[1] == version:
+        return dict(cart_count = stored[0])
+
+    cart_count = await get_cart_store().acount(session.session_key)
+    await session.aset(CART_COUNT_SESSION_KEY, [cart_count, version])
     return dict(cart_count = cart_count)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from carts.storage import get_cart_store
+
+
+class Command(BaseCommand):
+    help = "Write carts buffered by the configured cart store to the Cart/CartItem tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type = float, default = 0,
+            help = "Keep running and flush every INTERVAL seconds instead of once.",
+        )
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        while True:
+            started = time.monotonic()
+            flushed = store.flush()
+            self.stdout.write("Flushed %d carts in %.3fs." % (flushed, time.monotonic() - started))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,130 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+
+# Session engines that keep a Session row per visitor.
+DATABASE_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete abandoned carts (unchanged for longer than the TTL and, with a "
+        "database session engine, without a live session) with their items, "
+        "then expired sessions, in small batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type = int, default = None,
+            help = "Cart TTL in days (default: settings.CART_TTL_DAYS).",
+        )
+        parser.add_argument('--batch-size', type = int, default = 500, help = "Rows deleted per transaction.")
+        parser.add_argument(
+            '--sleep', type = float, default = 0,
+            help = "Seconds to pause between batches, leaving the write lock to requests.",
+        )
+        parser.add_argument('--database', default = 'default')
+        parser.add_argument('--dry-run', action = 'store_true', help = "Only count what would be deleted.")
+
+    def handle(self, *args, **options):
+        days = settings.CART_TTL_DAYS if options['days'] is None else options['days']
+        if days < 0 or options['batch_size'] < 1:
+            raise CommandError("--days must not be negative and --batch-size must be positive.")
+        self.using = options['database']
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
+        self.dry_run = options['dry_run']
+        now = timezone.now()
+
+        started = time.monotonic()
+        carts, items = self.purge_carts(timezone.localdate(now) - datetime.timedelta(days = days), now)
+        self.report("Carts", carts, started, "(%d items)" % items)
+
+        started = time.monotonic()
+        self.report("Expired sessions", self.purge_sessions(now), started)
+
+    def report(self, label, rows, started, extra = ''):
+        elapsed = time.monotonic() - started
+        self.stdout.write("%s: %s%d rows in %.1fs (%d rows/s) %s" % (
+            label, 'would delete ' if self.dry_run else '', rows, elapsed, rows / max(elapsed, 1e-6), extra,
+        ))
+
+    def pause(self):
+        if self.sleep:
+            time.sleep(self.sleep)
+
+    def purge_carts(self, cutoff, now):
+        """
+        Delete carts last changed before ``cutoff``.
+
+        With a database session engine, carts whose session is still live
+        are kept too. Other engines (cache, signed cookies) write no
+        ``Session`` rows, so the cart's own ``last_active`` day decides.
+
+        Carts are visited in ``(last_active, id)`` order through
+        ``cart_last_active_idx``, seeking past the last one seen, so every
+        batch is an index range read however many carts are kept.
+
+        Returns:
+            tuple: Numbers of deleted carts and cart items
+        """
+        abandoned = Cart.objects.using(self.using).filter(last_active__lt = cutoff).order_by('last_active', 'id')
+        if settings.SESSION_ENGINE in DATABASE_SESSION_ENGINES:
+            live_session = Session.objects.using(self.using).filter(
+                session_key = OuterRef('cart_id'), expire_date__gte = now,
+            )
+            abandoned = abandoned.filter(~Exists(live_session))
+        carts = items = 0
+        last = None
+        while True:
+            queryset = abandoned
+            if last is not None:
+                queryset = queryset.filter(Q(last_active__gt = last[0]) | Q(last_active = last[0], id__gt = last[1]))
+            batch = list(queryset.values_list('last_active', 'id')[:self.batch_size])
+            if not batch:
+                break
+            last = batch[-1]
+            ids = [cart_id for _, cart_id in batch]
+
+            if self.dry_run:
+                items += CartItem.objects.using(self.using).filter(cart_id__in = ids).count()
+            else:
+                with transaction.atomic(using = self.using):
+                    # Items first: the cart delete then has nothing left to cascade.
+                    items += CartItem.objects.using(self.using).filter(cart_id__in = ids).delete()[0]
+                    Cart.objects.using(self.using).filter(id__in = ids).delete()
+            carts += len(ids)
+            self.pause()
+        return carts, items
+
+    def purge_sessions(self, now):
+        """
+        Delete expired sessions, oldest first, through the ``expire_date`` index.
+
+        Returns:
+            int: Number of deleted sessions
+        """
+        expired = Session.objects.using(self.using).filter(expire_date__lt = now).order_by('expire_date')
+        if self.dry_run:
+            return expired.count()
+
+        deleted = 0
+        while True:
+            keys = list(expired.values_list('session_key', flat = True)[:self.batch_size])
+            if not keys:
+                break
+            with transaction.atomic(using = self.using):
+                deleted += Session.objects.using(self.using).filter(session_key__in = keys).delete()[0]
+            self.pause()
+        return deleted
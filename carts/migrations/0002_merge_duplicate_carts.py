@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+
+    # Carts sharing a session key: move their items onto the oldest cart.
+    duplicate_carts = (
+        Cart.objects.values('cart_id')
+        .annotate(carts = Count('id'), keep = Min('id'))
+        .filter(carts__gt = 1)
+    )
+    for row in duplicate_carts:
+        others = Cart.objects.filter(cart_id = row['cart_id']).exclude(pk = row['keep'])
+        CartItem.objects.filter(cart__in = others).update(cart = row['keep'])
+        others.delete()
+
+    # Several rows for the same product in one cart: fold them into one.
+    duplicate_items = (
+        CartItem.objects.values('cart', 'products')
+        .annotate(rows = Count('id'), keep = Min('id'), total = Sum('quantity'))
+        .filter(rows__gt = 1)
+    )
+    for row in duplicate_items:
+        items = CartItem.objects.filter(cart = row['cart'], products = row['products'])
+        items.exclude(pk = row['keep']).delete()
+        items.update(quantity = row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_date_added(apps, schema_editor):
+    # The last change of existing carts is unknown: start from their creation.
+    Cart = apps.get_model('carts', 'Cart')
+    Cart.objects.update(last_active = F('date_added'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0004_cart_date_added_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_active',
+            field=models.DateField(auto_now=True),
+        ),
+        migrations.RunPython(copy_date_added, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['last_active', 'id'], name='cart_last_active_idx'),
+        ),
+    ]
@@ -1,11 +1,58 @@
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
 from store.models import Product
 
 # Create your models here.
 
+class CartQuerySet(models.QuerySet):
+
+    def get_active(self, cart_id):
+        """
+        Get or create a cart for a write, recording today as its last
+        activity. Costs no extra query for carts already written today.
+
+        Args:
+            cart_id (str): The cart to write to
+
+        Returns:
+            Cart: The cart
+        """
+        cart, created = self.get_or_create(cart_id = cart_id)
+        today = timezone.localdate()
+        if not created and cart.last_active < today:
+            self.filter(pk = cart.pk).update(last_active = today)
+            cart.last_active = today
+        return cart
+
+    def mark_active(self, cart_id):
+        """
+        Record today as the last activity of a cart, for writes that do not
+        load it.
+        """
+        today = timezone.localdate()
+        self.filter(cart_id = cart_id, last_active__lt = today).update(last_active = today)
+
+
 class Cart(models.Model):
     cart_id     = models.CharField(max_length= 250, blank=True)
     date_added  = models.DateField(auto_now_add=True)
+    # Day of the last change; manage.py purge_carts deletes carts idle for
+    # CART_TTL_DAYS.
+    last_active = models.DateField(auto_now=True)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['cart_id'], name = 'unique_cart_id'),
+        ]
+        indexes = [
+            # Recent carts (store.popularity).
+            models.Index(fields = ['date_added', 'id'], name = 'cart_date_added_idx'),
+            # Finding abandoned carts to purge (manage.py purge_carts).
+            models.Index(fields = ['last_active', 'id'], name = 'cart_last_active_idx'),
+        ]
 
 
     def __str__(self):
@@ -18,23 +65,181 @@ class Cart(models.Model):
         return self.cart_id
     
 
+class CartItemQuerySet(models.QuerySet):
+
+    def with_totals(self):
+        """
+        Load each item's product and category in the same query and
+        annotate the line total, so rendering a cart costs no extra queries.
+
+        Returns:
+            QuerySet: Cart items annotated with ``line_total``
+        """
+        return self.select_related('products__category').annotate(
+            line_total = F('products__price') * F('quantity'),
+        )
+
+    def totals(self):
+        """
+        Sum prices and quantities of the items in a single aggregate query.
+
+        Returns:
+            dict: ``total`` (price × quantity summed) and ``quantity``
+        """
+        totals = self.aggregate(
+            total = Sum(F('products__price') * F('quantity')),
+            quantity = Sum('quantity'),
+        )
+        return {key: value or 0 for key, value in totals.items()}
+
+    async def atotals(self):
+        """
+        Async version of ``totals()``.
+        """
+        totals = await self.aaggregate(
+            total = Sum(F('products__price') * F('quantity')),
+            quantity = Sum('quantity'),
+        )
+        return {key: value or 0 for key, value in totals.items()}
+
+    def add_product(self, cart, product_id, quantity = 1):
+        """
+        Add ``quantity`` units of a product to a cart in one atomic statement.
+
+        Args:
+            cart (Cart): The cart to add to
+            product_id (int): ID of the product to add
+            quantity (int, optional): Number of units to add (default: 1)
+        """
+        self.add_products(cart, {product_id: quantity})
+
+    def add_products(self, cart, quantities):
+        """
+        Add units of several products to a cart in one atomic statement.
+
+        Uses ``INSERT ... ON CONFLICT (cart, product) DO UPDATE`` where the
+        database supports it, so concurrent adds of the same product can
+        neither lose an increment nor create a duplicate row. Other backends
+        fall back to a conditional ``F()`` update followed by an insert that
+        retries on the unique constraint, product by product.
+
+        Args:
+            cart (Cart): The cart to add to
+            quantities (dict): ``{product_id: units to add}``
+        """
+        if not quantities:
+            return
+        connection = connections[self.db]
+        if connection.features.supports_update_conflicts_with_target:
+            opts = self.model._meta
+            table = connection.ops.quote_name(opts.db_table)
+            cart_column, product_column, quantity_column, active_column = (
+                connection.ops.quote_name(opts.get_field(name).column)
+                for name in ('cart', 'products', 'quantity', 'is_active')
+            )
+            sql = (
+                'INSERT INTO {table} ({cart}, {product}, {quantity}, {active}) '
+                'VALUES {values} '
+                'ON CONFLICT ({cart}, {product}) DO UPDATE SET '
+                '{quantity} = {table}.{quantity} + excluded.{quantity}, '
+                '{active} = excluded.{active}'
+            ).format(
+                table = table, cart = cart_column, product = product_column,
+                quantity = quantity_column, active = active_column,
+                values = ', '.join(['(%s, %s, %s, %s)'] * len(quantities)),
+            )
+            params = []
+            for product_id, quantity in quantities.items():
+                params += [cart.pk, product_id, quantity, True]
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+            return
+
+        for product_id, quantity in quantities.items():
+            items = self.filter(cart = cart, products_id = product_id)
+            while not items.update(quantity = F('quantity') + quantity, is_active = True):
+                try:
+                    with transaction.atomic(using = self.db):
+                        self.create(cart = cart, products_id = product_id, quantity = quantity)
+                    break
+                except IntegrityError:
+                    # Another request inserted the row first; increment it instead.
+                    continue
+
+    def decrement(self):
+        """
+        Remove one unit of the selected cart item.
+
+        Items with more than one unit are decremented with a conditional
+        ``F()`` update, single units are deleted. Each step is one atomic
+        statement guarded by the quantity it expects, so a concurrent add
+        between the two is never lost.
+
+        Returns:
+            bool: True if a unit was removed, False if there was no such item
+        """
+        while True:
+            if self.filter(quantity__gt = 1).update(quantity = F('quantity') - 1):
+                return True
+            deleted, _ = self.filter(quantity__lte = 1).delete()
+            if deleted:
+                return True
+            if not self.exists():
+                return False
+
+    def subtract(self, quantity):
+        """
+        Remove up to ``quantity`` units of the selected cart item.
+
+        Like ``decrement()``, every step is one statement guarded by the
+        quantity it expects: a larger line loses ``quantity`` units through
+        a conditional ``F()`` update, a smaller one is deleted.
+
+        Args:
+            quantity (int): Number of units to remove
+
+        Returns:
+            int: Number of units removed, 0 if there was no such item
+        """
+        while True:
+            if self.filter(quantity__gt = quantity).update(quantity = F('quantity') - quantity):
+                return quantity
+            left = self.filter(quantity__lte = quantity).values_list('quantity', flat = True).first()
+            if left is None and not self.exists():
+                return 0
+            if left is not None and self.filter(quantity = left).delete()[0]:
+                return left
+
+
 class CartItem(models.Model):
     products     =  models.ForeignKey(Product, on_delete=models.CASCADE)
     cart         =  models.ForeignKey(Cart, on_delete=models.CASCADE)
     quantity     =  models.IntegerField()
     is_active    =  models.BooleanField(default=True)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields = ['cart', 'products'], name = 'unique_cart_product'),
+        ]
+
     
     def sub_total(self):
         """
         Calculate the subtotal for this cart item.
         
         This method multiplies the product price by the quantity
-        to get the total cost for this specific cart item.
+        to get the total cost for this specific cart item. Items loaded
+        through ``CartItem.objects.with_totals()`` reuse the ``line_total``
+        computed by the database.
         
         Returns:
             int: The subtotal (product price × quantity)
         """
+        line_total = getattr(self, 'line_total', None)
+        if line_total is not None:
+            return line_total
         return self.products.price * self.quantity
      
     def __str__(self):
@@ -0,0 +1,431 @@
+"""
+Pluggable storage for anonymous carts.
+
+The cart views never touch ``Cart``/``CartItem`` directly; they go through
+the store named by ``settings.CART_STORE``:
+
+``DatabaseCartStore``
+    Every mutation is a single atomic statement against the cart tables.
+
+``CacheCartStore``
+    Carts live in the cache (``settings.CART_STORE_CACHE``) as
+    ``{product_id: quantity}`` maps, so the add/remove path never takes the
+    database write lock. Changed carts are remembered in sharded dirty sets
+    and written behind into the cart tables by ``manage.py flush_carts``,
+    which is meant to run on a schedule. It needs a shared, non-evicting
+    cache (e.g. Redis): the ``carts.E001`` system check refuses process-local
+    backends, and a cart evicted before it is flushed is lost.
+
+The read methods have ``a``-prefixed async versions for the async views. By
+default they run the sync method in a thread; ``DatabaseCartStore`` uses
+the async ORM instead.
+"""
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.module_loading import import_string
+
+from store.models import Product
+from .models import Cart, CartItem
+
+
+class CartLockTimeout(Exception):
+    """
+    A cart stayed locked by another writer for longer than the lock timeout.
+    """
+
+
+def get_cart_store():
+    """
+    Return an instance of the cart store configured in ``settings.CART_STORE``.
+    """
+    return import_string(settings.CART_STORE)()
+
+
+class BaseCartStore:
+    """
+    Interface shared by the cart stores.
+
+    Carts are identified by their ``cart_id`` (the session key). Stores only
+    have to implement the mutations and ``quantities``; the remaining reads
+    are derived from it and may be overridden with cheaper queries.
+    """
+
+    def add(self, cart_id, product_id, quantity = 1):
+        """
+        Add ``quantity`` units of a product to the cart.
+        """
+        raise NotImplementedError
+
+    def decrement(self, cart_id, product_id):
+        """
+        Remove one unit of a product, dropping the line at zero.
+
+        Returns:
+            bool: True if a unit was removed
+        """
+        raise NotImplementedError
+
+    def remove(self, cart_id, product_id):
+        """
+        Remove a product line from the cart entirely.
+
+        Returns:
+            int: Number of units removed
+        """
+        raise NotImplementedError
+
+    def apply(self, cart_id, changes):
+        """
+        Apply changes to several cart lines at once, all or nothing.
+
+        Args:
+            cart_id (str): The cart to change
+            changes (dict): ``{product_id: (action, quantity)}``, where
+                ``('add', n)`` adds n units, or removes up to -n units when
+                n is negative, and ``('set', n)`` sets the line to n units;
+                lines are dropped at zero
+
+        Returns:
+            int: Change in the number of units in the cart
+        """
+        raise NotImplementedError
+
+    def quantities(self, cart_id):
+        """
+        Return the cart contents.
+
+        Returns:
+            dict: ``{product_id: quantity}`` for every line in the cart
+        """
+        raise NotImplementedError
+
+    def contains(self, cart_id, product_id):
+        return product_id in self.quantities(cart_id)
+
+    def count(self, cart_id):
+        return sum(self.quantities(cart_id).values())
+
+    def items(self, cart_id):
+        """
+        Return the cart lines as unsaved ``CartItem`` instances.
+
+        Products and their categories are loaded in one query and every item
+        carries ``line_total``, like ``CartItem.objects.with_totals()``.
+
+        Returns:
+            list: CartItem instances ordered by product id
+        """
+        quantities = self.quantities(cart_id)
+        products = Product.objects.select_related('category').in_bulk(list(quantities))
+        items = []
+        for product_id in sorted(quantities):
+            product = products.get(product_id)
+            if product is None:
+                continue
+            item = CartItem(products = product, quantity = quantities[product_id])
+            item.line_total = product.price * item.quantity
+            items.append(item)
+        return items
+
+    def totals(self, cart_id, items = None):
+        """
+        Return the cart totals.
+
+        Args:
+            cart_id (str): The cart to total
+            items (list, optional): Lines already returned by ``items()``
+
+        Returns:
+            dict: ``total`` (price × quantity summed) and ``quantity``
+        """
+        if items is None:
+            items = self.items(cart_id)
+        return {
+            'total': sum(item.line_total for item in items),
+            'quantity': sum(item.quantity for item in items),
+        }
+
+    def flush(self):
+        """
+        Write buffered carts to the database.
+
+        Returns:
+            int: Number of carts written
+        """
+        return 0
+
+    async def aquantities(self, cart_id):
+        return await sync_to_async(self.quantities)(cart_id)
+
+    async def acount(self, cart_id):
+        return await sync_to_async(self.count)(cart_id)
+
+    async def aitems(self, cart_id):
+        return await sync_to_async(self.items)(cart_id)
+
+    async def atotals(self, cart_id, items = None):
+        return await sync_to_async(self.totals)(cart_id, items)
+
+
+class DatabaseCartStore(BaseCartStore):
+    """
+    Cart store backed directly by the ``Cart`` and ``CartItem`` tables.
+    """
+
+    def _items(self, cart_id):
+        return CartItem.objects.filter(cart__cart_id = cart_id)
+
+    def add(self, cart_id, product_id, quantity = 1):
+        cart = Cart.objects.get_active(cart_id)
+        CartItem.objects.add_product(cart, product_id, quantity)
+
+    def decrement(self, cart_id, product_id):
+        decremented = self._items(cart_id).filter(products_id = product_id).decrement()
+        if decremented:
+            Cart.objects.mark_active(cart_id)
+        return decremented
+
+    def remove(self, cart_id, product_id):
+        cart_item = self._items(cart_id).filter(products_id = product_id)
+        with transaction.atomic():
+            removed = cart_item.aggregate(quantity = Sum('quantity'))['quantity'] or 0
+            cart_item.delete()
+            if removed:
+                Cart.objects.mark_active(cart_id)
+        return removed
+
+    def apply(self, cart_id, changes):
+        added = {product_id: quantity for product_id, (action, quantity) in changes.items() if action == 'add'}
+        targets = {product_id: quantity for product_id, (action, quantity) in changes.items() if action == 'set'}
+        with transaction.atomic():
+            cart = Cart.objects.get_active(cart_id)
+            CartItem.objects.add_products(cart, {
+                product_id: quantity for product_id, quantity in added.items() if quantity > 0
+            })
+            delta = sum(quantity for quantity in added.values() if quantity > 0)
+            for product_id, quantity in added.items():
+                if quantity < 0:
+                    delta -= CartItem.objects.filter(cart = cart, products_id = product_id).subtract(-quantity)
+            if targets:
+                items = CartItem.objects.filter(cart = cart, products_id__in = list(targets))
+                before = dict(items.select_for_update().values_list('products_id', 'quantity'))
+                delta += sum(targets.values()) - sum(before.values())
+                if any(quantity == 0 for quantity in targets.values()):
+                    items.filter(products_id__in = [
+                        product_id for product_id, quantity in targets.items() if quantity == 0
+                    ]).delete()
+                CartItem.objects.bulk_create(
+                    [
+                        CartItem(cart = cart, products_id = product_id, quantity = quantity)
+                        for product_id, quantity in targets.items()
+                        if quantity
+                    ],
+                    update_conflicts = True,
+                    unique_fields = ['cart', 'products'],
+                    update_fields = ['quantity', 'is_active'],
+                )
+        return delta
+
+    def quantities(self, cart_id):
+        return dict(self._items(cart_id).values_list('products_id', 'quantity'))
+
+    def contains(self, cart_id, product_id):
+        return self._items(cart_id).filter(products_id = product_id).exists()
+
+    def count(self, cart_id):
+        return self._items(cart_id).aggregate(count = Sum('quantity'))['count'] or 0
+
+    def items(self, cart_id):
+        return list(self._items(cart_id).filter(is_active = True).with_totals())
+
+    def totals(self, cart_id, items = None):
+        return self._items(cart_id).filter(is_active = True).totals()
+
+    async def aquantities(self, cart_id):
+        return {
+            product_id: quantity
+            async for product_id, quantity in self._items(cart_id).values_list('products_id', 'quantity')
+        }
+
+    async def acount(self, cart_id):
+        return (await self._items(cart_id).aaggregate(count = Sum('quantity')))['count'] or 0
+
+    async def aitems(self, cart_id):
+        return [item async for item in self._items(cart_id).filter(is_active = True).with_totals()]
+
+    async def atotals(self, cart_id, items = None):
+        return await self._items(cart_id).filter(is_active = True).atotals()
+
+
+class CacheCartStore(BaseCartStore):
+    """
+    Cart store that keeps carts in the cache and writes them behind.
+
+    Each mutation is a read-modify-write of one cache entry under a short
+    per-cart lock taken with ``cache.add``, which is atomic on every Django
+    cache backend. Carts missing from the cache are loaded from the
+    database once, so carts written by ``DatabaseCartStore`` or flushed
+    earlier keep working after a restart.
+
+    A changed cart sets a per-cart dirty flag with ``cache.add``; only the
+    first change since the last flush also adds the cart to one of
+    ``dirty_shards`` dirty sets, so writes to different carts rarely wait
+    for each other and most writes touch no set at all.
+    """
+    lock_timeout = 5
+    lock_wait = 0.002
+    dirty_key = 'carts:dirty'
+    dirty_shards = 16
+    # A flag whose cart never made it into a dirty set (the writer died in
+    # between) only holds back re-marking the cart for this long.
+    dirty_flag_timeout = 60 * 60
+
+    def __init__(self, cache = None):
+        self.cache = cache or caches[settings.CART_STORE_CACHE]
+
+    def _key(self, cart_id):
+        return 'carts:cart:%s' % cart_id
+
+    def _shard_key(self, shard):
+        return '%s:%d' % (self.dirty_key, shard)
+
+    @contextmanager
+    def _lock(self, name):
+        """
+        Hold the lock ``name`` for the duration of the block.
+
+        Raises:
+            CartLockTimeout: If the lock is still held by someone else after
+                ``lock_timeout`` seconds
+        """
+        key = '%s:lock' % name
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.cache.add(key, token, self.lock_timeout):
+            # Stale locks expire after lock_timeout, so give up waiting by then.
+            if time.monotonic() >= deadline:
+                raise CartLockTimeout("Could not lock %s." % name)
+            time.sleep(self.lock_wait)
+        try:
+            yield
+        finally:
+            # Only release our own lock: if it expired and someone else
+            # took it, theirs stays.
+            if self.cache.get(key) == token:
+                self.cache.delete(key)
+
+    def _load(self, cart_id):
+        quantities = self.cache.get(self._key(cart_id))
+        if quantities is None:
+            quantities = dict(
+                CartItem.objects.filter(cart__cart_id = cart_id).values_list('products_id', 'quantity')
+            )
+        return quantities
+
+    def _store(self, cart_id, quantities):
+        self.cache.set(self._key(cart_id), quantities, None)
+        if not self.cache.add('%s:flag' % self._key(cart_id), 1, self.dirty_flag_timeout):
+            # Already in a dirty set, waiting for the next flush.
+            return
+        shard = self._shard_key(zlib.crc32(cart_id.encode()) % self.dirty_shards)
+        with self._lock(shard):
+            dirty = self.cache.get(shard, set())
+            dirty.add(cart_id)
+            self.cache.set(shard, dirty, None)
+
+    def add(self, cart_id, product_id, quantity = 1):
+        with self._lock(self._key(cart_id)):
+            quantities = self._load(cart_id)
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+            self._store(cart_id, quantities)
+
+    def decrement(self, cart_id, product_id):
+        with self._lock(self._key(cart_id)):
+            quantities = self._load(cart_id)
+            if product_id not in quantities:
+                return False
+            if quantities[product_id] > 1:
+                quantities[product_id] -= 1
+            else:
+                del quantities[product_id]
+            self._store(cart_id, quantities)
+            return True
+
+    def remove(self, cart_id, product_id):
+        with self._lock(self._key(cart_id)):
+            quantities = self._load(cart_id)
+            removed = quantities.pop(product_id, 0)
+            if removed:
+                self._store(cart_id, quantities)
+            return removed
+
+    def apply(self, cart_id, changes):
+        with self._lock(self._key(cart_id)):
+            quantities = self._load(cart_id)
+            delta = 0
+            for product_id, (action, quantity) in changes.items():
+                before = quantities.get(product_id, 0)
+                after = max(before + quantity, 0) if action == 'add' else quantity
+                if after:
+                    quantities[product_id] = after
+                else:
+                    quantities.pop(product_id, None)
+                delta += after - before
+            if changes:
+                self._store(cart_id, quantities)
+            return delta
+
+    def quantities(self, cart_id):
+        key = self._key(cart_id)
+        quantities = self.cache.get(key)
+        if quantities is None:
+            quantities = self._load(cart_id)
+            self.cache.add(key, quantities, None)
+        return quantities
+
+    def flush(self):
+        """
+        Write every cart changed since the last flush to the cart tables.
+
+        Each cart is written in its own short transaction: missing lines are
+        deleted and the rest upserted with one ``bulk_create``.
+        """
+        dirty = set()
+        for shard in range(self.dirty_shards):
+            key = self._shard_key(shard)
+            with self._lock(key):
+                dirty |= self.cache.get(key, set())
+                self.cache.delete(key)
+
+        flushed = 0
+        for cart_id in dirty:
+            # Clear the flag before reading the cart: a change made after
+            # the read marks the cart dirty again for the next flush.
+            self.cache.delete('%s:flag' % self._key(cart_id))
+            quantities = self.cache.get(self._key(cart_id))
+            if quantities is None:
+                continue
+            existing = set(Product.objects.filter(id__in = list(quantities)).values_list('id', flat = True))
+            with transaction.atomic():
+                cart = Cart.objects.get_active(cart_id)
+                CartItem.objects.filter(cart = cart).exclude(products_id__in = existing).delete()
+                CartItem.objects.bulk_create(
+                    [
+                        CartItem(cart = cart, products_id = product_id, quantity = quantity)
+                        for product_id, quantity in quantities.items()
+                        if product_id in existing
+                    ],
+                    update_conflicts = True,
+                    unique_fields = ['cart', 'products'],
+                    update_fields = ['quantity', 'is_active'],
+                )
+            flushed += 1
+        return flushed
@@ -1,3 +1,463 @@
-from django.test import TestCase
+import datetime
+import io
+import threading
+from unittest import mock
+
+from django.contrib.sessions.models import Session
+from django.db import connection, connections
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from carts.checks import check_cart_store_cache
+from carts.context_processors import CART_COUNT_SESSION_KEY, counter
+from carts.models import Cart, CartItem
+from carts.storage import CacheCartStore, CartLockTimeout, get_cart_store
+from carts.views import CART_API_MAX_QUANTITY
+from category.models import Category
+from shipshop.cache import get_version
+from store.models import Product
 
 # Create your tests here.
+
+
+def make_product(category, name, price = 10):
+    return Product.objects.create(
+        product_name = name,
+        slug = name.lower().replace(' ', '-'),
+        price = price,
+        image = 'photos/product/%s.jpg' % name,
+        stock = 10,
+        category = category,
+    )
+
+
+class CartMutationTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.product = make_product(category, 'Blue Shirt')
+
+    def item(self):
+        return CartItem.objects.get(products = self.product)
+
+    def test_add_and_remove_cart(self):
+        url = '/cart/add_cart/%d/' % self.product.id
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(self.item().quantity, 2)
+        self.assertEqual(Cart.objects.count(), 1)
+
+        self.client.get('/cart/remove_cart/%d/' % self.product.id)
+        self.assertEqual(self.item().quantity, 1)
+        self.client.get('/cart/remove_cart/%d/' % self.product.id)
+        self.assertFalse(CartItem.objects.exists())
+
+        # Removing what is no longer in the cart is a no-op, not an error.
+        response = self.client.get('/cart/remove_cart/%d/' % self.product.id)
+        self.assertRedirects(response, '/cart/')
+
+    def test_add_unknown_product(self):
+        response = self.client.get('/cart/add_cart/999999/')
+        self.assertEqual(response.status_code, 404)
+
+
+class CartTotalsTests(TestCase):
+
+    def test_database_totals_match_sub_totals(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        cart = Cart.objects.create(cart_id = 'totals')
+        for name, price, quantity in (('Blue Shirt', 20, 3), ('Jeans', 55, 1), ('Socks', 4, 7)):
+            CartItem.objects.create(cart = cart, products = make_product(category, name, price = price), quantity = quantity)
+        items = CartItem.objects.filter(cart = cart)
+
+        with self.assertNumQueries(1):
+            annotated = list(items.with_totals())
+        for item in annotated:
+            self.assertEqual(item.line_total, item.products.price * item.quantity)
+        plain = [CartItem.objects.get(pk = item.pk) for item in annotated]
+        self.assertEqual([item.sub_total() for item in annotated], [item.sub_total() for item in plain])
+
+        with self.assertNumQueries(1):
+            totals = items.totals()
+        self.assertEqual(totals, {'total': sum(item.sub_total() for item in plain), 'quantity': 11})
+        self.assertEqual(totals['total'], 20 * 3 + 55 + 4 * 7)
+        self.assertEqual(CartItem.objects.none().totals(), {'total': 0, 'quantity': 0})
+
+
+class CartBadgeTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.product = make_product(category, 'Blue Shirt')
+
+    def badge(self):
+        return self.client.get('/store/').context['cart_count']
+
+    def test_badge_follows_cart_changes(self):
+        self.assertEqual(self.badge(), 0)
+        self.client.get('/cart/add_cart/%d/' % self.product.id)
+        self.client.get('/cart/add_cart/%d/' % self.product.id)
+        self.assertEqual(self.badge(), 2)
+        request = self.client.get('/store/').wsgi_request
+        with self.assertNumQueries(0):
+            self.assertEqual(counter(request)['cart_count'], 2)
+        self.client.get('/cart/remove_cart/%d/' % self.product.id)
+        self.assertEqual(self.badge(), 1)
+        self.client.get('/cart/remove_cart_item/%d/' % self.product.id)
+        self.assertEqual(self.badge(), 0)
+
+    def test_badge_of_a_session_without_a_stored_count(self):
+        self.client.get('/cart/add_cart/%d/' % self.product.id)
+        self.assertEqual(self.badge(), 1)
+        session = self.client.session
+        del session[CART_COUNT_SESSION_KEY]
+        session.save()
+        self.assertEqual(self.badge(), 1)
+        self.assertEqual(self.client.session[CART_COUNT_SESSION_KEY][0], 1)
+
+    def test_cart_change_bumps_the_cart_version(self):
+        self.client.get('/cart/add_cart/%d/' % self.product.id)
+        key = 'cart:%s' % self.client.session.session_key
+        version = get_version(key)
+        self.client.get('/cart/add_cart/%d/' % self.product.id)
+        self.assertEqual(get_version(key), version + 1)
+
+
+@override_settings(CART_STORE = 'carts.storage.CacheCartStore')
+class CacheCartStoreTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.shirt = make_product(category, 'Blue Shirt', price = 20)
+        self.jeans = make_product(category, 'Jeans', price = 50)
+
+    def test_mutations_stay_off_the_database_until_flushed(self):
+        self.client.get('/cart/add_cart/%d/' % self.shirt.id)
+        with self.assertNumQueries(0):
+            get_cart_store().add(self.client.session.session_key, self.shirt.id)
+        self.client.get('/cart/add_cart/%d/' % self.jeans.id)
+        self.client.get('/cart/remove_cart_item/%d/' % self.jeans.id)
+        self.assertFalse(CartItem.objects.exists())
+
+        response = self.client.get('/cart/')
+        self.assertEqual(response.context['total'], 40)
+        self.assertEqual(response.context['quantity'], 2)
+
+        self.assertEqual(get_cart_store().flush(), 1)
+        self.assertEqual(
+            list(CartItem.objects.values_list('products_id', 'quantity')),
+            [(self.shirt.id, 2)],
+        )
+        self.assertEqual(get_cart_store().flush(), 0)
+
+
+class CartApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.shirt = make_product(category, 'Blue Shirt', price = 20)
+        self.jeans = make_product(category, 'Jeans', price = 50)
+        self.socks = make_product(category, 'Socks', price = 5)
+
+    def post(self, *changes):
+        return self.client.post('/cart/api/', {'changes': list(changes)}, content_type = 'application/json')
+
+    def test_batch_changes(self):
+        response = self.post(
+            {'action': 'add', 'product': self.shirt.id, 'quantity': 2},
+            {'action': 'add', 'product': self.jeans.id},
+            {'action': 'add', 'product': self.socks.id, 'quantity': 3},
+        )
+        self.assertEqual(response.status_code, 200)
+        cart = response.json()
+        self.assertEqual([(item['name'], item['quantity']) for item in cart['items']], [
+            ('Blue Shirt', 2), ('Jeans', 1), ('Socks', 3),
+        ])
+        self.assertEqual(cart['items'][0]['url'], self.shirt.get_url())
+        self.assertEqual((cart['total'], cart['quantity'], cart['cart_count']), (105, 6, 6))
+        self.assertEqual(cart['grand_total'], 105 + cart['tax'])
+
+        # The session count feeds the navbar badge.
+        self.client.get('/store/')
+        cart = self.post(
+            {'action': 'set', 'product': self.shirt.id, 'quantity': 5},
+            {'action': 'add', 'product': self.shirt.id},
+            {'action': 'remove', 'product': self.jeans.id},
+            {'action': 'set', 'product': self.socks.id, 'quantity': 0},
+        ).json()
+        self.assertEqual([(item['name'], item['quantity']) for item in cart['items']], [('Blue Shirt', 6)])
+        self.assertEqual((cart['total'], cart['cart_count']), (120, 6))
+        self.assertEqual(self.client.get('/store/').context['cart_count'], 6)
+        self.assertEqual(self.client.get('/cart/api/').json(), cart)
+
+    def test_invalid_batches_change_nothing(self):
+        self.post({'action': 'add', 'product': self.shirt.id})
+        for body in (
+            [{'action': 'add', 'product': self.jeans.id}, {'action': 'add', 'product': 999999}],
+            [{'action': 'add', 'product': self.jeans.id}, {'action': 'set', 'product': self.shirt.id, 'quantity': -1}],
+            [{'action': 'buy', 'product': self.jeans.id}],
+            [{'action': 'add', 'product': str(self.jeans.id)}],
+            [{'action': 'add', 'product': self.jeans.id, 'quantity': 10 ** 30}],
+            [{'action': 'set', 'product': self.jeans.id, 'quantity': CART_API_MAX_QUANTITY + 1}],
+            [{'action': 'decrement', 'product': self.shirt.id, 'quantity': 0}],
+        ):
+            response = self.post(*body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('error', response.json())
+        response = self.client.post('/cart/api/', 'not json', content_type = 'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            list(CartItem.objects.values_list('products_id', 'quantity')),
+            [(self.shirt.id, 1)],
+        )
+
+    def test_decrement_is_relative(self):
+        self.post({'action': 'add', 'product': self.shirt.id, 'quantity': 3})
+        # Another tab adds a unit after this page showed 3.
+        self.post({'action': 'add', 'product': self.shirt.id})
+        cart = self.post({'action': 'decrement', 'product': self.shirt.id}).json()
+        self.assertEqual([(item['name'], item['quantity']) for item in cart['items']], [('Blue Shirt', 3)])
+
+        cart = self.post(
+            {'action': 'add', 'product': self.jeans.id, 'quantity': 2},
+            {'action': 'decrement', 'product': self.jeans.id},
+            {'action': 'set', 'product': self.socks.id, 'quantity': 4},
+            {'action': 'decrement', 'product': self.socks.id, 'quantity': 5},
+            {'action': 'decrement', 'product': self.shirt.id, 'quantity': 2},
+        ).json()
+        self.assertEqual([(item['name'], item['quantity']) for item in cart['items']], [
+            ('Blue Shirt', 1), ('Jeans', 1),
+        ])
+        cart = self.post({'action': 'decrement', 'product': self.shirt.id, 'quantity': 5}).json()
+        self.assertEqual([item['name'] for item in cart['items']], ['Jeans'])
+        self.assertEqual(cart['cart_count'], 1)
+
+    def test_removing_without_a_cart(self):
+        cart = self.post({'action': 'remove', 'product': self.shirt.id}).json()
+        self.assertEqual((cart['items'], cart['cart_count']), ([], 0))
+        self.assertFalse(Session.objects.exists())
+
+    @override_settings(CART_STORE = 'carts.storage.CacheCartStore')
+    def test_cache_store(self):
+        self.post({'action': 'add', 'product': self.shirt.id}, {'action': 'add', 'product': self.jeans.id})
+        cart = self.post(
+            {'action': 'add', 'product': self.shirt.id, 'quantity': 2},
+            {'action': 'remove', 'product': self.jeans.id},
+        ).json()
+        self.assertEqual([(item['name'], item['quantity']) for item in cart['items']], [('Blue Shirt', 3)])
+        self.assertEqual(cart['cart_count'], 3)
+        self.assertFalse(CartItem.objects.exists())
+
+        cart = self.post(
+            {'action': 'decrement', 'product': self.shirt.id, 'quantity': 2},
+            {'action': 'decrement', 'product': self.socks.id},
+        ).json()
+        self.assertEqual([(item['name'], item['quantity']) for item in cart['items']], [('Blue Shirt', 1)])
+        self.assertEqual(cart['cart_count'], 1)
+
+
+class CacheCartStoreLockTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.store = CacheCartStore(cache)
+
+    def test_lock_times_out_instead_of_entering(self):
+        # Another writer holds the lock (for longer than we are willing to wait).
+        cache.set('carts:cart:a:lock', 'theirs', 60)
+        self.store.lock_timeout = 0.05
+        with self.assertRaises(CartLockTimeout):
+            with self.store._lock('carts:cart:a'):
+                self.fail("Entered a lock held by someone else.")
+        # The failed attempt must not have released the lock it never had.
+        self.assertEqual(cache.get('carts:cart:a:lock'), 'theirs')
+
+    def test_expired_lock_is_not_released_by_its_former_owner(self):
+        with self.store._lock('carts:cart:a'):
+            # Our lock expired and another writer took it.
+            cache.set('carts:cart:a:lock', 'theirs')
+        self.assertEqual(cache.get('carts:cart:a:lock'), 'theirs')
+
+    def test_dirty_carts_are_sharded_and_marked_once(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        product = make_product(category, 'Blue Shirt')
+        for i in range(40):
+            self.store.add('cart-%d' % i, product.id)
+        shards = [cache.get(self.store._shard_key(shard), set()) for shard in range(self.store.dirty_shards)]
+        self.assertEqual(set().union(*shards), {'cart-%d' % i for i in range(40)})
+        self.assertGreater(sum(1 for shard in shards if shard), 1)
+
+        # Further changes to a dirty cart leave the dirty sets alone.
+        with mock.patch.object(cache, 'set', wraps = cache.set) as set_:
+            self.store._store('cart-0', {product.id: 5})
+        self.assertEqual([call.args[0] for call in set_.call_args_list], ['carts:cart:cart-0'])
+
+        self.assertEqual(self.store.flush(), 40)
+        self.store.add('cart-0', product.id)
+        self.assertEqual(self.store.flush(), 1)
+        self.assertEqual(CartItem.objects.get(cart__cart_id = 'cart-0').quantity, 6)
+        self.assertEqual(self.store.flush(), 0)
+
+
+class CartStoreCheckTests(SimpleTestCase):
+
+    @override_settings(CART_STORE = 'carts.storage.CacheCartStore')
+    def test_cache_store_refuses_a_local_cache(self):
+        self.assertEqual([error.id for error in check_cart_store_cache(None)], ['carts.E001'])
+        with override_settings(CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_cart_store_cache(None), [])
+
+    def test_database_store_needs_no_shared_cache(self):
+        self.assertEqual(check_cart_store_cache(None), [])
+
+
+class LazySessionTests(TestCase):
+
+    def test_browsing_does_not_create_sessions(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        product = make_product(category, 'Blue Shirt')
+
+        for url in ('/', '/store/', product.get_url(), '/cart/', '/cart/remove_cart/%d/' % product.id):
+            self.client.get(url)
+        self.assertFalse(Session.objects.exists())
+
+        self.client.get('/cart/add_cart/%d/' % product.id)
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(self.client.get('/cart/').context['quantity'], 1)
+
+
+class PurgeCartsTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.product = make_product(category, 'Blue Shirt')
+        self.now = timezone.now()
+
+    def cart(self, cart_id, days_old, session_expires_in = None):
+        cart = Cart.objects.create(cart_id = cart_id)
+        day = timezone.localdate(self.now) - datetime.timedelta(days = days_old)
+        Cart.objects.filter(id = cart.id).update(date_added = day, last_active = day)
+        CartItem.objects.create(cart = cart, products = self.product, quantity = 1)
+        if session_expires_in is not None:
+            Session.objects.create(
+                session_key = cart_id, session_data = '',
+                expire_date = self.now + datetime.timedelta(days = session_expires_in),
+            )
+        return cart
+
+    def test_purge(self):
+        for i in range(5):
+            self.cart('abandoned-%d' % i, days_old = 40)
+        self.cart('expired-session', days_old = 40, session_expires_in = -1)
+        self.cart('live-session', days_old = 40, session_expires_in = 1)
+        self.cart('recent', days_old = 2)
+
+        out = io.StringIO()
+        call_command('purge_carts', days = 30, batch_size = 2, dry_run = True, stdout = out)
+        self.assertIn('Carts: would delete 6 rows', out.getvalue())
+        self.assertEqual(Cart.objects.count(), 8)
+
+        out = io.StringIO()
+        call_command('purge_carts', days = 30, batch_size = 2, stdout = out)
+        self.assertIn('Carts: 6 rows', out.getvalue())
+        self.assertIn('(6 items)', out.getvalue())
+        self.assertIn('Expired sessions: 1 rows', out.getvalue())
+        self.assertEqual(sorted(Cart.objects.values_list('cart_id', flat = True)), ['live-session', 'recent'])
+        self.assertEqual(CartItem.objects.count(), 2)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat = True)), ['live-session'])
+
+    @override_settings(SESSION_ENGINE = 'django.contrib.sessions.backends.cache')
+    def test_purge_without_database_sessions(self):
+        self.cart('idle', days_old = 40)
+        active = self.cart('active', days_old = 40)
+        get_cart_store().add('active', self.product.id)
+        self.assertEqual(Cart.objects.get(pk = active.pk).last_active, timezone.localdate())
+
+        call_command('purge_carts', days = 30, stdout = io.StringIO())
+        self.assertEqual(list(Cart.objects.values_list('cart_id', flat = True)), ['active'])
+
+    def test_writes_mark_the_cart_active(self):
+        store = get_cart_store()
+        cart = self.cart('cart', days_old = 40)
+        for write in (
+            lambda: store.apply('cart', {self.product.id: ('set', 2)}),
+            lambda: store.decrement('cart', self.product.id),
+            lambda: store.remove('cart', self.product.id),
+        ):
+            Cart.objects.filter(pk = cart.pk).update(last_active = datetime.date(2000, 1, 1))
+            write()
+            self.assertEqual(Cart.objects.get(pk = cart.pk).last_active, timezone.localdate())
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    """
+    Hammer one cart through the cart views from several threads at once and
+    check that no increment is lost, no duplicate rows appear and the
+    navbar badge agrees with the cart.
+    """
+    threads = 8
+    clicks = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("An in-memory SQLite database cannot be shared between threads.")
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.product = make_product(category, 'Blue Shirt')
+        # One visitor: every thread sends the same session cookie.
+        self.client.get('/cart/add_cart/%d/' % self.product.id)
+        self.cart = Cart.objects.get()
+
+    def click(self, client, url):
+        # No retries: a "database is locked" error would be a 500 for a user.
+        self.assertEqual(client.get(url).status_code, 302)
+
+    def badge(self):
+        return self.client.get('/store/').context['cart_count']
+
+    def run_concurrently(self, url):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker():
+            client = self.client_class()
+            for name, morsel in self.client.cookies.items():
+                client.cookies[name] = morsel.value
+            try:
+                barrier.wait()
+                for _ in range(self.clicks):
+                    self.click(client, url)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target = worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_add_cart(self):
+        self.run_concurrently('/cart/add_cart/%d/' % self.product.id)
+
+        self.assertEqual(Cart.objects.count(), 1)
+        items = CartItem.objects.filter(cart = self.cart)
+        self.assertEqual(items.count(), 1)
+        self.assertEqual(items.get().quantity, self.threads * self.clicks + 1)
+        self.assertEqual(self.badge(), self.threads * self.clicks + 1)
+
+    def test_concurrent_remove_cart(self):
+        total = self.threads * self.clicks
+        CartItem.objects.filter(cart = self.cart).update(quantity = total + 5)
+
+        self.run_concurrently('/cart/remove_cart/%d/' % self.product.id)
+
+        self.assertEqual(CartItem.objects.get(cart = self.cart).quantity, 5)
+        self.assertEqual(self.badge(), 5)
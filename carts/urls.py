@@ -6,4 +6,5 @@ urlpatterns = [
     path("add_cart/<int:product_id>/", views.add_cart, name = 'add_cart'),
     path("remove_cart/<int:product_id>/", views.remove_cart, name='remove_cart'),
     path("remove_cart_item/<int:product_id>/", views.remove_cart_item, name='remove_cart_item'),
+    path("api/", views.cart_api, name = 'cart_api'),
 ]
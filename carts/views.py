@@ -1,36 +1,89 @@
-from django.shortcuts import get_object_or_404, redirect, render
+import json
 
-from carts.models import Cart, CartItem
+from django.http import Http404, JsonResponse
+from django.shortcuts import redirect
+from django.views.decorators.http import require_http_methods
+
+from carts.context_processors import counter
+from carts.storage import get_cart_store
+from shipshop.cache import aget_version, bump_version, get_version
+from shipshop.routers import pin_to_primary
+from shipshop.shortcuts import arender
+from shipshop.timing import query_budget
 from store.models import Product
 
 # Create your views here.
 
-def _cart_id(request):
+def _cart_id(request, create = False):
     """
     Get or create a cart ID for the current session.
     
     This helper function retrieves the session key to use as cart ID.
-    If no session exists, it creates a new one.
+    A new session is only created when ``create`` is set, i.e. on the first
+    cart mutation; read paths get None for visitors without a session and
+    treat that as an empty cart, so browsing never writes a session row.
     
     Args:
         request (HttpRequest): The HTTP request object containing session data
+        create (bool, optional): Create a session if there is none (default: False)
     
     Returns:
-        str: The session key to be used as cart ID
+        str | None: The session key to be used as cart ID, or None if the
+            visitor has no session and ``create`` is False
     """
     cart = request.session.session_key
     
-    if not cart:
-        cart = request.session.create()
+    if not cart and create:
+        request.session.create()
+        cart = request.session.session_key
     
     return cart
 
+def _cart_version(request):
+    """
+    Return the version of the visitor's cart, for use in HTTP validators.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+
+    Returns:
+        int: The cart version, 0 for visitors without a session
+    """
+    cart_id = _cart_id(request)
+    if cart_id is None:
+        return 0
+    return get_version('cart:%s' % cart_id)
+
+async def _acart_version(request):
+    """
+    Async version of ``_cart_version()``.
+    """
+    cart_id = _cart_id(request)
+    if cart_id is None:
+        return 0
+    return await aget_version('cart:%s' % cart_id)
+
+def _cart_changed(request):
+    """
+    Record a cart write: bump the cart version, which also makes the
+    ``counter`` context processor recount the badge, and pin the visitor's
+    reads to the primary database for a few seconds, so they see their
+    change.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+    """
+    bump_version('cart:%s' % _cart_id(request))
+    pin_to_primary(request)
+
+@query_budget(6)
 def remove_cart(request, product_id):
     """
     Remove one quantity of a product from the cart.
     
     This function decreases the quantity of a specific product in the cart by 1.
     If the quantity becomes 0, the cart item is completely removed.
+    Removing a product that is not in the cart does nothing.
     
     Args:
         request (HttpRequest): The HTTP request object
@@ -38,27 +91,23 @@ def remove_cart(request, product_id):
     
     Returns:
         HttpResponseRedirect: Redirects to the cart page after removal
-    
-    Raises:
-        Http404: If the product with given ID doesn't exist
     """
-    cart = Cart.objects.get(cart_id = _cart_id(request))
-    product = get_object_or_404(Product, id = product_id)
-    cart_item = CartItem.objects.get(products = product, cart = cart)
+    cart_id = _cart_id(request)
+    if cart_id is None:
+        return redirect('cart')
 
-    if cart_item.quantity > 1:
-        cart_item.quantity -= 1
-        cart_item.save()
-    else:
-        cart_item.delete()
+    if get_cart_store().decrement(cart_id, product_id):
+        _cart_changed(request)
     return redirect('cart')
     
+@query_budget(6)
 def remove_cart_item(request, product_id):
     """
     Completely remove a product from the cart.
     
     This function removes all quantities of a specific product from the cart,
-    regardless of how many items were in the cart.
+    regardless of how many items were in the cart. Removing a product that
+    is not in the cart does nothing.
     
     Args:
         request (HttpRequest): The HTTP request object
@@ -66,26 +115,27 @@ def remove_cart_item(request, product_id):
     
     Returns:
         HttpResponseRedirect: Redirects to the cart page after removal
-    
-    Raises:
-        Http404: If the product with given ID doesn't exist
     """
-    cart = Cart.objects.get(cart_id = _cart_id(request))
-    product = get_object_or_404(Product, id = product_id)
-    cart_item = CartItem.objects.get(products = product, cart = cart)
+    cart_id = _cart_id(request)
+    if cart_id is None:
+        return redirect('cart')
 
-    cart_item.delete()
+    if get_cart_store().remove(cart_id, product_id):
+        _cart_changed(request)
     
     return redirect('cart')
     
 
+@query_budget(8)
 def add_cart(request, product_id):
     """
     Add a product to the cart or increase its quantity if already present.
     
     This function adds a product to the user's cart. If the product is already
     in the cart, it increases the quantity by 1. If not, it creates a new
-    cart item with quantity 1.
+    cart item with quantity 1. The change goes through the configured cart
+    store (see ``carts.storage``), whose increment-or-insert is atomic, so
+    concurrent clicks never lose an increment or create duplicate items.
     
     Args:
         request (HttpRequest): The HTTP request object
@@ -95,39 +145,25 @@ def add_cart(request, product_id):
         HttpResponseRedirect: Redirects to the cart page after adding
     
     Raises:
-        Product.DoesNotExist: If the product with given ID doesn't exist
+        Http404: If the product with given ID doesn't exist
     """
-    product = Product.objects.get(id = product_id) # get the productusing product_id
-
-    try:
-        cart = Cart.objects.get(cart_id = _cart_id(request)) # get the cart using Cart_id
-    except Cart.DoesNotExist:
-        cart = Cart.objects.create(
-            cart_id = _cart_id(request)
-        )
+    if not Product.objects.filter(id = product_id).exists():
+        raise Http404("No Product matches the given query.")
 
-    cart.save()
-
-    try:
-        cart_item =  CartItem.objects.get(products = product, cart = cart)
-        cart_item.quantity += 1
-    except CartItem.DoesNotExist:
-        cart_item  = CartItem.objects.create(
-            products = product,
-            quantity = 1,
-            cart = cart,
-        )
-    
-    cart_item.save()
+    get_cart_store().add(_cart_id(request, create = True), product_id)
+    _cart_changed(request)
 
     return redirect('cart')
 
-def cart(request, total = 0, quantity = 0, cart_items = None):
+@query_budget(7)
+async def cart(request, total = 0, quantity = 0, cart_items = None):
     """
     Display the shopping cart with calculated totals.
     
     This view retrieves all active cart items for the current session and
     calculates the total price, quantity, tax (5%), and grand total.
+    Items, their products and categories are read from the cart store in a
+    constant number of queries, whatever the size of the cart.
     
     Args:
         request (HttpRequest): The HTTP request object
@@ -141,24 +177,20 @@ def cart(request, total = 0, quantity = 0, cart_items = None):
     Context:
         total (int): Subtotal of all cart items
         quantity (int): Total number of items in cart
-        cart_items (QuerySet): All active cart items
+        cart_items (list): All active cart items
         tax (float): Calculated tax amount (5% of total)
         grand_total (float): Total amount including tax
     """
-    try:
-        tax = grand_total = 0
-        cart = Cart.objects.get(cart_id = _cart_id(request))
-        cart_items = CartItem.objects.filter(cart = cart, is_active = True)
+    cart_id = _cart_id(request)
+    if cart_id is not None:
+        store = get_cart_store()
+        cart_items = await store.aitems(cart_id)
+        totals = await store.atotals(cart_id, cart_items)
+        total += totals['total']
+        quantity += totals['quantity']
 
-        for cart_item in cart_items:
-            total += (cart_item.products.price * cart_item.quantity)
-            quantity += cart_item.quantity
-        
-        tax = (5 * total)/100
-        grand_total = total + tax
-
-    except CartItem.DoesNotExist:
-        pass
+    tax = (5 * total)/100
+    grand_total = total + tax
     
     context = {
         'total': total,
@@ -169,4 +201,134 @@ def cart(request, total = 0, quantity = 0, cart_items = None):
 
     }
 
-    return render(request, "store/cart.html", context)
\ No newline at end of file
+    return await arender(request, "store/cart.html", context)
+
+
+# Most changes a single cart API request may make.
+CART_API_MAX_CHANGES = 100
+# Largest quantity a single cart API change may name.
+CART_API_MAX_QUANTITY = 999
+
+def _parse_changes(data):
+    """
+    Fold the changes posted to ``cart_api`` into one change per product.
+
+    Changes apply in order, so ``add`` after ``set`` adds to the new
+    quantity and ``remove`` is a ``set`` to zero. ``add`` and ``decrement``
+    stay relative, an ``add`` of a negative quantity for a decrement, so
+    they combine with concurrent changes instead of overwriting them.
+
+    Args:
+        data: The decoded JSON request body
+
+    Returns:
+        dict: ``{product_id: (action, quantity)}`` for ``CartStore.apply()``
+
+    Raises:
+        ValueError: If the body is not a list of valid changes
+    """
+    changes = data.get('changes') if isinstance(data, dict) else None
+    if not isinstance(changes, list):
+        raise ValueError("Expected {\"changes\": [...]}.")
+    if len(changes) > CART_API_MAX_CHANGES:
+        raise ValueError("At most %d changes per request." % CART_API_MAX_CHANGES)
+
+    folded = {}
+    for change in changes:
+        if not isinstance(change, dict):
+            raise ValueError("Each change must be an object.")
+        action, product_id, quantity = change.get('action'), change.get('product'), change.get('quantity', 1)
+        if action == 'remove':
+            quantity = 0
+        if action not in ('add', 'decrement', 'set', 'remove'):
+            raise ValueError("Unknown action %r." % action)
+        if type(product_id) is not int or type(quantity) is not int:
+            raise ValueError("Products and quantities must be integers.")
+        if not (1 if action in ('add', 'decrement') else 0) <= quantity <= CART_API_MAX_QUANTITY:
+            raise ValueError("Invalid quantity %d for %s." % (quantity, action))
+
+        previous = folded.get(product_id)
+        if action in ('set', 'remove'):
+            folded[product_id] = ('set', quantity)
+            continue
+        if action == 'decrement':
+            quantity = -quantity
+        if previous is None:
+            folded[product_id] = ('add', quantity)
+        elif previous[0] == 'add':
+            folded[product_id] = ('add', previous[1] + quantity)
+        else:
+            folded[product_id] = ('set', max(previous[1] + quantity, 0))
+    return folded
+
+def _cart_summary(request):
+    """
+    Return the visitor's cart lines, totals and badge count for ``cart_api``.
+    """
+    items = []
+    cart_id = _cart_id(request)
+    if cart_id is not None:
+        items = get_cart_store().items(cart_id)
+    total = sum(item.sub_total() for item in items)
+    tax = (5 * total)/100
+    return {
+        'items': [
+            {
+                'product': item.products.id,
+                'name': item.products.product_name,
+                'url': item.products.get_url(),
+                'price': item.products.price,
+                'quantity': item.quantity,
+                'line_total': item.sub_total(),
+            }
+            for item in items
+        ],
+        'total': total,
+        'quantity': sum(item.quantity for item in items),
+        'tax': tax,
+        'grand_total': total + tax,
+        'cart_count': counter(request).get('cart_count', 0),
+    }
+
+@query_budget(14)
+@require_http_methods(['GET', 'POST'])
+def cart_api(request):
+    """
+    Read or change the cart as JSON, for updating the page in place.
+
+    A POST applies a batch of changes in one transaction and answers with
+    the updated cart, so changing several lines costs one request and no
+    page render. The body is ``{"changes": [...]}``, each change being
+    ``{"action": "add" | "decrement" | "set" | "remove", "product": id,
+    "quantity": n}`` (``quantity`` defaults to 1, and may not exceed
+    ``CART_API_MAX_QUANTITY``). Decrementing or removing a product that is
+    not in the cart does nothing.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+
+    Returns:
+        JsonResponse: ``items`` (``product``, ``name``, ``url``, ``price``,
+            ``quantity``, ``line_total``), ``total``, ``quantity``, ``tax``,
+            ``grand_total`` and ``cart_count``, the navbar badge count; or
+            an ``error`` with status 400 for an invalid body or unknown
+            products
+    """
+    if request.method == 'POST':
+        try:
+            changes = _parse_changes(json.loads(request.body))
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status = 400)
+
+        wanted = [product_id for product_id, (_, quantity) in changes.items() if quantity > 0]
+        existing = set(Product.objects.filter(id__in = wanted).values_list('id', flat = True))
+        missing = sorted(set(wanted) - existing)
+        if missing:
+            return JsonResponse({'error': "Unknown products: %s." % ', '.join(map(str, missing))}, status = 400)
+
+        cart_id = _cart_id(request, create = bool(wanted))
+        if changes and cart_id is not None:
+            get_cart_store().apply(cart_id, changes)
+            _cart_changed(request)
+
+    return JsonResponse(_cart_summary(request))
@@ -1,6 +1,47 @@
+from django.core.cache import cache
+
+from shipshop.cache import aversioned_key, versioned_key
+from shipshop.routers import primary_reads
 from .models import Category
 
+MENU_CACHE_TIMEOUT = 60 * 60
+
+
+def get_menu_links():
+    """
+    Return all categories for the navigation menu.
+
+    The list is cached under the ``category`` version, which the signal
+    handlers in ``category.signals`` bump whenever a Category changes, so a
+    warm cache serves the menu without touching the database. A miss reads
+    the primary, which already has the change that bumped the version.
+
+    Returns:
+        list: All Category instances
+    """
+    key = versioned_key('category', 'menu')
+    links = cache.get(key)
+    if links is None:
+        with primary_reads():
+            links = list(Category.objects.all())
+        cache.set(key, links, MENU_CACHE_TIMEOUT)
+    return links
+
+async def aget_menu_links():
+    """
+    Async version of ``get_menu_links()``.
+
+    Async views await it before rendering so that ``menu_links`` finds the
+    menu in the cache and runs no query inside the event loop.
+    """
+    key = await aversioned_key('category', 'menu')
+    links = await cache.aget(key)
+    if links is None:
+        with primary_reads():
+            links = [category async for category in Category.objects.all()]
+        await cache.aset(key, links, MENU_CACHE_TIMEOUT)
+    return links
+
 # we can use this in all the templates 
 def menu_links(request):
-    links = Category.objects.all()
-    return dict(links = links)
+    return dict(links = get_menu_links())
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:59
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_products(apps, schema_editor):
+    Category = apps.get_model('category', 'Category')
+    counts = Category.objects.annotate(
+        products = Count('product'),
+        available = Count('product', filter = Q(product__is_available = True)),
+    ).values_list('id', 'products', 'available')
+    for category_id, products, available in counts:
+        Category.objects.filter(pk = category_id).update(product_count = products, available_count = available)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('category', '0002_alter_category_slug'),
+        ('store', '0005_listing_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='available_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
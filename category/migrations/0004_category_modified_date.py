@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('category', '0003_category_product_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='modified_date',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -7,6 +7,11 @@ class Category(models.Model):
     slug = models.SlugField(max_length=100, unique=True)
     description = models.TextField(max_length=255, blank=True)
     cat_image = models.ImageField(upload_to= 'photos/categories', blank=True)
+    # Maintained by store.counters; `manage.py reconcile_category_counts` repairs drift.
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    available_count = models.PositiveIntegerField(default=0, editable=False)
+    # Part of the product feed's ETag and Last-Modified (see store.feeds).
+    modified_date = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = ''
@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shipshop.cache import bump_version
+from store.images import schedule_derivatives
+from .models import Category
+
+
+@receiver(post_save, sender = Category)
+def category_saved(sender, instance, using, **kwargs):
+    """
+    Render the pre-sized derivatives of the category image.
+    """
+    schedule_derivatives(instance.cat_image, using = using)
+
+
+@receiver(post_save, sender = Category)
+@receiver(post_delete, sender = Category)
+def category_changed(sender, using, **kwargs):
+    """
+    Invalidate cached category data such as the navigation menu.
+    """
+    transaction.on_commit(lambda: bump_version('category'), using = using)
@@ -1,3 +1,62 @@
+from django.core.cache import cache, caches
 from django.test import TestCase
 
+from shipshop import cache as versions
+from .context_processor import get_menu_links
+from .models import Category
+
 # Create your tests here.
+
+
+class CacheVersionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_is_seen_by_other_cache_clients(self):
+        other = caches.create_connection('default')
+        version = versions.get_version('category')
+        key = versions.versioned_key('category', 'menu')
+        self.assertEqual(versions.bump_version('category'), version + 1)
+        self.assertEqual(other.get(versions._version_key('category')), version + 1)
+        self.assertNotEqual(versions.versioned_key('category', 'menu'), key)
+
+    def test_lost_version_never_repeats(self):
+        seen = {versions.get_version('category')}
+        for _ in range(3):
+            seen.add(versions.bump_version('category'))
+        cache.delete(versions._version_key('category'))
+        self.assertGreater(versions.get_version('category'), max(seen))
+
+        seen.add(versions.get_version('category'))
+        cache.delete(versions._version_key('category'))
+        self.assertGreater(versions.bump_version('category'), max(seen))
+
+    async def test_async_versions(self):
+        version = await versions.aget_version('catalog')
+        self.assertEqual(versions.get_version('catalog'), version)
+        versions.bump_version('catalog')
+        self.assertEqual(await versions.aversioned_key('catalog', 'x'), 'catalog:x:v%d' % (version + 1))
+
+
+class MenuCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+
+    def menu(self):
+        return [category.slug for category in self.client.get('/').context['links']]
+
+    def test_menu_is_cached_until_categories_change(self):
+        self.assertEqual(self.menu(), ['shirts'])
+        with self.assertNumQueries(0):
+            get_menu_links()
+
+        with self.captureOnCommitCallbacks(execute = True):
+            Category.objects.create(category_name = 'Jeans', slug = 'jeans')
+        self.assertEqual(self.menu(), ['shirts', 'jeans'])
+
+        with self.captureOnCommitCallbacks(execute = True):
+            Category.objects.get(slug = 'shirts').delete()
+        self.assertEqual(self.menu(), ['jeans'])
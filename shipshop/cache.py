@@ -0,0 +1,134 @@
+"""
+Version stamps for cached data.
+
+Cached values are stored under keys that embed a namespace version, e.g.
+``category:menu:v3``. Bumping the version on write makes every key of the
+namespace miss at once, without having to know or delete them individually;
+stale entries simply age out of the cache.
+
+A version key that is missing (first use, eviction, cache restart) is
+seeded from the clock rather than restarted at 1, so a namespace never
+hands out a version it has issued before: old entries such as
+``category:menu:v3`` or ETags built from an old version cannot come back.
+
+The versions only invalidate anything if every process reads the same
+cache; see ``CACHES`` in the settings.
+
+``bump_version`` also notes when it ran, so ``bumped_within`` can tell
+whether a namespace changed in the last few seconds (see
+``shipshop.routers``).
+
+The ``a``-prefixed functions are the versions for async views.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def _version_key(namespace):
+    return 'version:%s' % namespace
+
+
+def _bumped_key(namespace):
+    return 'version:%s:bumped' % namespace
+
+
+# How long bump times are remembered; longer than any useful window.
+BUMPED_TIMEOUT = 60 * 60
+
+
+def _initial_version():
+    # Microseconds since the epoch: larger than any version reached by
+    # incrementing an earlier seed, unless it was bumped more than a
+    # million times a second.
+    return time.time_ns() // 1000
+
+
+def get_version(namespace):
+    """
+    Return the current version of a cache namespace.
+
+    Args:
+        namespace (str): Name of the cached data set, e.g. ``'category'``
+
+    Returns:
+        int: The namespace version
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = _initial_version()
+        cache.add(key, version, timeout = None)
+        version = cache.get(key, version)
+    return version
+
+
+async def aget_version(namespace):
+    """
+    Async version of ``get_version()``.
+    """
+    key = _version_key(namespace)
+    version = await cache.aget(key)
+    if version is None:
+        version = _initial_version()
+        await cache.aadd(key, version, timeout = None)
+        version = await cache.aget(key, version)
+    return version
+
+
+def bump_version(namespace):
+    """
+    Invalidate every cached value of a namespace.
+
+    Args:
+        namespace (str): Name of the cached data set
+
+    Returns:
+        int: The new namespace version
+    """
+    key = _version_key(namespace)
+    cache.set(_bumped_key(namespace), time.time(), BUMPED_TIMEOUT)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Nothing to invalidate: any fresh seed is a version never used.
+        version = _initial_version()
+        cache.add(key, version, timeout = None)
+        return cache.get(key, version)
+
+
+def bumped_within(namespaces, seconds):
+    """
+    Return whether any of the namespaces was bumped in the last ``seconds``.
+
+    Args:
+        namespaces (iterable): Names of cached data sets
+        seconds (float): Length of the window
+
+    Returns:
+        bool: True if a version changed within the window
+    """
+    bumped = cache.get_many([_bumped_key(namespace) for namespace in namespaces])
+    return any(at > time.time() - seconds for at in bumped.values())
+
+
+async def abumped_within(namespaces, seconds):
+    """
+    Async version of ``bumped_within()``.
+    """
+    bumped = await cache.aget_many([_bumped_key(namespace) for namespace in namespaces])
+    return any(at > time.time() - seconds for at in bumped.values())
+
+
+def versioned_key(namespace, name):
+    """
+    Return the cache key for ``name`` under the namespace's current version.
+    """
+    return '%s:%s:v%s' % (namespace, name, get_version(namespace))
+
+
+async def aversioned_key(namespace, name):
+    """
+    Async version of ``versioned_key()``.
+    """
+    return '%s:%s:v%s' % (namespace, name, await aget_version(namespace))
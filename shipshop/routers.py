@@ -0,0 +1,185 @@
+"""
+Read replica routing.
+
+``ReplicaRouter`` sends reads of the catalog apps (``store``, ``category``)
+to one of the aliases in ``settings.DATABASE_REPLICAS``, picked at random,
+and everything else, carts, accounts, sessions and every write, to
+``default``.
+
+Replicas lag behind the primary. A visitor who just changed their cart, or
+made any other successful non-GET request such as an admin save, is pinned
+to the primary for ``settings.REPLICA_PIN_SECONDS``: ``pin_to_primary``
+stores a deadline in their session, and ``ReplicaPinMiddleware`` routes all
+of their reads to ``default`` until it passes. Non-GET requests and reads
+inside a transaction on the primary never use a replica either.
+
+Writes bump cache versions (see ``shipshop.cache``) as soon as they commit,
+before the replicas have them. Whatever is stored under a version must not
+be read from a lagging replica, or it stays stale until the next bump:
+
+* values filled into the cache on a miss are read inside ``primary_reads()``;
+* pages whose ETag is built from versions call ``apin_after_bump()`` first,
+  which pins the request while those versions changed recently.
+
+Locally, ``SHIPSHOP_SQLITE_REPLICAS=N`` configures N SQLite file copies of
+the database, refreshed with ``manage.py sync_replicas``.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shipshop.cache import abumped_within
+
+CATALOG_APPS = {'store', 'category'}
+PIN_SESSION_KEY = '_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_pinned = ContextVar('replica_pinned', default = False)
+
+
+def pin_to_primary(request):
+    """
+    Route the visitor's reads to the primary for ``REPLICA_PIN_SECONDS``,
+    starting with the rest of this request, so they see their own writes.
+
+    Args:
+        request (HttpRequest): The HTTP request that wrote to the primary
+    """
+    if not settings.DATABASE_REPLICAS:
+        return
+    _pinned.set(True)
+    request.session[PIN_SESSION_KEY] = time.time() + settings.REPLICA_PIN_SECONDS
+
+
+async def apin_to_primary(request):
+    """
+    Async version of ``pin_to_primary()``.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return
+    _pinned.set(True)
+    await request.session.aset(PIN_SESSION_KEY, time.time() + settings.REPLICA_PIN_SECONDS)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Route the reads made inside the block to the primary.
+
+    Use it to fill a cache under a version that a write may just have
+    bumped, so the value stored is the committed state.
+    """
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+async def apin_after_bump(*namespaces):
+    """
+    Route the rest of this request's reads to the primary if any of the
+    cache namespaces was bumped within ``REPLICA_PIN_SECONDS``.
+
+    Call it from an async view, or the coroutine it awaits, before reading
+    data whose ETag or cache entry carries those versions.
+
+    Args:
+        namespaces (str): Cache namespaces, e.g. ``'catalog'``
+    """
+    if settings.DATABASE_REPLICAS and await abumped_within(namespaces, settings.REPLICA_PIN_SECONDS):
+        _pinned.set(True)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or model._meta.app_label not in CATALOG_APPS or _pinned.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Read-modify-write on the primary: read what it holds.
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in replicas:
+            # Related objects come from the replica the instance came from.
+            return instance._state.db
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name = None, **hints):
+        # Replicas get the schema by copying the primary.
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinMiddleware:
+    """
+    Pin the reads of a request to the primary when it writes, or when the
+    visitor's session is pinned by ``pin_to_primary``.
+
+    A successful write pins the session too, so the page it redirects to
+    reads the primary. Must come after ``SessionMiddleware``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        writes = request.method not in SAFE_METHODS
+        token = _pinned.set(writes or self.is_pinned(request))
+        try:
+            response = self.get_response(request)
+            if writes and response.status_code < 400:
+                pin_to_primary(request)
+        finally:
+            _pinned.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        writes = request.method not in SAFE_METHODS
+        token = _pinned.set(writes or await self.ais_pinned(request))
+        try:
+            response = await self.get_response(request)
+            if writes and response.status_code < 400:
+                await apin_to_primary(request)
+        finally:
+            _pinned.reset(token)
+        return response
+
+    def is_pinned(self, request):
+        # Visitors without a session cookie cannot be pinned; don't load one.
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return False
+        return request.session.get(PIN_SESSION_KEY, 0) > time.time()
+
+    async def ais_pinned(self, request):
+        """
+        Async version of ``is_pinned()``.
+        """
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return False
+        return await request.session.aget(PIN_SESSION_KEY, 0) > time.time()
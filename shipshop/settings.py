@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,8 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shipshop.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'shipshop.routers.ReplicaPinMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -57,7 +60,8 @@ ROOT_URLCONF = 'shipshop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render times to shipshop.timing.
+        'BACKEND': 'shipshop.timing.TimedDjangoTemplates',
         'DIRS': ['templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -84,9 +88,69 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Concurrent writers wait for each other instead of failing with
+        # "database is locked": transactions take the write lock when they
+        # start, so none has to upgrade a read lock (which SQLite refuses
+        # without waiting), and a blocked writer waits up to 20 seconds.
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # A file-backed test database lets tests open several connections
+        # at once (see the concurrent cart tests).
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Catalog reads go to the read replicas listed here (see shipshop.routers).
+# SHIPSHOP_SQLITE_REPLICAS=N adds N local file copies of the database, kept
+# up to date with "manage.py sync_replicas"; tests read them from default.
+DATABASE_REPLICAS = []
+for number in range(1, int(os.environ.get('SHIPSHOP_SQLITE_REPLICAS', 0)) + 1):
+    DATABASES['replica%d' % number] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / ('db.replica%d.sqlite3' % number),
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+    DATABASE_REPLICAS.append('replica%d' % number)
+
+DATABASE_ROUTERS = ['shipshop.routers.ReplicaRouter']
+
+# How long a visitor's reads stay on the primary after a cart change, so
+# they see it whatever the replication lag.
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# The cache holds the version stamps that invalidate cached pages, menus and
+# ETags (shipshop.cache), the cached sessions and, with CacheCartStore, the
+# carts themselves. Every worker process and management command must see the
+# same cache, so production needs a shared backend: set SHIPSHOP_REDIS_URL
+# (e.g. redis://localhost:6379/0). The local-memory fallback is per process
+# and only fit for a single development server and the tests.
+if os.environ.get('SHIPSHOP_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['SHIPSHOP_REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Sessions are read on every page (cart badge); serve them from the cache
+# and only fall back to the database on a miss.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,11 +191,78 @@ STATIC_ROOT = BASE_DIR / 'static'
 STATICFILES_DIRS = [
     'shipshop/static',
 ]
+# collectstatic writes content-hashed copies plus .gz/.br variants (brotli
+# when the package is installed); shipshop.staticfiles serves them with
+# immutable caching.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'shipshop.staticfiles.CompressedManifestStaticFilesStorage'},
+}
 
 # Media (user-uploaded files like ImageField)
 MEDIA_URL = '/media/'
 # Point to project root so existing 'photos/' works: /media/photos/... maps to BASE_DIR/photos/...
 MEDIA_ROOT = BASE_DIR
+# Top-level directories of MEDIA_ROOT served under MEDIA_URL; the rest of
+# the project root never is.
+MEDIA_PUBLIC_DIRS = ['photos', 'derivatives']
+# Uploads keep their names when replaced, so they are cached for a day only.
+MEDIA_CACHE_MAX_AGE = 86400
+
+# Anonymous carts
+# carts.storage.DatabaseCartStore writes every change straight to the cart
+# tables; carts.storage.CacheCartStore keeps carts in CART_STORE_CACHE and
+# writes them behind with `manage.py flush_carts`. The cache store needs a
+# shared cache such as Redis (see CACHES); the carts.E001 check refuses to
+# start with a per-process one. Pair the cache store with the 'cache' or
+# 'signed_cookies' session engine to keep the add/remove path entirely off
+# the database.
+CART_STORE = 'carts.storage.DatabaseCartStore'
+CART_STORE_CACHE = 'default'
+# Days without a change after which `manage.py purge_carts` deletes a cart
+# (unless, with a database session engine, its session is still live).
+CART_TTL_DAYS = 30
+
+# Store listings
+# Page with opaque ?after=/?before= cursor tokens instead of ?page= numbers.
+STORE_CURSOR_PAGINATION = False
+# Seconds a listing's "N items found" total may be served from the cache.
+STORE_COUNT_CACHE_TIMEOUT = 60
+# Products fetched and rendered at a time by the /store/feed.xml and
+# /store/feed.csv streams (see store.feeds).
+PRODUCT_FEED_CHUNK_SIZE = 1000
+
+# Home page "Popular products" (see store.popularity).
+POPULAR_PRODUCTS_LIMIT = 8
+POPULAR_PRODUCTS_DAYS = 30
+
+# Pre-sized copies of product and category photos (see store.images).
+IMAGE_DERIVATIVE_WIDTHS = [160, 320, 640, 1024]
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# Per-request instrumentation (see shipshop.timing). When enabled, every
+# response carries a Server-Timing header with the query count, DB,
+# template and context processor times, and a line is logged per request.
+REQUEST_TIMING = False
+# Raise instead of logging a warning when a view exceeds its @query_budget.
+QUERY_BUDGET_STRICT = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'shipshop.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -0,0 +1,27 @@
+import asyncio
+
+from django.shortcuts import render
+
+from carts.context_processors import acounter
+from category.context_processor import aget_menu_links
+
+
+async def arender(request, template_name, context = None):
+    """
+    Render a template from an async view.
+
+    Django templates render synchronously, and the ``menu_links`` and
+    ``counter`` context processors read the database on a cold cache or an
+    unloaded session. Their data is loaded first with the async APIs, so
+    the render itself runs no query and needs no thread.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+        template_name (str): The template to render
+        context (dict, optional): The template context
+
+    Returns:
+        HttpResponse: The rendered page
+    """
+    await asyncio.gather(aget_menu_links(), acounter(request))
+    return render(request, template_name, context)
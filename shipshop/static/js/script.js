@@ -46,6 +46,79 @@ $(document).ready(function() {
 
 
 
+	//////////////////////// Search box suggestions
+    var suggestionUrls = {};
+    var suggestionTimer = null;
+    $('[data-autocomplete-url]').on('input', function (event) {
+        var input = $(this);
+        var value = input.val();
+        // Typing and pasting set inputType; picking a datalist option sets
+        // insertReplacementText, or no inputType at all in some browsers.
+        var inputType = event.originalEvent && event.originalEvent.inputType;
+        var picked = !inputType || inputType === 'insertReplacementText';
+        if (picked && suggestionUrls[value]) {
+            // A suggestion was picked: go straight to its page.
+            window.location = suggestionUrls[value];
+            return;
+        }
+        clearTimeout(suggestionTimer);
+        suggestionTimer = setTimeout(function () {
+            $.getJSON(input.data('autocomplete-url'), {q: value}, function (data) {
+                var list = $('#' + input.attr('list')).empty();
+                suggestionUrls = {};
+                $.each(data.results, function (i, result) {
+                    suggestionUrls[result.name] = result.url;
+                    list.append($('<option>').attr('value', result.name));
+                });
+            });
+        }, 150);
+    });
+
+
+    //////////////////////// Cart changes in place
+    // The +, - and Remove links go through the JSON cart API; the links
+    // themselves still work without JavaScript or if the API call fails.
+    var cartApi = $('[data-cart-api]');
+    cartApi.on('click', '[data-cart-action]', function (event) {
+        var link = $(this);
+        var row = link.closest('[data-cart-product]');
+        var product = row.data('cart-product');
+        var change = {add: {action: 'add', product: product},
+                      decrement: {action: 'decrement', product: product},
+                      remove: {action: 'remove', product: product}}[link.data('cart-action')];
+        event.preventDefault();
+        $.ajax({
+            url: cartApi.data('cart-api'),
+            method: 'POST',
+            contentType: 'application/json',
+            headers: {'X-CSRFToken': cartApi.data('csrf-token')},
+            data: JSON.stringify({changes: [change]})
+        }).done(function (cart) {
+            if (!cart.items.length) {
+                window.location.reload();
+                return;
+            }
+            var lines = {};
+            $.each(cart.items, function (i, item) { lines[item.product] = item; });
+            cartApi.find('[data-cart-product]').each(function () {
+                var line = lines[$(this).data('cart-product')];
+                if (!line) {
+                    $(this).remove();
+                    return;
+                }
+                $(this).find('[data-cart-quantity]').val(line.quantity);
+                $(this).find('[data-cart-line-total]').text('$' + line.line_total);
+            });
+            $.each(['total', 'tax', 'grand_total'], function (i, name) {
+                cartApi.find('[data-cart-total="' + name + '"]').text('$' + cart[name]);
+            });
+            $('[data-cart-count]').text(cart.cart_count);
+        }).fail(function () {
+            window.location = link.attr('href');
+        });
+    });
+
+
 	//////////////////////// Bootstrap tooltip
 	if($('[data-toggle="tooltip"]').length>0) {  // check if element exists
 		$('[data-toggle="tooltip"]').tooltip()
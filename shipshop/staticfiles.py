@@ -0,0 +1,237 @@
+"""
+Hashed, precompressed static files and the in-process file server.
+
+``collectstatic`` stores every asset under a content-hashed name
+(``css/ui.3f1c0a2b9d4e.css``) through ``CompressedManifestStaticFilesStorage``
+and writes ``.gz`` and, when the ``brotli`` package is installed, ``.br``
+copies of the compressible ones next to it. A hashed name never changes
+content, so ``serve_static`` sends it with a far-future ``immutable``
+``Cache-Control``; other names are revalidated with ``Last-Modified``.
+
+``serve_static`` and ``serve_media`` answer with ``FileResponse``, which
+WSGI servers hand to ``wsgi.file_wrapper`` (``sendfile()`` under gunicorn
+and uWSGI), and pick the smallest precompressed variant the client accepts.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Text formats worth compressing; images and fonts other than the legacy
+# ones are compressed already.
+COMPRESSIBLE = {'.css', '.js', '.map', '.svg', '.html', '.txt', '.json', '.xml', '.ico', '.ttf', '.otf', '.eot'}
+# A variant is only kept if it saves at least this fraction of the file.
+MIN_SAVING = 0.05
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# (Accept-Encoding token, file suffix, Content-Encoding), preferred first.
+ENCODINGS = (
+    ('br', '.br', 'br'),
+    ('gzip', '.gz', 'gzip'),
+)
+
+
+def _compress_gzip(content):
+    return gzip.compress(content, compresslevel = 9, mtime = 0)
+
+
+def _compress_brotli(content):
+    return brotli.compress(content, quality = 11)
+
+
+def compressors():
+    """
+    Return ``(file suffix, compress function)`` for every available encoding.
+    """
+    available = [('.gz', _compress_gzip)]
+    if brotli is not None:
+        available.insert(0, ('.br', _compress_brotli))
+    return available
+
+
+def write_compressed(path):
+    """
+    Write the precompressed variants of one file next to it.
+
+    Variants that do not shrink the file by ``MIN_SAVING`` are not written,
+    and stale ones are removed, so the server never picks a bigger file.
+
+    Returns:
+        int: Number of variants written
+    """
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE:
+        return 0
+    with open(path, 'rb') as source:
+        content = source.read()
+    written = 0
+    for suffix, compress in compressors():
+        compressed = compress(content)
+        if len(compressed) <= len(content) * (1 - MIN_SAVING):
+            with open(path + suffix, 'wb') as target:
+                target.write(compressed)
+            written += 1
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ``ManifestStaticFilesStorage`` that also precompresses what it collects.
+    """
+
+    def stored_name(self, name):
+        # Until the first collectstatic there is no manifest to look names
+        # up in; serve the plain names instead of failing every page.
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def url_converter(self, name, hashed_files, template = None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def tolerant(matchobj):
+            # Vendor stylesheets reference images and source maps that are
+            # not shipped; leave those references as they are.
+            try:
+                return converter(matchobj)
+            except ValueError:
+                return matchobj.group(0)
+        return tolerant
+
+    def post_process(self, paths, dry_run = False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if self.exists(name):
+                write_compressed(self.path(name))
+
+    def is_hashed(self, name):
+        """
+        Return True if ``name`` is a content-hashed name from the manifest.
+        """
+        if not hasattr(self, '_hashed_names'):
+            self._hashed_names = set(self.hashed_files.values())
+        return name in self._hashed_names
+
+
+def _accepted(request):
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = part.strip().partition(';')
+        if not re.search(r'q=0(\.0*)?\s*$', params):
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def file_response(request, fullpath, cache_control):
+    """
+    Serve a file, or its best precompressed variant the client accepts.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+        fullpath (str): Absolute path of the uncompressed file
+        cache_control (str): ``Cache-Control`` header value
+
+    Returns:
+        FileResponse | HttpResponseNotModified: The file, or 304 if the
+            client's copy is current
+    """
+    try:
+        stat = os.stat(fullpath)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("File not found.")
+    if not os.path.isfile(fullpath):
+        raise Http404("File not found.")
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        response = HttpResponseNotModified()
+        response['Cache-Control'] = cache_control
+        return response
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    path, encoding = fullpath, None
+    accepted = _accepted(request)
+    for token, suffix, content_encoding in ENCODINGS:
+        if token in accepted and os.path.exists(fullpath + suffix):
+            path, encoding = fullpath + suffix, content_encoding
+            break
+
+    response = FileResponse(open(path, 'rb'), content_type = content_type or 'application/octet-stream')
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if any(os.path.exists(fullpath + suffix) for _, suffix, _ in ENCODINGS):
+        patch_vary_headers(response, ['Accept-Encoding'])
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def serve_static(request, path):
+    """
+    Serve a collected static file from ``STATIC_ROOT``.
+
+    Content-hashed names are cached for a year as ``immutable``; anything
+    else must be revalidated. Files not collected yet are looked up with the
+    staticfiles finders when ``DEBUG`` is on.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+        path (str): Path of the file below ``STATIC_URL``
+
+    Returns:
+        FileResponse: The file
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except ValueError:
+        raise Http404("File not found.")
+    if not os.path.exists(fullpath) and settings.DEBUG:
+        fullpath = finders.find(path) or fullpath
+    if isinstance(staticfiles_storage, CompressedManifestStaticFilesStorage) and staticfiles_storage.is_hashed(path):
+        cache_control = IMMUTABLE
+    else:
+        cache_control = 'public, max-age=0, must-revalidate'
+    return file_response(request, fullpath, cache_control)
+
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file from ``MEDIA_ROOT``.
+
+    Only the directories listed in ``settings.MEDIA_PUBLIC_DIRS`` are
+    served: ``MEDIA_ROOT`` is the project root, which also holds the code
+    and the database.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+        path (str): Path of the file below ``MEDIA_URL``
+
+    Returns:
+        FileResponse: The file
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    if path.split('/', 1)[0] not in settings.MEDIA_PUBLIC_DIRS:
+        raise Http404("File not found.")
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except ValueError:
+        raise Http404("File not found.")
+    return file_response(request, fullpath, 'public, max-age=%d' % settings.MEDIA_CACHE_MAX_AGE)
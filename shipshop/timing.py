@@ -0,0 +1,292 @@
+"""
+Per-request SQL and rendering instrumentation.
+
+``TimingMiddleware`` measures every request it sees:
+
+* the number of SQL queries and the time spent executing them, on every
+  database alias;
+* the time spent rendering templates, excluding context processors;
+* the time spent in each template context processor (``menu_links``,
+  ``counter``, ...).
+
+The measurements are sent back as a ``Server-Timing`` header, so they show
+up in the browser's network panel, logged as one ``key=value`` line per
+request on the ``shipshop.timing`` logger, and attached to the response as
+``response.timings`` for tests.
+
+Views may declare how many queries they are allowed with ``query_budget``.
+Requests that go over budget are logged as warnings and, with
+``settings.QUERY_BUDGET_STRICT``, raise ``QueryBudgetExceeded`` so the test
+suite fails on query regressions.
+
+Template and context processor times come from ``TimedDjangoTemplates``, a
+``DjangoTemplates`` backend that times its own renders and whose engine wraps
+the context processors with timers; set it as the ``BACKEND`` in
+``TEMPLATES``. Outside a timed request its cost is one ``ContextVar`` lookup
+per render and per context processor.
+
+The middleware is listed in ``MIDDLEWARE`` but stays out of the request path
+unless ``settings.REQUEST_TIMING`` is enabled. It runs in both sync and async
+mode, so async views stay on the event loop.
+"""
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template import Engine
+from django.template.backends.base import BaseEngine
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.functional import cached_property
+
+logger = logging.getLogger('shipshop.timing')
+
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+_current = ContextVar('request_timings', default = None)
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    A view ran more SQL queries than its ``query_budget`` allows.
+    """
+
+
+def query_budget(queries):
+    """
+    Declare the maximum number of SQL queries a view may run per request.
+
+    The budget covers the whole request, including sessions, context
+    processors and cache misses, so set it for a cold cache.
+    """
+    def decorator(view_func):
+        view_func.query_budget = queries
+        return view_func
+    return decorator
+
+
+class RequestTimings:
+    """
+    Measurements of a single request. Durations are in seconds.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.queries = 0
+        self.db = 0.0
+        self.render = 0.0
+        self.context_processors = {}
+        self.view = None
+        self.budget = None
+        self._rendering = False
+
+    @property
+    def template(self):
+        # Context processors run inside Template.render.
+        return max(self.render - sum(self.context_processors.values()), 0.0)
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and self.queries > self.budget
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute_wrapper: time every statement but leave savepoints
+        # out of the count, so budgets hold both inside and outside an
+        # enclosing transaction (e.g. in TestCase).
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            if not sql.startswith(SAVEPOINT_STATEMENTS):
+                self.queries += 1
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """
+        Return the value of the ``Server-Timing`` header.
+        """
+        metrics = [
+            'db;dur=%.2f;desc="%d queries"' % (1000 * self.db, self.queries),
+            'tpl;dur=%.2f' % (1000 * self.template),
+        ]
+        metrics += [
+            'cp-%s;dur=%.2f' % (name, 1000 * duration)
+            for name, duration in self.context_processors.items()
+        ]
+        metrics.append('total;dur=%.2f' % (1000 * self.total))
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {
+            'view': self.view,
+            'queries': self.queries,
+            'budget': self.budget,
+            'db_ms': round(1000 * self.db, 2),
+            'template_ms': round(1000 * self.template, 2),
+            'context_processors_ms': {
+                name: round(1000 * duration, 2) for name, duration in self.context_processors.items()
+            },
+            'total_ms': round(1000 * self.total, 2),
+        }
+
+
+def _timed_processor(processor):
+    name = getattr(processor, '__name__', type(processor).__name__)
+
+    @wraps(processor)
+    def wrapper(request):
+        timings = _current.get()
+        if timings is None:
+            return processor(request)
+        started = time.perf_counter()
+        try:
+            return processor(request)
+        finally:
+            timings.context_processors[name] = (
+                timings.context_processors.get(name, 0.0) + time.perf_counter() - started
+            )
+    return wrapper
+
+
+class TimedTemplate(Template):
+    """
+    Template of ``TimedDjangoTemplates``.
+    """
+
+    def render(self, context = None, request = None):
+        timings = _current.get()
+        if timings is None or timings._rendering:
+            return super().render(context, request)
+        # Only the outermost render is timed, so templates rendered from
+        # inside another one (by a template tag, say) are not counted twice.
+        timings._rendering = True
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.render += time.perf_counter() - started
+            timings._rendering = False
+
+
+class TimedEngine(Engine):
+    """
+    Template engine whose context processors record their run time.
+    """
+
+    @cached_property
+    def template_context_processors(self):
+        return tuple(_timed_processor(processor) for processor in Engine.template_context_processors.func(self))
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    ``DjangoTemplates`` backend that records render and context processor
+    times on the current request's ``RequestTimings``. Configured exactly
+    like ``DjangoTemplates``.
+    """
+
+    def __init__(self, params):
+        params = params.copy()
+        options = params.pop('OPTIONS').copy()
+        options.setdefault('autoescape', True)
+        options.setdefault('debug', settings.DEBUG)
+        options.setdefault('file_charset', 'utf-8')
+        options['libraries'] = self.get_templatetag_libraries(options.get('libraries', {}))
+        # Same as DjangoTemplates.__init__, with a TimedEngine.
+        BaseEngine.__init__(self, params)
+        self.engine = TimedEngine(self.dirs, self.app_dirs, **options)
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class TimingMiddleware:
+    """
+    Record per-request SQL and rendering timings; see the module docstring.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        request.timings = timings
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                self.wrap_queries(stack, timings)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        request.timings = timings
+        token = _current.set(timings)
+        stack = ExitStack()
+        try:
+            # Connections belong to the thread that runs the request's
+            # sync_to_async() calls, so wrap them from there.
+            await sync_to_async(self.wrap_queries)(stack, timings)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def wrap_queries(self, stack, timings):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timings))
+
+    def finish(self, request, response, timings):
+        timings.finish()
+        response['Server-Timing'] = timings.server_timing()
+        response.timings = timings
+        self.log(request, response, timings)
+        if timings.over_budget and settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(
+                "%s ran %d queries, over its budget of %d (%s)" % (
+                    timings.view, timings.queries, timings.budget, request.get_full_path(),
+                )
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = request.timings
+        timings.view = request.resolver_match.view_name
+        timings.budget = getattr(view_func, 'query_budget', None)
+
+    def log(self, request, response, timings):
+        fields = timings.as_dict()
+        level = logging.WARNING if timings.over_budget else logging.INFO
+        logger.log(
+            level,
+            'method=%s path=%s status=%d view=%s queries=%d budget=%s db_ms=%.2f template_ms=%.2f %s total_ms=%.2f',
+            request.method, request.path, response.status_code, timings.view, timings.queries,
+            timings.budget, fields['db_ms'], fields['template_ms'],
+            ' '.join('cp_%s_ms=%.2f' % item for item in fields['context_processors_ms'].items()),
+            fields['total_ms'],
+            extra = {'timings': fields, 'path': request.path, 'status_code': response.status_code},
+        )
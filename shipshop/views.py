@@ -1,11 +1,14 @@
-from django.shortcuts import HttpResponse, redirect, render
-from store.models import Product 
-def home(request):
+from shipshop.shortcuts import arender
+from store.popularity import apopular_products
+from shipshop.timing import query_budget
+@query_budget(6)
+async def home(request):
     """
     Display the home page with available products.
     
-    This view retrieves all available products and displays them on the
-    home page, typically showing featured or recently added products.
+    This view shows the precomputed "Popular products" ranking (see
+    ``store.popularity``), a bounded list read in a single query with the
+    async ORM.
     
     Args:
         request (HttpRequest): The HTTP request object
@@ -14,14 +17,14 @@ def home(request):
         HttpResponse: Rendered home template with product data
     
     Context:
-        products (QuerySet): All available products
+        products (list): The most popular available products
     """
-    products = Product.objects.all().filter(is_available = True)
+    products = await apopular_products()
     
     context = {
         'products': products
     }
-    return render(request, "home.html", context=context)
+    return await arender(request, "home.html", context=context)
 
 def search(request):
     """
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shipshop.settings')
 
 application = get_wsgi_application()
+
+# Build the search box suggestion index before the first request needs it.
+from store.autocomplete import suggestion_index  # noqa: E402
+
+suggestion_index.warm()
@@ -0,0 +1,236 @@
+"""
+In-memory prefix index for the navbar search box suggestions.
+
+Every process keeps the names of the categories and the available products
+in sorted arrays of search keys. A key is a normalized name from one of its
+words on, so "jea" finds "Blue Jeans", and a lookup is a ``bisect`` into
+the array followed by a scan of the matching range: no database, no cache
+round trip beyond reading two version stamps.
+
+The index follows the ``catalog`` and ``category`` cache versions. When
+they move it reloads the categories (a small table) and only the products
+modified since the last refresh, patching the arrays in place of a
+rebuild. Deletions leave no modified row behind; they are noticed when the
+number of indexed products no longer matches the categories'
+``available_count`` sum, and answered with a full rebuild.
+"""
+import bisect
+import logging
+import re
+import threading
+import unicodedata
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Max
+from django.urls import get_script_prefix, get_urlconf
+
+from category.models import Category
+from shipshop.cache import aget_version, get_version
+from shipshop.routers import primary_reads
+from .models import Product, _product_url
+
+logger = logging.getLogger('store.autocomplete')
+
+# Past this many changed products a refresh sorts new arrays instead of
+# inserting the changes one by one.
+INCREMENTAL_LIMIT = 1000
+
+
+def normalize(text):
+    """
+    Lower-case ``text``, strip accents and collapse whitespace.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text.casefold()))
+
+
+def search_keys(name):
+    """
+    Return the keys a name is found under: its normalized text from every
+    word on ("blue jeans", "jeans").
+    """
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class PrefixIndex:
+    """
+    Sorted ``(key, id)`` tuples plus an ``id -> (name, target)`` map.
+
+    The key array is replaced, never modified in place, so a lookup running
+    in another thread always scans a consistent array.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+
+    def rebuild(self, entries):
+        self.entries = dict(entries)
+        self.keys = sorted((key, id) for id, (name, _) in self.entries.items() for key in search_keys(name))
+
+    def apply(self, changed, removed):
+        """
+        Replace or add ``changed`` entries and drop the ``removed`` ids.
+        """
+        if len(changed) + len(removed) > INCREMENTAL_LIMIT:
+            entries = dict(self.entries)
+            for id in removed:
+                entries.pop(id, None)
+            entries.update(changed)
+            self.rebuild(entries)
+            return
+        keys = list(self.keys)
+        for id in list(changed) + list(removed):
+            if id in self.entries:
+                for key in search_keys(self.entries[id][0]):
+                    index = bisect.bisect_left(keys, (key, id))
+                    if index < len(keys) and keys[index] == (key, id):
+                        del keys[index]
+        for id, (name, _) in changed.items():
+            for key in search_keys(name):
+                bisect.insort(keys, (key, id))
+        # New entries become visible before the keys that point at them,
+        # removed ones only after.
+        self.entries.update(changed)
+        self.keys = keys
+        for id in removed:
+            self.entries.pop(id, None)
+
+    def lookup(self, prefix, limit):
+        """
+        Return up to ``limit`` ``(name, target)`` entries whose name has a
+        word starting with ``prefix`` (already normalized), in key order.
+        """
+        keys = self.keys
+        found = []
+        seen = set()
+        index = bisect.bisect_left(keys, (prefix,))
+        while index < len(keys) and len(found) < limit:
+            key, id = keys[index]
+            if not key.startswith(prefix):
+                break
+            entry = self.entries.get(id)
+            if entry is not None and id not in seen:
+                seen.add(id)
+                found.append(entry)
+            index += 1
+        return found
+
+
+class SuggestionIndex:
+    """
+    The per-process suggestion index of categories and available products.
+
+    Category entries hold their URL; product entries hold their category
+    and product slugs, turned into a URL only for the suggestions returned.
+    """
+
+    def __init__(self):
+        self.categories = PrefixIndex()
+        self.products = PrefixIndex()
+        self.versions = None
+        self.modified = None
+        self.lock = threading.Lock()
+
+    def is_current(self, versions):
+        return self.versions == versions
+
+    def refresh(self, versions = None):
+        """
+        Bring the index up to date with the database if the catalog or the
+        categories changed since the last refresh.
+
+        Args:
+            versions (tuple, optional): The current ``(catalog, category)``
+                versions, when the caller has read them already
+        """
+        if versions is None:
+            versions = current_versions()
+        # A replica may not have the change that moved the versions yet.
+        with self.lock, primary_reads():
+            if self.versions == versions:
+                return
+            categories = list(Category.objects.values_list('id', 'category_name', 'slug', 'available_count'))
+            self.categories.rebuild(
+                (id, (name, Category(slug = slug).get_url())) for id, name, slug, _ in categories
+            )
+            available = sum(count for _, _, _, count in categories)
+
+            products = Product.objects.values_list('id', 'product_name', 'category__slug', 'slug', 'is_available', 'modified_date')
+            if self.modified is not None:
+                changes = list(products.filter(modified_date__gte = self.modified))
+                self.products.apply(
+                    {id: (name, (category, slug)) for id, name, category, slug, is_available, _ in changes if is_available},
+                    [id for id, _, _, _, is_available, _ in changes if not is_available],
+                )
+                self.modified = max([self.modified] + [row[-1] for row in changes])
+            if self.modified is None or len(self.products.entries) != available:
+                self.modified = Product.objects.aggregate(modified = Max('modified_date'))['modified']
+                self.products.rebuild(
+                    (id, (name, (category, slug)))
+                    for id, name, category, slug, _, _ in products.filter(is_available = True).iterator(chunk_size = 2000)
+                )
+            self.versions = versions
+
+    def warm(self):
+        """
+        Build the index at process start, unless the database is not ready
+        (not migrated yet, unreachable); the first request builds it then.
+        """
+        try:
+            self.refresh()
+        except DatabaseError:
+            logger.warning("Suggestion index not built at startup.", exc_info = True)
+
+    async def arefresh(self, versions = None):
+        """
+        Async version of ``refresh()``.
+
+        The refresh runs in a thread: it takes a lock and may read many rows.
+        """
+        if versions is None:
+            versions = await acurrent_versions()
+        await sync_to_async(self.refresh)(versions)
+
+    def suggest(self, query, limit = 8):
+        """
+        Return suggestions for a search box entry, categories first.
+
+        Args:
+            query (str): What the visitor typed so far
+            limit (int): Maximum number of suggestions
+
+        Returns:
+            list: ``{'type', 'name', 'url'}`` dictionaries
+        """
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        results = [
+            {'type': 'category', 'name': name, 'url': url}
+            for name, url in self.categories.lookup(prefix, limit)
+        ]
+        urlconf, script_prefix = get_urlconf() or settings.ROOT_URLCONF, get_script_prefix()
+        results += [
+            {'type': 'product', 'name': name, 'url': _product_url(category, slug, urlconf, script_prefix)}
+            for name, (category, slug) in self.products.lookup(prefix, limit - len(results))
+        ]
+        return results
+
+
+suggestion_index = SuggestionIndex()
+
+
+def current_versions():
+    return get_version('catalog'), get_version('category')
+
+
+async def acurrent_versions():
+    """
+    Async version of ``current_versions()``.
+    """
+    return await aget_version('catalog'), await aget_version('category')
@@ -0,0 +1,120 @@
+"""
+Per-category product counters.
+
+``Category.product_count`` and ``Category.available_count`` hold how many
+products each category has, and how many of them are available, so the
+menu and sidebars can show them without a ``COUNT(*)``. They are adjusted
+in the transaction that changes the products: by the ``Product`` save and
+delete signals in ``store.signals``, and by ``ProductQuerySet``'s
+``bulk_create``, ``bulk_update`` and ``update``, which send no signals.
+Writes that bypass both (raw SQL, another application) leave them off until
+``manage.py reconcile_category_counts`` recounts.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from category.models import Category
+from shipshop.cache import bump_version
+
+
+class Deltas:
+    """
+    Accumulates counter changes per category and writes them at once.
+    """
+
+    def __init__(self):
+        self.changes = defaultdict(lambda: [0, 0])
+
+    def add(self, category_id, is_available, products = 1):
+        """
+        Count ``products`` products (negative to uncount) in a category.
+        """
+        if category_id is None:
+            return
+        change = self.changes[category_id]
+        change[0] += products
+        if is_available:
+            change[1] += products
+
+    def move(self, old, new, products = 1):
+        """
+        Count products going from state ``old`` to state ``new``.
+
+        Args:
+            old (tuple): ``(category id, is available)`` before, or None
+                for new products
+            new (tuple): ``(category id, is available)`` after, or None for
+                deleted products
+            products (int): Number of products making that move
+        """
+        if old is not None:
+            self.add(*old, products = -products)
+        if new is not None:
+            self.add(*new, products = products)
+
+    def save(self, using = None):
+        """
+        Apply the accumulated changes with one ``UPDATE`` per changed category.
+        """
+        changed = False
+        for category_id, (products, available) in self.changes.items():
+            if products or available:
+                Category.objects.using(using).filter(pk = category_id).update(
+                    product_count = F('product_count') + products,
+                    available_count = F('available_count') + available,
+                )
+                changed = True
+        self.changes.clear()
+        if changed:
+            # The menu, which shows the counts, is cached under this version.
+            transaction.on_commit(lambda: bump_version('category'), using = using)
+
+
+def product_moved(old, new, using = None):
+    """
+    Adjust the counters for one product saved or deleted; see ``Deltas.move``.
+    """
+    deltas = Deltas()
+    deltas.move(old, new)
+    deltas.save(using = using)
+
+
+def actual_counts(using = None):
+    """
+    Count the products of every category in one grouped query.
+
+    Returns:
+        dict: Category id -> ``(products, available products)``
+    """
+    counts = Category.objects.using(using).annotate(
+        products = Count('product'),
+        available = Count('product', filter = Q(product__is_available = True)),
+    ).values_list('id', 'products', 'available')
+    return {category_id: (products, available) for category_id, products, available in counts}
+
+
+def recount(using = None):
+    """
+    Set every category's counters to the actual number of products.
+
+    Returns:
+        list: ``(category, (stored counts), (actual counts))`` for every
+            category that was off
+    """
+    drifted = []
+    with transaction.atomic(using = using):
+        categories = list(Category.objects.using(using).select_for_update())
+        actual = actual_counts(using = using)
+        for category in categories:
+            stored = (category.product_count, category.available_count)
+            counts = actual.get(category.id, (0, 0))
+            if stored != counts:
+                Category.objects.using(using).filter(pk = category.pk).update(
+                    product_count = counts[0], available_count = counts[1],
+                )
+                drifted.append((category, stored, counts))
+        if drifted:
+            transaction.on_commit(lambda: bump_version('category'), using = using)
+    return drifted
@@ -0,0 +1,218 @@
+"""
+Filters, sort orders and facet counts for the store listings.
+
+Listings can be narrowed by category (the URL), by a price range and to
+products in stock, and sorted by price or newest first. Every filter and
+sort has a matching partial index on ``store_product`` (see
+``Product.Meta.indexes``).
+
+The sidebar shows how many products each category and each price bucket
+would list. All of these numbers come from one grouped aggregate,
+products counted per ``(category, price bucket)`` pair, which only depends
+on the stock filter. Its few rows are cached under the ``catalog`` version
+per stock filter, and the category, price and total counts for any
+combination of the other filters are summed from them in Python.
+"""
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from shipshop.cache import aversioned_key, versioned_key
+from shipshop.routers import primary_reads
+from .models import Product
+
+# Bucket boundaries, as offered by the price range selects. Buckets are
+# half-open, [0, 50), [50, 100), ... and [2000, no limit).
+PRICE_BOUNDARIES = (0, 50, 100, 150, 200, 500, 1000, 2000)
+PRICE_BUCKETS = tuple(zip(PRICE_BOUNDARIES, PRICE_BOUNDARIES[1:] + (None,)))
+
+# ?sort= value -> (label, ordering). Orderings end in id so that they are
+# total, as cursor pagination requires.
+SORTS = {
+    '': ('Default', ('id',)),
+    'price': ('Price: low to high', ('price', 'id')),
+    '-price': ('Price: high to low', ('-price', '-id')),
+    'newest': ('Newest first', ('-created_date', '-id')),
+}
+
+FACET_CACHE_TIMEOUT = 60 * 60
+
+# Query parameters that select a page; dropped from filter and sort links.
+PAGE_PARAMETERS = ('page', 'after', 'before')
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ListingFilters:
+    """
+    The filters and sort order of one listing request.
+
+    Args:
+        category (Category, optional): Category the listing is limited to
+        min_price (int, optional): Lowest price, one of ``PRICE_BOUNDARIES``
+        max_price (int, optional): Price limit (exclusive), one of
+            ``PRICE_BOUNDARIES`` above ``min_price``; None for no limit
+        in_stock (bool): Only list products with stock left
+        sort (str): A key of ``SORTS``
+    """
+
+    def __init__(self, category = None, min_price = None, max_price = None, in_stock = False, sort = ''):
+        self.category = category
+        self.min_price = min_price
+        self.max_price = max_price
+        self.in_stock = in_stock
+        self.sort = sort
+
+    @classmethod
+    def from_request(cls, request, category = None):
+        """
+        Read the filters from the query string, ignoring invalid values.
+        """
+        min_price = _int(request.GET.get('min_price'))
+        if min_price not in PRICE_BOUNDARIES:
+            min_price = None
+        max_price = _int(request.GET.get('max_price'))
+        if max_price not in PRICE_BOUNDARIES or max_price <= (min_price or 0):
+            max_price = None
+        sort = request.GET.get('sort', '')
+        return cls(
+            category = category,
+            min_price = min_price,
+            max_price = max_price,
+            in_stock = request.GET.get('in_stock') == '1',
+            sort = sort if sort in SORTS else '',
+        )
+
+    @property
+    def ordering(self):
+        # In id order, a price range would have to be read in full and sorted;
+        # in price order it is read from product_price_idx up to the page.
+        if not self.sort and (self.min_price or self.max_price is not None):
+            return SORTS['price'][1]
+        return SORTS[self.sort][1]
+
+    def apply(self, queryset):
+        """
+        Return ``queryset`` narrowed to the selected category, price and stock.
+        """
+        if self.category is not None:
+            queryset = queryset.filter(category = self.category)
+        if self.min_price:
+            queryset = queryset.filter(price__gte = self.min_price)
+        if self.max_price is not None:
+            queryset = queryset.filter(price__lt = self.max_price)
+        if self.in_stock:
+            queryset = queryset.filter(stock__gt = 0)
+        return queryset
+
+    def price_matches(self, bucket):
+        low, high = PRICE_BUCKETS[bucket]
+        if self.min_price and low < self.min_price:
+            return False
+        return self.max_price is None or (high is not None and high <= self.max_price)
+
+    def category_matches(self, category_id):
+        return self.category is None or self.category.id == category_id
+
+
+def _facet_query(in_stock):
+    queryset = Product.objects.filter(is_available = True)
+    if in_stock:
+        queryset = queryset.filter(stock__gt = 0)
+    bucket = Case(
+        *[When(price__lt = high, then = Value(index)) for index, (_, high) in enumerate(PRICE_BUCKETS[:-1])],
+        default = Value(len(PRICE_BUCKETS) - 1),
+        output_field = IntegerField(),
+    )
+    return (
+        queryset.annotate(bucket = bucket)
+        .values('category_id', 'bucket')
+        .annotate(products = Count('id'))
+        .values_list('category_id', 'bucket', 'products')
+        .order_by()
+    )
+
+
+def _facet_key(in_stock):
+    return 'facets:%s' % ('in-stock' if in_stock else 'all')
+
+
+def facet_rows(in_stock = False):
+    """
+    Return the number of available products per category and price bucket.
+
+    Args:
+        in_stock (bool): Only count products with stock left
+
+    Returns:
+        list: ``(category id, bucket index, products)`` tuples
+    """
+    key = versioned_key('catalog', _facet_key(in_stock))
+    rows = cache.get(key)
+    if rows is None:
+        with primary_reads():
+            rows = list(_facet_query(in_stock))
+        cache.set(key, rows, FACET_CACHE_TIMEOUT)
+    return rows
+
+
+async def afacet_rows(in_stock = False):
+    """
+    Async version of ``facet_rows()``.
+    """
+    key = await aversioned_key('catalog', _facet_key(in_stock))
+    rows = await cache.aget(key)
+    if rows is None:
+        with primary_reads():
+            rows = [row async for row in _facet_query(in_stock)]
+        await cache.aset(key, rows, FACET_CACHE_TIMEOUT)
+    return rows
+
+
+class Facets:
+    """
+    Facet counts for one combination of filters.
+
+    The count for a category ignores the category filter and the count for
+    a price bucket ignores the price filter, so each shows how many products
+    choosing it would list.
+
+    Attributes:
+        categories (dict): Category id -> number of matching products
+        prices (list): Number of matching products per ``PRICE_BUCKETS``
+        total (int): Number of products matching every filter
+    """
+
+    def __init__(self, rows, filters):
+        self.categories = {}
+        self.prices = [0] * len(PRICE_BUCKETS)
+        self.total = 0
+        for category_id, bucket, products in rows:
+            in_price = filters.price_matches(bucket)
+            in_category = filters.category_matches(category_id)
+            if in_price:
+                self.categories[category_id] = self.categories.get(category_id, 0) + products
+            if in_category:
+                self.prices[bucket] += products
+                if in_price:
+                    self.total += products
+
+
+def filter_url(request, path, **changes):
+    """
+    Return ``path`` with the current query string, minus the page, updated
+    with ``changes`` (a None value removes the parameter).
+    """
+    query = request.GET.copy()
+    for name in PAGE_PARAMETERS:
+        query.pop(name, None)
+    for name, value in changes.items():
+        if value is None:
+            query.pop(name, None)
+        else:
+            query[name] = value
+    return '%s?%s' % (path, query.urlencode()) if query else path
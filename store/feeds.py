@@ -0,0 +1,143 @@
+"""
+Full-catalog product feed for marketplaces and crawlers.
+
+The feed lists every available product with its price, stock, page URL and
+image URL, as XML or CSV. It is produced chunk by chunk from a streaming
+cursor: ``settings.PRODUCT_FEED_CHUNK_SIZE`` products are fetched, rendered
+to one piece of text and sent before the next chunk is read, so neither the
+products nor the document are ever held in memory whole.
+"""
+import csv
+import hashlib
+import io
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from shipshop.cache import bumped_within, get_version
+from .models import Product
+
+CONTENT_TYPES = {
+    'xml': 'application/xml; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+CSV_HEADER = ('id', 'title', 'link', 'image_link', 'price', 'stock', 'category')
+# How long the first-seen time of a catalog state is kept. When it expires
+# Last-Modified moves forward, costing each client one full download.
+FEED_MODIFIED_TIMEOUT = 24 * 60 * 60
+
+
+def feed_products():
+    return (
+        Product.objects.filter(is_available = True)
+        .select_related('category')
+        .only('product_name', 'slug', 'price', 'stock', 'image', 'category__slug', 'category__category_name')
+        .order_by('id')
+    )
+
+
+def feed_state():
+    """
+    Return ``(ETag, Last-Modified)`` for the feed without a database query.
+
+    Product writes bump the ``catalog`` version and category writes (the
+    names are in the feed) the ``category`` version, so the ETag is built
+    from both. Last-Modified is when this pair of versions was first seen,
+    kept in the cache under them: never earlier than the change it follows.
+
+    Right after a bump a replica may still serve the old rows, which must
+    not be cached under the new versions: no validators are given then.
+    """
+    versions = (get_version('catalog'), get_version('category'))
+    if settings.DATABASE_REPLICAS and bumped_within(('catalog', 'category'), settings.REPLICA_PIN_SECONDS):
+        return None, None
+    key = 'feed:modified:v%s.%s' % versions
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, timezone.now().replace(microsecond = 0), FEED_MODIFIED_TIMEOUT)
+        modified = cache.get(key)
+    etag = hashlib.md5(('feed|%s|%s' % versions).encode()).hexdigest()
+    return etag, modified
+
+
+def _row(product, base_url):
+    return (
+        product.id,
+        product.product_name,
+        base_url + product.get_url(),
+        base_url + product.image.url if product.image else '',
+        product.price,
+        product.stock,
+        product.category.category_name,
+    )
+
+
+def _render_chunk(products, format, base_url):
+    if format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(_row(product, base_url) for product in products)
+        return buffer.getvalue()
+    return ''.join(
+        '<product>%s</product>\n' % ''.join(
+            '<%s>%s</%s>' % (name, escape(str(value)), name) for name, value in zip(CSV_HEADER, row)
+        )
+        for row in (_row(product, base_url) for product in products)
+    )
+
+
+def _head(format):
+    if format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(CSV_HEADER)
+        return buffer.getvalue()
+    return '<?xml version="1.0" encoding="UTF-8"?>\n<products>\n'
+
+
+def _tail(format):
+    return '' if format == 'csv' else '</products>\n'
+
+
+def iter_feed(format, base_url):
+    """
+    Yield the feed document in pieces, one per chunk of products.
+
+    Args:
+        format (str): ``'xml'`` or ``'csv'``
+        base_url (str): Scheme and host prefixed to page and image paths
+
+    Yields:
+        str: The header, one rendered chunk of products at a time, the footer
+    """
+    chunk_size = settings.PRODUCT_FEED_CHUNK_SIZE
+    yield _head(format)
+    chunk = []
+    for product in feed_products().iterator(chunk_size = chunk_size):
+        chunk.append(product)
+        if len(chunk) == chunk_size:
+            yield _render_chunk(chunk, format, base_url)
+            chunk = []
+    if chunk:
+        yield _render_chunk(chunk, format, base_url)
+    yield _tail(format)
+
+
+async def aiter_feed(format, base_url):
+    """
+    Async version of ``iter_feed()``.
+
+    Served under ASGI, a synchronous iterator would be read to the end into
+    a list before the first byte is sent; an async one streams.
+    """
+    chunk_size = settings.PRODUCT_FEED_CHUNK_SIZE
+    yield _head(format)
+    chunk = []
+    async for product in feed_products().aiterator(chunk_size = chunk_size):
+        chunk.append(product)
+        if len(chunk) == chunk_size:
+            yield _render_chunk(chunk, format, base_url)
+            chunk = []
+    if chunk:
+        yield _render_chunk(chunk, format, base_url)
+    yield _tail(format)
@@ -0,0 +1,166 @@
+"""
+Pre-sized image derivatives for product and category photos.
+
+Every uploaded image gets a set of resized, re-encoded copies (WebP plus a
+JPEG fallback, one per width in ``settings.IMAGE_DERIVATIVE_WIDTHS``) stored
+next to the media under ``derivatives/``. They are rendered in a process
+pool after the saving transaction commits, never inside the request, and
+templates emit them as ``srcset`` candidates through the ``images`` template
+tags. ``manage.py generate_image_derivatives`` backfills existing photos.
+"""
+import multiprocessing
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+DERIVATIVE_DIR = 'derivatives'
+FORMATS = (
+    # (file extension, Pillow format, MIME type)
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+
+_executor = None
+
+
+def derivative_name(name, width, extension):
+    """
+    Return the storage name of one derivative of an image.
+
+    ``photos/product/Blue-Shirt.jpg`` at 320px as WebP becomes
+    ``derivatives/photos/product/Blue-Shirt-320w.webp``.
+    """
+    root, _ = posixpath.splitext(name)
+    return '%s/%s-%dw.%s' % (DERIVATIVE_DIR, root, width, extension)
+
+
+def derivative_names(name):
+    """
+    Return ``(width, extension, storage name)`` for every derivative of an image.
+    """
+    return [
+        (width, extension, derivative_name(name, width, extension))
+        for width in settings.IMAGE_DERIVATIVE_WIDTHS
+        for extension, _, _ in FORMATS
+    ]
+
+
+def has_derivatives(name):
+    """
+    Return True if the derivatives of an image exist and are up to date.
+    """
+    try:
+        source = os.path.getmtime(default_storage.path(name))
+        return all(
+            os.path.getmtime(default_storage.path(path)) >= source
+            for _, _, path in derivative_names(name)
+        )
+    except OSError:
+        return False
+
+
+def derivatives_ready(name):
+    """
+    Return True if every derivative of an image has been rendered.
+
+    A missing size (a failed or interrupted render, a width added to
+    ``IMAGE_DERIVATIVE_WIDTHS``) would put a broken candidate in the
+    ``srcset``, so each one is checked.
+    """
+    return all(default_storage.exists(path) for _, _, path in derivative_names(name))
+
+
+def render_derivatives(source, targets):
+    """
+    Resize and re-encode one image. Runs in a worker process.
+
+    Images are only ever scaled down; a derivative wider than the original
+    is a re-encoded copy at the original size. Files are written to a
+    temporary name and renamed into place so readers never see a partial
+    image.
+
+    Args:
+        source (str): Filesystem path of the original image
+        targets (list): ``(path, width, pillow_format)`` tuples to write
+
+    Returns:
+        int: Number of files written
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        for path, width, image_format in targets:
+            image = original.copy()
+            if image.width > width:
+                image.thumbnail((width, image.height), Image.Resampling.LANCZOS)
+            if image_format == 'JPEG' and image.mode != 'RGB':
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask = image.getchannel('A') if 'A' in image.getbands() else None)
+                image = background
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            temporary = '%s.tmp' % path
+            if image_format == 'JPEG':
+                image.save(temporary, image_format, quality = 82, optimize = True, progressive = True)
+            else:
+                image.save(temporary, image_format, quality = 80, method = 4)
+            os.replace(temporary, path)
+    return len(targets)
+
+
+def derivative_job(name):
+    """
+    Return the ``render_derivatives`` arguments for an image in storage.
+    """
+    formats = {extension: image_format for extension, image_format, _ in FORMATS}
+    targets = [
+        (default_storage.path(path), width, formats[extension])
+        for width, extension, path in derivative_names(name)
+    ]
+    return default_storage.path(name), targets
+
+
+def get_executor():
+    """
+    Return the process pool that renders derivatives, starting it on first use.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers = settings.IMAGE_DERIVATIVE_WORKERS,
+            mp_context = multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def schedule_derivatives(image, using = None):
+    """
+    Render the derivatives of a saved image in the background.
+
+    Does nothing for empty fields, missing files or images whose derivatives
+    are already current, so saves that do not touch the image cost one
+    ``stat`` per derivative.
+
+    Args:
+        image (FieldFile): The ``ImageField`` value of a saved instance
+        using (str, optional): Database alias of the saving transaction
+    """
+    if not image or not os.path.exists(default_storage.path(image.name)) or has_derivatives(image.name):
+        return
+    source, targets = derivative_job(image.name)
+    transaction.on_commit(lambda: get_executor().submit(render_derivatives, source, targets), using = using)
+
+
+def srcset(name, extension):
+    """
+    Return the ``srcset`` value listing every derivative of one format.
+    """
+    return ', '.join(
+        '%s %dw' % (default_storage.url(path), width)
+        for width, ext, path in derivative_names(name)
+        if ext == extension
+    )
@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import time
+from itertools import cycle
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from category.models import Category
+from store.models import Product
+
+
+def positive_int(value):
+    """
+    ``argparse`` type for counts that must be at least 1.
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %d" % number)
+    return number
+
+
+def percentile(samples, fraction):
+    """
+    Return the nearest-rank percentile of a sorted list.
+    """
+    if not samples:
+        return 0.0
+    index = max(math.ceil(fraction * len(samples)) - 1, 0)
+    return samples[index]
+
+
+async def asgi_request(application, host, method, url, cookies):
+    """
+    Send one request to an ASGI application the way an ASGI server would.
+
+    Cookies set by the response are stored in ``cookies`` and sent with the
+    following requests.
+
+    Returns:
+        int: The response status code
+    """
+    path, _, query = url.partition('?')
+    headers = [(b'host', host.encode())]
+    if cookies:
+        headers.append((b'cookie', '; '.join('%s=%s' % item for item in cookies.items()).encode()))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': headers,
+        'client': ('127.0.0.1', 0),
+        'server': (host, 80),
+    }
+    finished = asyncio.Event()
+    status = None
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            for name, value in message['headers']:
+                if name.lower() == b'set-cookie':
+                    cookie = value.decode().split(';', 1)[0]
+                    key, _, morsel = cookie.partition('=')
+                    cookies[key] = morsel
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    await application(scope, receive, send)
+    finished.set()
+    return status
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the storefront URLs with the Django test client against the "
+        "current database and report throughput, latency percentiles and SQL "
+        "queries per request. Seed a realistic dataset first with seed_data. "
+        "With --asgi, requests are instead sent straight to the ASGI "
+        "application from an event loop, as uvicorn would, keeping up to "
+        "--concurrency requests in flight."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type = positive_int, default = 200, help = "Measured requests per scenario.")
+        parser.add_argument('--warmup', type = int, default = 20, help = "Unmeasured requests per scenario.")
+        parser.add_argument('--scenario', action = 'append', help = "Only run the named scenario (repeatable).")
+        parser.add_argument('--seed', type = int, default = 0, help = "Random seed for the sampled products.")
+        parser.add_argument('--cold-cache', action = 'store_true', help = "Clear the cache before every request.")
+        parser.add_argument('--host', default = 'localhost', help = "Host header; must be in ALLOWED_HOSTS.")
+        parser.add_argument('--asgi', action = 'store_true', help = "Serve the requests through the ASGI application.")
+        parser.add_argument(
+            '--concurrency', type = positive_int, nargs = '+', default = [1],
+            help = "Requests in flight with --asgi; several levels may be given (default: 1).",
+        )
+        parser.add_argument('--output', help = "Write the results as JSON to this file.")
+        parser.add_argument('--baseline', help = "JSON results of an earlier run to compare against.")
+        parser.add_argument(
+            '--threshold', type = float, default = 0.25,
+            help = "Fail when a scenario's p95 latency grows by more than this fraction (default: 0.25).",
+        )
+
+    def handle(self, *args, **options):
+        self.client = Client(HTTP_HOST = options['host'])
+        scenarios = self.scenarios(random.Random(options['seed']))
+        if options['scenario']:
+            unknown = set(options['scenario']) - set(scenarios)
+            if unknown:
+                raise CommandError("Unknown scenarios: %s (available: %s)" % (
+                    ', '.join(sorted(unknown)), ', '.join(scenarios),
+                ))
+            scenarios = {name: steps for name, steps in scenarios.items() if name in options['scenario']}
+
+        results = {}
+        for name, requests in scenarios.items():
+            if not options['asgi']:
+                results[name] = self.run(requests, options['requests'], options['warmup'], options['cold_cache'])
+                self.report(name, results[name])
+                continue
+            for concurrency in options['concurrency']:
+                label = '%s@%d' % (name, concurrency)
+                results[label] = asyncio.run(self.run_asgi(
+                    requests, options['requests'], options['warmup'], options['cold_cache'], concurrency,
+                ))
+                self.report(label, results[label])
+
+        document = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'products': Product.objects.count(),
+                'requests': options['requests'],
+                'cold_cache': options['cold_cache'],
+                'asgi': options['asgi'],
+            },
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(document, output, indent = 2)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = self.compare(json.load(baseline)['scenarios'], results, options['threshold'])
+            if regressions:
+                raise CommandError("Performance regressions:\n  " + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against %s." % options['baseline']))
+
+    def scenarios(self, rng):
+        """
+        Build the request generators, one per scenario.
+
+        Each generator yields ``(method, url)`` pairs forever; URLs are drawn
+        from the current catalog so every scenario hits real rows, and the
+        same seed samples the same products on every run.
+        """
+        ids = list(Product.objects.filter(is_available = True).order_by('id').values_list('id', flat = True))
+        if not ids:
+            raise CommandError("The catalog is empty; run seed_data first.")
+        sample = rng.sample(ids, min(len(ids), 100))
+        products = list(Product.objects.select_related('category').filter(id__in = sample).order_by('id'))
+        category = Category.objects.annotate(products = Count('product')).order_by('-products', 'id').first()
+        available = len(ids)
+        last_page = max(math.ceil(available / 3), 1)
+        keywords = sorted({word.lower() for product in products for word in product.product_name.split() if word.isalpha()})
+
+        def repeat(*urls):
+            return (('GET', url) for url in cycle(urls))
+
+        def cart_flow():
+            for product in cycle(products):
+                yield 'GET', reverse('add_cart', args = [product.id])
+                yield 'GET', reverse('cart')
+                yield 'GET', reverse('remove_cart', args = [product.id])
+
+        return {
+            'home': repeat(reverse('home')),
+            'store_first_page': repeat(reverse('store')),
+            'store_deep_page': repeat('%s?page=%d' % (reverse('store'), last_page)),
+            'category': repeat(category.get_url()),
+            'product_detail': repeat(*[product.get_url() for product in products]),
+            'search': repeat(*['%s?keyword=%s' % (reverse('search'), word) for word in keywords[:20]]),
+            'cart_flow': cart_flow(),
+        }
+
+    def run(self, requests, count, warmup, cold_cache):
+        for _ in range(warmup):
+            method, url = next(requests)
+            self.client.generic(method, url)
+
+        timings = []
+        queries = 0
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            method, url = next(requests)
+            if cold_cache:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = self.client.generic(method, url)
+                timings.append(time.perf_counter() - request_started)
+            queries += len(captured)
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+        return self.summary(timings, errors, elapsed, round(queries / count, 2))
+
+    async def run_asgi(self, requests, count, warmup, cold_cache, concurrency):
+        """
+        Send ``count`` requests to the ASGI application, ``concurrency`` at a time.
+
+        Every worker is one visitor with its own cookies. Queries run in the
+        per-request threads Django gives sync code under ASGI, so they are
+        not counted here.
+        """
+        # The deployed entry point, which also warms the suggestion index.
+        from shipshop.asgi import application
+        host = self.client.defaults['HTTP_HOST']
+        timings = []
+        errors = 0
+        remaining = count
+
+        async def worker(measured):
+            nonlocal errors, remaining
+            cookies = {}
+            while remaining > 0:
+                remaining -= 1
+                method, url = next(requests)
+                if cold_cache:
+                    await cache.aclear()
+                request_started = time.perf_counter()
+                status = await asgi_request(application, host, method, url, cookies)
+                if measured:
+                    timings.append(time.perf_counter() - request_started)
+                    if status >= 400:
+                        errors += 1
+
+        remaining = warmup
+        await worker(measured = False)
+        remaining = count
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(measured = True) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        return self.summary(timings, errors, elapsed, None)
+
+    def summary(self, timings, errors, elapsed, queries_per_request):
+        count = len(timings)
+        timings.sort()
+        return {
+            'requests': count,
+            'errors': errors,
+            'throughput_rps': round(count / elapsed, 2),
+            'mean_ms': round(1000 * sum(timings) / count, 3),
+            'p50_ms': round(1000 * percentile(timings, 0.50), 3),
+            'p95_ms': round(1000 * percentile(timings, 0.95), 3),
+            'p99_ms': round(1000 * percentile(timings, 0.99), 3),
+            'queries_per_request': queries_per_request,
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            "%-21s %8.1f req/s  p50 %7.2fms  p95 %7.2fms  p99 %7.2fms%s%s" % (
+                name, result['throughput_rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                '' if result['queries_per_request'] is None else '  %5.1f queries/req' % result['queries_per_request'],
+                '  %d errors' % result['errors'] if result['errors'] else '',
+            )
+        )
+
+    def compare(self, baseline, results, threshold):
+        """
+        Return a description of every scenario that got slower than allowed.
+
+        A scenario regresses when its p95 latency grows by more than
+        ``threshold`` or when it issues more SQL queries per request.
+        """
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append("%s: p95 %.2fms -> %.2fms" % (name, before['p95_ms'], result['p95_ms']))
+            if None not in (result['queries_per_request'], before['queries_per_request']) and (
+                result['queries_per_request'] > before['queries_per_request']
+            ):
+                regressions.append("%s: %.2f -> %.2f queries/request" % (
+                    name, before['queries_per_request'], result['queries_per_request'],
+                ))
+            if result['errors'] > before.get('errors', 0):
+                regressions.append("%s: %d errors" % (name, result['errors']))
+        return regressions
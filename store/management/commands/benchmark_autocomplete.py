@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from store.autocomplete import SuggestionIndex, current_versions
+from store.management.commands.benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the search box suggestion index from the current database and "
+        "time lookups of prefixes sampled from the indexed names, including "
+        "the per-request version check. Seed a catalog first with seed_data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookups', type = int, default = 10000, help = "Measured lookups.")
+        parser.add_argument('--limit', type = int, default = 8, help = "Suggestions per lookup.")
+        parser.add_argument('--seed', type = int, default = 0, help = "Random seed for the sampled prefixes.")
+
+    def handle(self, *args, **options):
+        index = SuggestionIndex()
+        started = time.perf_counter()
+        index.refresh()
+        elapsed = time.perf_counter() - started
+        entries = len(index.products.entries) + len(index.categories.entries)
+        keys = len(index.products.keys) + len(index.categories.keys)
+        if not entries:
+            raise CommandError("The catalog is empty; run seed_data first.")
+        self.stdout.write("Build: %d names, %d keys in %.2fs (%d names/s)" % (
+            entries, keys, elapsed, entries / max(elapsed, 1e-6),
+        ))
+
+        rng = random.Random(options['seed'])
+        names = [name for name, _ in index.products.entries.values()] + [name for name, _ in index.categories.entries.values()]
+        prefixes = []
+        for _ in range(options['lookups']):
+            words = rng.choice(names).split()
+            word = rng.choice(words)
+            prefixes.append(word[:rng.randint(1, max(len(word), 1))])
+
+        timings = []
+        results = 0
+        with CaptureQueriesContext(connection) as queries:
+            for prefix in prefixes:
+                started = time.perf_counter()
+                if not index.is_current(current_versions()):
+                    index.refresh()
+                results += len(index.suggest(prefix, options['limit']))
+                timings.append((time.perf_counter() - started) * 1e6)
+        timings.sort()
+        total = sum(timings) / 1e6
+        self.stdout.write(
+            "Lookup: %d lookups, %.1f results each, %d queries; "
+            "mean %.1fus p50 %.1fus p95 %.1fus p99 %.1fus max %.1fus (%d lookups/s)" % (
+                len(timings), results / len(timings), len(queries), sum(timings) / len(timings),
+                percentile(timings, 0.50), percentile(timings, 0.95), percentile(timings, 0.99), timings[-1],
+                len(timings) / max(total, 1e-6),
+            )
+        )
@@ -0,0 +1,52 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.transfer import FIELDS, FORMATS, RowWriter, guess_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every product as CSV or JSON Lines, in the format read by "
+        "import_products. Rows are streamed from a server-side cursor, so "
+        "memory use does not grow with the catalog."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs = '?', default = '-', help = "File to write, or - for standard output (default).")
+        parser.add_argument('--format', choices = FORMATS, help = "Default: guessed from the file name, else csv.")
+        parser.add_argument('--batch-size', type = int, default = 2000, help = "Rows fetched per round trip.")
+        parser.add_argument('--database', default = 'default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        # Keep the report out of the data when the data goes to stdout.
+        report = self.stderr if path == '-' else self.stdout
+
+        rows = (
+            Product.objects.using(options['database'])
+            .order_by('id')
+            .values_list(*FIELDS[:-1], 'category__slug')
+            .iterator(chunk_size = options['batch_size'])
+        )
+        started = time.monotonic()
+        if path == '-':
+            written = self.export(rows, sys.stdout, format)
+        else:
+            with open(path, 'w', newline = '', encoding = 'utf-8') as stream:
+                written = self.export(rows, stream, format)
+        elapsed = time.monotonic() - started
+        report.write(self.style.SUCCESS(
+            "Exported %d products in %.1fs (%d rows/s)." % (written, elapsed, written / max(elapsed, 1e-6))
+        ))
+
+    def export(self, rows, stream, format):
+        writer = RowWriter(stream, format)
+        written = 0
+        for row in rows:
+            writer.write(row)
+            written += 1
+        return written
@@ -0,0 +1,55 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from category.models import Category
+from store.images import derivative_job, has_derivatives, render_derivatives
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Render pre-sized WebP/JPEG derivatives for product and category images."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type = int, default = os.cpu_count(),
+            help = "Number of worker processes (default: one per CPU).",
+        )
+        parser.add_argument(
+            '--force', action = 'store_true',
+            help = "Re-render derivatives that are already up to date.",
+        )
+
+    def handle(self, *args, **options):
+        names = set(Product.objects.exclude(image = '').values_list('image', flat = True).iterator())
+        names.update(Category.objects.exclude(cat_image = '').values_list('cat_image', flat = True).iterator())
+
+        jobs = []
+        missing = 0
+        for name in sorted(names):
+            if not os.path.exists(default_storage.path(name)):
+                missing += 1
+                continue
+            if options['force'] or not has_derivatives(name):
+                jobs.append(derivative_job(name))
+
+        started = time.monotonic()
+        written = failed = 0
+        with ProcessPoolExecutor(max_workers = options['workers']) as executor:
+            futures = [executor.submit(render_derivatives, source, targets) for source, targets in jobs]
+            for future, (source, _) in zip(futures, jobs):
+                try:
+                    written += future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write("%s: %s" % (source, exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Rendered %d files for %d images in %.1fs (%d up to date, %d missing, %d failed)." % (
+                written, len(jobs) - failed, time.monotonic() - started,
+                len(names) - len(jobs) - missing, missing, failed,
+            )
+        ))
@@ -0,0 +1,169 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from category.models import Category
+from shipshop.cache import bump_version
+from store.models import Product
+from store.transfer import FORMATS, guess_format, parse_bool, parse_int, read_rows
+
+UPDATE_FIELDS = ['product_name', 'description', 'price', 'stock', 'is_available', 'image', 'category', 'modified_date']
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or JSON Lines file, matched on "
+        "slug. Columns: product_name, slug (optional, generated from the "
+        "name), description, price, stock, is_available, image, category "
+        "(category slug)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help = "File to read, or - for standard input.")
+        parser.add_argument('--format', choices = FORMATS, help = "Default: guessed from the file name, else csv.")
+        parser.add_argument('--batch-size', type = int, default = 2000, help = "Rows written per transaction.")
+        parser.add_argument('--database', default = 'default')
+        parser.add_argument('--max-errors', type = int, default = 20, help = "Rejected rows to print.")
+
+    def handle(self, *args, **options):
+        self.using = options['database']
+        self.batch_size = options['batch_size']
+        self.max_errors = options['max_errors']
+        self.created = self.updated = self.rejected = 0
+        format = options['format'] or guess_format(options['path'])
+
+        # The whole category table is small: resolve slugs from memory.
+        self.categories = dict(Category.objects.using(self.using).values_list('slug', 'id'))
+
+        started = time.monotonic()
+        if options['path'] == '-':
+            self.load(sys.stdin, format)
+        else:
+            with open(options['path'], newline = '', encoding = 'utf-8') as stream:
+                self.load(stream, format)
+        elapsed = time.monotonic() - started
+
+        bump_version('catalog')
+        rows = self.created + self.updated
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d products (%d created, %d updated, %d rejected) in %.1fs (%d rows/s)." % (
+                rows, self.created, self.updated, self.rejected, elapsed, rows / max(elapsed, 1e-6),
+            )
+        ))
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if self.rejected <= self.max_errors:
+            self.stderr.write("Row %d rejected: %s" % (line, reason))
+
+    def load(self, stream, format):
+        chunk = {}
+        for line, row in enumerate(read_rows(stream, format), start = 1):
+            if isinstance(row, Exception):
+                self.reject(line, row)
+                continue
+            try:
+                product = self.build(row)
+            except (KeyError, TypeError, ValueError) as exc:
+                self.reject(line, exc)
+                continue
+            # A slug repeated within a chunk keeps its last row.
+            chunk[product.slug] = (line, product)
+            if len(chunk) >= self.batch_size:
+                self.write(chunk)
+                chunk = {}
+        if chunk:
+            self.write(chunk)
+
+    def build(self, row):
+        """
+        Turn one input row into an unsaved Product.
+        """
+        name = (row.get('product_name') or '').strip()
+        if not name:
+            raise ValueError('product_name is required')
+        slug = (row.get('slug') or '').strip() or slugify(name)
+        if not slug:
+            raise ValueError('cannot generate a slug from %r' % name)
+        category = (row.get('category') or '').strip()
+        if category not in self.categories:
+            raise ValueError('unknown category %r' % category)
+        is_available = row.get('is_available')
+        return Product(
+            product_name = name,
+            slug = slug,
+            description = row.get('description') or '',
+            price = parse_int(row['price']),
+            stock = parse_int(row['stock']),
+            is_available = True if is_available is None else parse_bool(is_available),
+            image = row.get('image') or '',
+            category_id = self.categories[category],
+        )
+
+    def write(self, chunk):
+        """
+        Upsert one chunk of products in a single transaction: rows whose slug
+        exists are updated with ``bulk_update``, the rest inserted with
+        ``bulk_create``.
+
+        Rows whose product name belongs to another product are rejected. If
+        the chunk still hits a constraint, it is retried one row at a time
+        so only the offending rows are rejected.
+        """
+        chunk = self.check_names(chunk)
+        try:
+            with transaction.atomic(using = self.using):
+                self.upsert(chunk)
+        except IntegrityError:
+            for slug, (line, product) in chunk.items():
+                try:
+                    with transaction.atomic(using = self.using):
+                        self.upsert({slug: (line, product)})
+                except IntegrityError as exc:
+                    self.reject(line, exc)
+
+    def check_names(self, chunk):
+        """
+        Return ``chunk`` without the rows that would reuse the name of a
+        product with another slug, in the database or earlier in the chunk.
+        """
+        names = [product.product_name for line, product in chunk.values()]
+        owners = dict(
+            Product.objects.using(self.using).filter(product_name__in = names).values_list('product_name', 'slug')
+        )
+        checked = {}
+        for slug, (line, product) in chunk.items():
+            owner = owners.setdefault(product.product_name, slug)
+            if owner != slug:
+                self.reject(line, 'product_name %r is already used by %r' % (product.product_name, owner))
+            else:
+                checked[slug] = (line, product)
+        return checked
+
+    def upsert(self, chunk):
+        """
+        Write one chunk. ``Product.objects.bulk_update()`` and
+        ``bulk_create()`` refresh the search index of the rows they write, so
+        the chunk is searchable when its transaction commits.
+        """
+        products = Product.objects.using(self.using)
+        now = timezone.now()
+        existing = dict(products.filter(slug__in = list(chunk)).values_list('slug', 'id'))
+        updates, creates = [], []
+        for slug, (line, product) in chunk.items():
+            if slug in existing:
+                product.pk = existing[slug]
+                product.modified_date = now
+                updates.append(product)
+            else:
+                creates.append(product)
+        if updates:
+            products.bulk_update(updates, UPDATE_FIELDS, batch_size = 500)
+        if creates:
+            products.bulk_create(creates)
+        self.updated += len(updates)
+        self.created += len(creates)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from the Product table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default = 'default', help = "Database alias to rebuild.")
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(using = options['database'])
+        if indexed is None:
+            self.stdout.write("This database backend does not use a separate search index.")
+        else:
+            self.stdout.write(self.style.SUCCESS("Indexed %d products." % indexed))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.counters import recount
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the products of every category and fix the stored "
+        "product_count/available_count where they have drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default = 'default')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        drifted = recount(using = options['database'])
+        elapsed = time.monotonic() - started
+        for category, stored, actual in drifted:
+            self.stdout.write("%s: %d/%d available -> %d/%d available" % (category.slug, *stored, *actual))
+        self.stdout.write(self.style.SUCCESS(
+            "Fixed %d categories in %.1fs." % (len(drifted), elapsed)
+        ))
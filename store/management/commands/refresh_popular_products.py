@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.popularity import refresh_popular_products
+
+
+class Command(BaseCommand):
+    help = "Recompute the home page's popular products from recent cart activity."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type = int, help = "Number of products to keep.")
+        parser.add_argument('--days', type = int, help = "Only count carts from the last DAYS days.")
+
+    def handle(self, *args, **options):
+        rows = refresh_popular_products(limit = options['limit'], days = options['days'])
+        self.stdout.write(self.style.SUCCESS("Stored %d popular products." % len(rows)))
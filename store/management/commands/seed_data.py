@@ -0,0 +1,217 @@
+import datetime
+import os
+import random
+import time
+from array import array
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from accounts.models import Account
+from carts.models import Cart, CartItem
+from category.models import Category
+from shipshop.cache import bump_version
+from store.models import PopularProduct, Product
+from store.search import rebuild_index
+
+WORDS = (
+    'classic slim regular relaxed vintage washed stretch organic cotton linen '
+    'denim leather suede wool fleece canvas casual formal sport outdoor summer '
+    'winter lightweight heavyweight striped plain printed checked graphic basic '
+    'premium essential everyday travel urban street black white blue red green '
+    'grey navy olive beige brown pink yellow orange shirt tshirt jeans jacket '
+    'hoodie sweater shoes sneakers boots cap shorts chinos polo coat vest'
+).split()
+FIRST_NAMES = 'Ava Ben Chloe Dan Emma Finn Grace Hugo Isla Jack Kai Lena Max Nora Omar Priya Ravi Sara Tom Zoe'.split()
+LAST_NAMES = 'Adams Brown Chen Diaz Evans Fischer Garcia Hill Ito Jones Khan Lopez Meyer Nair Olsen Patel Rossi Singh Tanaka Wu'.split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the catalog, cart and account tables with a deterministic synthetic "
+        "dataset for scale testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type = int, default = 50)
+        parser.add_argument('--products', type = int, default = 10000)
+        parser.add_argument('--carts', type = int, default = 5000)
+        parser.add_argument('--max-items', type = int, default = 5, help = "Maximum lines per cart.")
+        parser.add_argument('--accounts', type = int, default = 1000)
+        parser.add_argument('--cart-days', type = int, default = 60, help = "Spread cart dates over this many days.")
+        parser.add_argument('--seed', type = int, default = 0, help = "Random seed; the same seed yields the same data.")
+        parser.add_argument('--batch-size', type = int, default = 10000, help = "Rows per bulk_create and transaction.")
+        parser.add_argument('--database', default = 'default')
+        parser.add_argument(
+            '--flush', action = 'store_true',
+            help = "Delete all existing products, categories, carts and non-staff accounts first.",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.using = options['database']
+        self.batch_size = options['batch_size']
+
+        connection = connections[self.using]
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            # Seeding is restartable; trade durability for a much faster load.
+            # (SQLite refuses the change inside a transaction, e.g. in tests.)
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+        if options['products'] and not options['categories']:
+            raise CommandError("Products need at least one category.")
+        if options['flush']:
+            self.flush()
+        elif Product.objects.using(self.using).exists() or Category.objects.using(self.using).exists():
+            raise CommandError("The catalog is not empty; use --flush to replace it.")
+
+        started = time.monotonic()
+        category_ids = self.seed_categories(options['categories'])
+        product_ids = self.seed_products(options['products'], category_ids)
+        self.seed_carts(options['carts'], options['max_items'], options['cart_days'], product_ids)
+        self.seed_accounts(options['accounts'])
+
+        index_started = time.monotonic()
+        self.report("Search index", rebuild_index(using = self.using) or 0, index_started)
+        bump_version('catalog')
+        bump_version('category')
+        self.stdout.write(self.style.SUCCESS("Seeded in %.1fs." % (time.monotonic() - started)))
+
+    def report(self, label, rows, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write("%s: %d rows in %.1fs (%d rows/s)" % (label, rows, elapsed, rows / max(elapsed, 1e-6)))
+
+    def bulk_insert(self, model, objects):
+        """
+        Insert objects in chunks of ``batch_size``, one transaction per chunk.
+
+        Returns:
+            array: Primary keys of the inserted rows, in order
+        """
+        ids = array('q')
+        chunk = []
+
+        def write():
+            with transaction.atomic(using = self.using):
+                created = model.objects.using(self.using).bulk_create(chunk, batch_size = self.batch_size)
+            ids.extend(obj.pk for obj in created if obj.pk is not None)
+            chunk.clear()
+
+        for obj in objects:
+            chunk.append(obj)
+            if len(chunk) >= self.batch_size:
+                write()
+        if chunk:
+            write()
+        return ids
+
+    def flush(self):
+        # Plain DELETE/TRUNCATE statements: a queryset delete() would load
+        # every row to run the Product signal handlers.
+        connection = connections[self.using]
+        tables = [model._meta.db_table for model in (CartItem, Cart, PopularProduct, Product, Category)]
+        connection.ops.execute_sql_flush(
+            connection.ops.sql_flush(no_style(), tables, allow_cascade = True)
+        )
+        Account.objects.using(self.using).filter(is_staff = False, is_admin = False).delete()
+
+    def seed_categories(self, count):
+        def categories():
+            for i in range(count):
+                name = '%s %s %d' % (self.rng.choice(WORDS).title(), self.rng.choice(WORDS).title(), i)
+                yield Category(category_name = name, slug = slugify(name), description = 'Synthetic category %d' % i)
+
+        started = time.monotonic()
+        ids = self.bulk_insert(Category, categories())
+        self.report("Categories", count, started)
+        if not ids:
+            ids.extend(Category.objects.using(self.using).values_list('id', flat = True))
+        return ids
+
+    def seed_products(self, count, category_ids):
+        images_dir = os.path.join(settings.MEDIA_ROOT, 'photos', 'product')
+        images = sorted(
+            'photos/product/%s' % name for name in os.listdir(images_dir)
+        ) if os.path.isdir(images_dir) else ['photos/product/placeholder.jpg']
+
+        def products():
+            rng = self.rng
+            for i in range(count):
+                words = rng.sample(WORDS, 3)
+                name = '%s %d' % (' '.join(words).title(), i)
+                yield Product(
+                    product_name = name,
+                    slug = slugify(name),
+                    description = ' '.join(rng.choices(WORDS, k = 20)).capitalize() + '.',
+                    price = rng.randint(5, 2000),
+                    image = images[i % len(images)],
+                    stock = rng.randint(0, 100),
+                    is_available = rng.random() < 0.95,
+                    category_id = category_ids[rng.randrange(len(category_ids))],
+                )
+
+        started = time.monotonic()
+        ids = self.bulk_insert(Product, products())
+        self.report("Products", count, started)
+        if not ids:
+            ids.extend(Product.objects.using(self.using).values_list('id', flat = True))
+        return ids
+
+    def seed_carts(self, count, max_items, days, product_ids):
+        if not count or not product_ids:
+            return
+        started = time.monotonic()
+        cart_ids = self.bulk_insert(Cart, (Cart(cart_id = 'seed%028d' % i) for i in range(count)))
+        self.report("Carts", count, started)
+        if not cart_ids:
+            cart_ids.extend(Cart.objects.using(self.using).order_by('id').values_list('id', flat = True))
+
+        # date_added and last_active are set on save, so spread the carts evenly
+        # over the past days afterwards with one ranged UPDATE per day instead
+        # of one per cart.
+        today = timezone.now().date()
+        days = max(days, 1)
+        step = -(-len(cart_ids) // days)
+        with transaction.atomic(using = self.using):
+            for day, start in enumerate(range(0, len(cart_ids), step)):
+                chunk = cart_ids[start:start + step]
+                added = today - datetime.timedelta(days = day)
+                Cart.objects.using(self.using).filter(id__gte = chunk[0], id__lte = chunk[-1]).update(
+                    date_added = added, last_active = added
+                )
+
+        def items():
+            rng = self.rng
+            lines = min(max_items, len(product_ids))
+            for cart_id in cart_ids:
+                for index in rng.sample(range(len(product_ids)), rng.randint(1, lines)):
+                    yield CartItem(cart_id = cart_id, products_id = product_ids[index], quantity = rng.randint(1, 3))
+
+        started = time.monotonic()
+        self.report("Cart items", len(self.bulk_insert(CartItem, items())), started)
+
+    def seed_accounts(self, count):
+        password = make_password('password', salt = 'seeddata')
+
+        def accounts():
+            rng = self.rng
+            for i in range(count):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                yield Account(
+                    first_name = first,
+                    last_name = last,
+                    username = 'seed%d' % i,
+                    email = 'seed%d@example.com' % i,
+                    phone_number = '555%07d' % rng.randrange(10 ** 7),
+                    password = password,
+                    is_active = True,
+                )
+
+        started = time.monotonic()
+        self.report("Accounts", len(self.bulk_insert(Account, accounts())), started)
@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over the local read replicas "
+        "(settings.DATABASE_REPLICAS, see SHIPSHOP_SQLITE_REPLICAS). Run it "
+        "again to catch the replicas up; real replicas replicate by themselves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs = '*', help = "Replicas to copy to (default: all).")
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        if not aliases:
+            raise CommandError("No replicas configured; set SHIPSHOP_SQLITE_REPLICAS.")
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.in_atomic_block:
+            # The backup would wait for the open write transaction forever.
+            raise CommandError("Cannot copy the primary inside a transaction.")
+        for alias in aliases:
+            if alias not in settings.DATABASE_REPLICAS:
+                raise CommandError("%r is not a replica." % alias)
+            replica = connections[alias]
+            if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+                raise CommandError("Only SQLite replicas can be copied.")
+            primary.ensure_connection()
+            replica.ensure_connection()
+            started = time.perf_counter()
+            # The online backup API copies a consistent snapshot page by page
+            # while the primary stays writable.
+            primary.connection.backup(replica.connection)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS("Copied the primary to %s in %.2fs." % (alias, elapsed)))
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+FTS_TABLE = 'store_product_fts'
+PG_DOCUMENT = (
+    "to_tsvector('english', coalesce(product_name, '') || ' ' || coalesce(description, ''))"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+            "product_name, description, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')" % FTS_TABLE
+        )
+        schema_editor.execute(
+            'INSERT INTO %s (rowid, product_name, description) '
+            'SELECT id, product_name, description FROM store_product' % FTS_TABLE
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS store_product_search_idx '
+            'ON store_product USING GIN ((%s))' % PG_DOCUMENT
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
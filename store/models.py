@@ -1,8 +1,154 @@
-from django.db import models
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import models, router, transaction
 from category.models import Category
-from django.urls import reverse
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.utils import timezone
+
+from shipshop.cache import bump_version
+from .counters import Deltas, recount
 # Create your models here.
 
+@lru_cache(maxsize = 10000)
+def _product_url(category_slug, product_slug, urlconf, script_prefix):
+    return reverse('product_detail', urlconf = urlconf, args = [category_slug, product_slug])
+
+def _category_id(value):
+    """
+    Return the category id a ``category``/``category_id`` update sets, or
+    None if it cannot be known before running the query (an expression).
+    """
+    if isinstance(value, Category):
+        return value.pk
+    if isinstance(value, int):
+        return value
+    return None
+
+
+# Columns mirrored into the full-text search index (store.search).
+SEARCH_FIELDS = {'product_name', 'description'}
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    Does for the bulk operations, which send no signals, what the save
+    signals do for ``save()``:
+
+    - keeps the category counters (``store.counters``) right, computing the
+      changes from the rows touched, in the same transaction;
+    - stamps ``modified_date``, which only ``save()`` sets;
+    - refreshes the search index of created and updated rows;
+    - bumps the ``catalog`` version on commit, so listing ETags, cached
+      facets and the suggestion index see the change.
+    """
+
+    def _changed(self, ids = None, fields = ()):
+        """
+        Follow up on bulk-written rows, inside the writing transaction.
+        """
+        if ids and SEARCH_FIELDS & set(fields):
+            from .search import index_products
+            index_products(ids, using = self.db)
+        transaction.on_commit(lambda: bump_version('catalog'), using = self.db)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using = self.db, savepoint = False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # Which rows were really inserted is not reported back.
+                recount(using = self.db)
+            else:
+                deltas = Deltas()
+                for obj in created:
+                    deltas.add(obj.category_id, obj.is_available)
+                deltas.save(using = self.db)
+            if created:
+                ids = [obj.pk for obj in created if obj.pk is not None]
+                if len(ids) < len(created):
+                    # Conflicting rows may come back without a primary key.
+                    ids += self.filter(
+                        slug__in = [obj.slug for obj in created if obj.pk is None],
+                    ).values_list('pk', flat = True)
+                self._changed(ids, SEARCH_FIELDS)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if 'modified_date' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.modified_date = now
+            fields = list(fields) + ['modified_date']
+        # QuerySet.bulk_update() runs update(), which must not count again.
+        plain = models.QuerySet(self.model, query = self.query.chain(), using = self._db, hints = self._hints)
+        moves_category = bool({'category', 'category_id'} & set(fields))
+        if not moves_category and 'is_available' not in fields:
+            with transaction.atomic(using = self.db, savepoint = False):
+                rows = plain.bulk_update(objs, fields, *args, **kwargs)
+                if rows:
+                    self._changed([obj.pk for obj in objs], fields)
+            return rows
+        with transaction.atomic(using = self.db, savepoint = False):
+            before = {
+                pk: (category_id, is_available)
+                for pk, category_id, is_available in self.model._base_manager.using(self.db)
+                .filter(pk__in = [obj.pk for obj in objs])
+                .values_list('pk', 'category_id', 'is_available')
+            }
+            rows = plain.bulk_update(objs, fields, *args, **kwargs)
+            deltas = Deltas()
+            for obj in objs:
+                if obj.pk in before:
+                    category_id, is_available = before[obj.pk]
+                    deltas.move(before[obj.pk], (
+                        obj.category_id if moves_category else category_id,
+                        obj.is_available if 'is_available' in fields else is_available,
+                    ))
+            deltas.save(using = self.db)
+            if rows:
+                self._changed([obj.pk for obj in objs], fields)
+        return rows
+
+    def update(self, **kwargs):
+        kwargs.setdefault('modified_date', timezone.now())
+        with transaction.atomic(using = self.db, savepoint = False):
+            ids = list(self.values_list('pk', flat = True)) if SEARCH_FIELDS & set(kwargs) else None
+            rows = self._update_counted(**kwargs)
+            if rows:
+                self._changed(ids, kwargs)
+        return rows
+
+    def _update_counted(self, **kwargs):
+        """
+        Run ``update()`` and adjust the category counters for it.
+        """
+        moves_category = 'category' in kwargs or 'category_id' in kwargs
+        if not moves_category and 'is_available' not in kwargs:
+            return super().update(**kwargs)
+        category_id = _category_id(kwargs.get('category_id', kwargs.get('category')))
+        is_available = kwargs.get('is_available')
+        if (moves_category and category_id is None) or ('is_available' in kwargs and not isinstance(is_available, bool)):
+            # The new values are expressions, only known to the database.
+            rows = super().update(**kwargs)
+            recount(using = self.db)
+            return rows
+        groups = list(
+            self.order_by().values('category_id', 'is_available')
+            .annotate(products = models.Count('pk'))
+            .values_list('category_id', 'is_available', 'products')
+        )
+        rows = super().update(**kwargs)
+        deltas = Deltas()
+        for old_category_id, was_available, products in groups:
+            deltas.move((old_category_id, was_available), (
+                category_id if moves_category else old_category_id,
+                is_available if 'is_available' in kwargs else was_available,
+            ), products)
+        deltas.save(using = self.db)
+        return rows
+
+
 class Product(models.Model):
     product_name    = models.CharField(max_length=100, unique=True)
     slug            = models.SlugField(max_length=200, unique=True)
@@ -11,21 +157,77 @@ class Product(models.Model):
     image           = models.ImageField(upload_to='photos/product')
     stock           = models.IntegerField()
     is_available    = models.BooleanField(default=True)
+    # Keeps its plain index: the listing indexes below only hold available
+    # products, and cascades, counters and the admin filter on all of them.
     category        = models.ForeignKey(Category, on_delete=models.CASCADE)
     created_date    = models.DateTimeField(auto_now_add=True)
     modified_date   = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Listings only ever show available products, so the listing indexes
+        # are partial: smaller, and matched by Django's bare boolean filter
+        # ("WHERE is_available"), which a full (is_available, ...) index
+        # cannot seek on in SQLite.
+        indexes = [
+            # Category listings: WHERE category_id = ? AND is_available ORDER BY id
+            models.Index(
+                fields = ['category', 'id'], condition = models.Q(is_available = True),
+                name = 'product_category_listing_idx',
+            ),
+            # Store listing and its count: WHERE is_available ORDER BY id
+            models.Index(
+                fields = ['id'], condition = models.Q(is_available = True),
+                name = 'product_listing_idx',
+            ),
+            # Newest products and the "newest" sort:
+            # WHERE is_available ORDER BY created_date DESC, id DESC
+            models.Index(
+                fields = ['-created_date', '-id'], condition = models.Q(is_available = True),
+                name = 'product_newest_idx',
+            ),
+            # Price sorts and ranges (store.facets):
+            # WHERE is_available [AND price >= ? AND price < ?] ORDER BY price, id
+            models.Index(
+                fields = ['price', 'id'], condition = models.Q(is_available = True),
+                name = 'product_price_idx',
+            ),
+            # The same within a category; also covers the facet aggregate.
+            models.Index(
+                fields = ['category', 'price', 'id'], condition = models.Q(is_available = True),
+                name = 'product_category_price_idx',
+            ),
+            models.Index(
+                fields = ['category', '-created_date', '-id'], condition = models.Q(is_available = True),
+                name = 'product_category_newest_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # The save signals adjust the category counters; one transaction
+        # keeps them in step with the product row.
+        using = kwargs.get('using') or router.db_for_write(type(self), instance = self)
+        with transaction.atomic(using = using, savepoint = False):
+            super().save(*args, **kwargs)
+
     def get_url(self):
         """
         Generate the URL for this product's detail page.
         
         This method creates a URL that points to the product detail view
-        using the product's category slug and product slug.
+        using the product's category slug and product slug. URLs are
+        memoized per slug pair, so building one is a dictionary lookup; load
+        products with ``select_related('category')`` to avoid a Category
+        query per product.
         
         Returns:
             str: The URL path for the product detail page
         """
-        return reverse('product_detail', args = [self.category.slug, self.slug])
+        return _product_url(
+            self.category.slug, self.slug,
+            get_urlconf() or settings.ROOT_URLCONF, get_script_prefix(),
+        )
 
     def __str__(self):
         """
@@ -34,4 +236,26 @@ class Product(models.Model):
         Returns:
             str: The product name
         """
-        return self.product_name
\ No newline at end of file
+        return self.product_name
+
+
+class PopularProduct(models.Model):
+    product         = models.OneToOneField(Product, on_delete=models.CASCADE)
+    rank            = models.PositiveIntegerField()
+    score           = models.IntegerField()
+    refreshed_date  = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['rank']
+        indexes = [
+            models.Index(fields = ['rank'], name = 'popularproduct_rank_idx'),
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation of the PopularProduct instance.
+        
+        Returns:
+            str: The rank and product name
+        """
+        return '#%d %s' % (self.rank, self.product.product_name)
@@ -0,0 +1,273 @@
+"""
+Paginators for the product listings.
+
+``CachedCountPaginator`` is a drop-in ``Paginator`` whose total comes from the
+cache instead of running ``COUNT(*)`` on every request.
+
+``CursorPaginator`` pages by seek predicates on the ordering columns
+(``WHERE (sort_key, id) > (...)``) instead of ``OFFSET``, so the cost of a
+page no longer depends on how deep it is. Page boundaries travel in signed,
+opaque ``?after=`` / ``?before=`` tokens.
+
+Both have ``acount()`` and ``aget_page()`` for the async views; their pages
+hold lists, so rendering one runs no query.
+"""
+import hashlib
+from functools import cached_property
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+CURSOR_SALT = 'store.pagination.cursor'
+
+
+def cached_count(queryset, timeout = None):
+    """
+    Return the row count of a queryset, served from the cache when possible.
+
+    The count is keyed on the queryset's SQL and may be up to ``timeout``
+    seconds stale, which is fine for an "N items found" label.
+
+    Args:
+        queryset (QuerySet): The queryset to count
+        timeout (int, optional): Cache lifetime in seconds
+            (default: ``settings.STORE_COUNT_CACHE_TIMEOUT``)
+
+    Returns:
+        int: The (possibly slightly stale) number of rows
+    """
+    if timeout is None:
+        timeout = settings.STORE_COUNT_CACHE_TIMEOUT
+    key = _count_key(queryset)
+
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+async def acached_count(queryset, timeout = None):
+    """
+    Async version of ``cached_count()``.
+    """
+    if timeout is None:
+        timeout = settings.STORE_COUNT_CACHE_TIMEOUT
+    key = _count_key(queryset)
+
+    count = await cache.aget(key)
+    if count is None:
+        count = await queryset.acount()
+        await cache.aset(key, count, timeout)
+    return count
+
+
+def _count_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(('%s|%r' % (sql, params)).encode()).hexdigest()
+    return 'store:count:%s' % digest
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator that takes its total from ``cached_count``.
+    """
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
+
+    async def acount(self):
+        if 'count' not in self.__dict__:
+            self.count = await acached_count(self.object_list)
+        return self.count
+
+    async def aget_page(self, number):
+        """
+        Async version of ``get_page()``.
+        """
+        await self.acount()
+        page = self.get_page(number)
+        page.object_list = [obj async for obj in page.object_list]
+        return page
+
+
+class CursorPage:
+    """
+    One page of a ``CursorPaginator``.
+
+    Mirrors the parts of ``django.core.paginator.Page`` the templates use.
+    There are no page numbers in cursor mode, so ``is_cursor`` tells the
+    template to render plain previous/next links built from
+    ``previous_cursor`` and ``next_cursor``.
+    """
+    is_cursor = True
+    number = None
+
+    def __init__(self, object_list, paginator, has_previous, has_next):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __repr__(self):
+        return '<Cursor page of %d items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0])
+
+
+class CursorPaginator:
+    """
+    Keyset paginator over an ordered queryset.
+
+    Args:
+        object_list (QuerySet): The rows to paginate
+        per_page (int): Number of rows per page
+        ordering (tuple): Field names to order and seek by, ``-`` prefix for
+            descending. Must end in a unique column; ``id`` is appended
+            when missing.
+    """
+
+    def __init__(self, object_list, per_page, ordering = ('id',)):
+        ordering = tuple(ordering)
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering += ('-id',) if ordering[-1].startswith('-') else ('id',)
+        self.object_list = object_list.order_by(*ordering)
+        self.per_page = int(per_page)
+        self.ordering = ordering
+
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
+
+    async def acount(self):
+        if 'count' not in self.__dict__:
+            self.count = await acached_count(self.object_list)
+        return self.count
+
+    def encode_cursor(self, obj):
+        """
+        Return the opaque token pointing just past ``obj``.
+        """
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            values.append(value)
+        return signing.dumps(values, salt = CURSOR_SALT, compress = True)
+
+    def decode_cursor(self, token):
+        """
+        Return the ordering values stored in ``token``, or None if invalid.
+        """
+        try:
+            values = signing.loads(token, salt = CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            return None
+        return values
+
+    def _seek(self, values, forward):
+        """
+        Build the lexicographic "row comes after values" predicate.
+
+        ``(a, b, id) > (x, y, z)`` is expanded into
+        ``a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)``,
+        flipping the comparison for descending fields and for backward seeks.
+        """
+        predicate = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            ascending = not field.startswith('-')
+            lookup = 'gt' if ascending == forward else 'lt'
+            predicate |= equal & Q(**{'%s__%s' % (name, lookup): value})
+            equal &= Q(**{name: value})
+        return predicate
+
+    def _query(self, after, before):
+        """
+        Return the queryset of the requested page plus the decoded tokens.
+
+        One row more than a page is selected to tell whether there is a
+        further page; backward pages are selected in reverse order.
+        """
+        after = self.decode_cursor(after) if after else None
+        before = self.decode_cursor(before) if before else None
+
+        if before is not None:
+            reversed_ordering = [
+                field[1:] if field.startswith('-') else '-' + field
+                for field in self.ordering
+            ]
+            queryset = self.object_list.filter(self._seek(before, forward = False)).order_by(*reversed_ordering)
+        else:
+            queryset = self.object_list
+            if after is not None:
+                queryset = queryset.filter(self._seek(after, forward = True))
+        return queryset[:self.per_page + 1], after, before
+
+    def _page(self, rows, after, before):
+        if before is not None:
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self, has_previous = has_previous, has_next = True)
+
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, has_previous = after is not None, has_next = has_next)
+
+    def get_page(self, after = None, before = None):
+        """
+        Return the page following ``after`` or preceding ``before``.
+
+        Invalid or missing tokens yield the first page.
+
+        Args:
+            after (str, optional): Token of the last row of the previous page
+            before (str, optional): Token of the first row of the next page
+
+        Returns:
+            CursorPage: The requested page
+        """
+        queryset, after, before = self._query(after, before)
+        return self._page(list(queryset), after, before)
+
+    async def aget_page(self, after = None, before = None):
+        """
+        Async version of ``get_page()``.
+        """
+        queryset, after, before = self._query(after, before)
+        return self._page([obj async for obj in queryset], after, before)
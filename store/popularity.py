@@ -0,0 +1,109 @@
+"""
+Materialized "Popular products" ranking for the home page.
+
+Products are ranked by how many carts they were added to recently (total
+units as tie-breaker). The top of the ranking is written to the small
+``PopularProduct`` table by ``manage.py refresh_popular_products``, meant to
+run on a schedule, so the home page reads a handful of rows instead of
+aggregating cart activity or listing the whole catalog.
+"""
+import datetime
+from contextlib import aclosing
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from carts.models import CartItem
+from .models import PopularProduct, Product
+
+
+def refresh_popular_products(limit = None, days = None):
+    """
+    Recompute the popularity ranking and replace the stored top-N.
+
+    Args:
+        limit (int, optional): Number of products to keep
+            (default: ``settings.POPULAR_PRODUCTS_LIMIT``)
+        days (int, optional): Only count carts created in the last ``days`` days
+            (default: ``settings.POPULAR_PRODUCTS_DAYS``)
+
+    Returns:
+        list: The stored PopularProduct rows, best first
+    """
+    limit = limit or settings.POPULAR_PRODUCTS_LIMIT
+    days = days or settings.POPULAR_PRODUCTS_DAYS
+    since = timezone.now().date() - datetime.timedelta(days = days)
+
+    ranking = (
+        CartItem.objects.filter(products__is_available = True, cart__date_added__gte = since)
+        .values('products')
+        .annotate(carts = Count('cart'), units = Sum('quantity'))
+        .order_by('-carts', '-units', 'products')[:limit]
+    )
+    rows = [
+        PopularProduct(product_id = row['products'], rank = rank, score = row['carts'])
+        for rank, row in enumerate(ranking, start = 1)
+    ]
+
+    with transaction.atomic():
+        PopularProduct.objects.all().delete()
+        return PopularProduct.objects.bulk_create(rows)
+
+
+def popular_products(limit = None):
+    """
+    Return the products to show under "Popular products".
+
+    Reads the materialized ranking in one query. Until the ranking has been
+    computed, the newest available products are shown instead.
+
+    Args:
+        limit (int, optional): Maximum number of products
+            (default: ``settings.POPULAR_PRODUCTS_LIMIT``)
+
+    Returns:
+        list: Product instances with their category loaded
+    """
+    limit = limit or settings.POPULAR_PRODUCTS_LIMIT
+    # Walk the ranking in rank order and skip products that became
+    # unavailable since the last refresh in Python: filtering on the product
+    # in SQL makes SQLite drive the join from the product table instead.
+    products = []
+    ranking = PopularProduct.objects.select_related('product__category').iterator(chunk_size = limit)
+    for popular in ranking:
+        if popular.product.is_available:
+            products.append(popular.product)
+            if len(products) == limit:
+                break
+    if not products:
+        products = list(
+            Product.objects.filter(is_available = True)
+            .select_related('category')
+            .order_by('-created_date')[:limit]
+        )
+    return products
+
+
+async def apopular_products(limit = None):
+    """
+    Async version of ``popular_products()``.
+    """
+    limit = limit or settings.POPULAR_PRODUCTS_LIMIT
+    products = []
+    ranking = PopularProduct.objects.select_related('product__category').aiterator(chunk_size = limit)
+    async with aclosing(ranking):
+        async for popular in ranking:
+            if popular.product.is_available:
+                products.append(popular.product)
+                if len(products) == limit:
+                    break
+    if not products:
+        products = [
+            product
+            async for product in Product.objects.filter(is_available = True)
+            .select_related('category')
+            .order_by('-created_date')[:limit]
+        ]
+    return products
@@ -0,0 +1,279 @@
+"""
+Full-text search over the product catalog.
+
+On SQLite the searchable columns of every product are mirrored into an FTS5
+table (``store_product_fts``, rowid = product id) that is kept in sync by the
+signal handlers in ``store.signals``. On PostgreSQL the same lookups run
+against a GIN-indexed ``tsvector`` expression over ``store_product`` itself,
+so nothing has to be mirrored. Other backends fall back to ``icontains``.
+"""
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Product
+
+FTS_TABLE = 'store_product_fts'
+
+# Must stay identical to the expression indexed in migration 0002, otherwise
+# PostgreSQL cannot use the GIN index.
+PG_DOCUMENT = (
+    "to_tsvector('english', coalesce(product_name, '') || ' ' || coalesce(description, ''))"
+)
+PG_RANK_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(product_name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+# bm25() column weights: a hit in the product name outranks one in the description.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+
+def _terms(keyword):
+    return re.findall(r'\w+', keyword or '')
+
+
+def _vendor(using):
+    return connections[using].vendor
+
+
+class ProductSearch:
+    """
+    Ranked search results for a keyword, evaluated lazily.
+
+    The object behaves like a sliceable sequence so it can be handed straight
+    to ``Paginator``: ``count()`` runs one COUNT against the index and slicing
+    fetches only the ids of the requested page, best match first, followed by
+    a single query for those products. Every term is prefix matched, so
+    "jea" finds "Jeans".
+    """
+
+    def __init__(self, keyword, using = None):
+        self.terms = _terms(keyword)
+        self.using = using or router.db_for_read(Product)
+        self._count = None
+
+    def _fallback(self):
+        query = Q()
+        for term in self.terms:
+            query &= Q(description__icontains = term) | Q(product_name__icontains = term)
+        return Product.objects.using(self.using).filter(query).order_by('-created_date')
+
+    def _match(self):
+        """
+        Return ``(from_where_sql, params)`` selecting the matching rows.
+        """
+        vendor = _vendor(self.using)
+        if vendor == 'sqlite':
+            match = ' '.join('"%s"*' % term for term in self.terms)
+            return '%s WHERE %s MATCH %%s' % (FTS_TABLE, FTS_TABLE), [match]
+        if vendor == 'postgresql':
+            match = ' & '.join('%s:*' % term for term in self.terms)
+            return "store_product WHERE %s @@ to_tsquery('english', %%s)" % PG_DOCUMENT, [match]
+        return None, None
+
+    def count(self):
+        """
+        Return the number of matching products.
+        """
+        if self._count is None:
+            if not self.terms:
+                self._count = 0
+            else:
+                sql, params = self._match()
+                if sql is None:
+                    self._count = self._fallback().count()
+                else:
+                    with connections[self.using].cursor() as cursor:
+                        cursor.execute('SELECT COUNT(*) FROM ' + sql, params)
+                        self._count = cursor.fetchone()[0]
+        return self._count
+
+    async def acount(self):
+        """
+        Async version of ``count()``.
+
+        The index is queried with raw SQL, which has no async API, so the
+        COUNT runs in a thread.
+        """
+        if self._count is None:
+            await sync_to_async(self.count)()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def ranked_ids(self, offset = 0, limit = None):
+        """
+        Return matching product ids ordered by relevance.
+
+        Args:
+            offset (int): Number of leading results to skip
+            limit (int, optional): Maximum number of ids to return
+
+        Returns:
+            list: Product primary keys, best match first
+        """
+        if not self.terms:
+            return []
+        sql, params = self._match()
+        if sql is None:
+            ids = self._fallback().values_list('id', flat = True)
+            return list(ids[offset:None if limit is None else offset + limit])
+
+        vendor = _vendor(self.using)
+        if vendor == 'sqlite':
+            select = 'SELECT rowid FROM %s ORDER BY bm25(%s, %s, %s), rowid DESC' % (
+                sql, FTS_TABLE, NAME_WEIGHT, DESCRIPTION_WEIGHT,
+            )
+            order_params = []
+        else:
+            select = "SELECT id FROM %s ORDER BY ts_rank(%s, to_tsquery('english', %%s)) DESC, id DESC" % (
+                sql, PG_RANK_DOCUMENT,
+            )
+            order_params = params
+        # SQLite spells "no limit" as LIMIT -1, PostgreSQL as LIMIT ALL (NULL).
+        if limit is None and vendor == 'sqlite':
+            limit = -1
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(select + ' LIMIT %s OFFSET %s', params + order_params + [limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                raise IndexError('Negative indexing is not supported.')
+            results = self[key:key + 1]
+            if not results:
+                raise IndexError(key)
+            return results[0]
+
+        start = key.start or 0
+        limit = None if key.stop is None else max(key.stop - start, 0)
+        ids = self.ranked_ids(start, limit)
+        products = Product.objects.using(self.using).select_related('category').in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+    async def aslice(self, start, stop):
+        """
+        Async version of ``self[start:stop]``.
+        """
+        ids = await sync_to_async(self.ranked_ids)(start, max(stop - start, 0))
+        products = await Product.objects.using(self.using).select_related('category').ain_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+
+class SearchPaginator(Paginator):
+    """
+    Paginator over a ``ProductSearch`` with an async ``get_page()``.
+    """
+
+    async def aget_page(self, number):
+        """
+        Async version of ``get_page()``.
+        """
+        await self.object_list.acount()
+        try:
+            number = self.validate_number(number)
+        except PageNotAnInteger:
+            number = 1
+        except EmptyPage:
+            number = self.num_pages
+        bottom = (number - 1) * self.per_page
+        objects = await self.object_list.aslice(bottom, bottom + self.per_page)
+        return self._get_page(objects, number, self)
+
+
+def _uses_fts(using):
+    return _vendor(using) == 'sqlite'
+
+
+def index_product(product, using = None):
+    """
+    Add or refresh a product's row in the SQLite full-text index.
+
+    Args:
+        product (Product): The saved product instance
+        using (str, optional): Database alias the product was saved to
+    """
+    using = using or router.db_for_write(Product)
+    if not _uses_fts(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product.pk])
+        cursor.execute(
+            'INSERT INTO %s (rowid, product_name, description) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+            [product.pk, product.product_name, product.description],
+        )
+
+
+def index_products(ids, using = None):
+    """
+    Refresh the SQLite full-text index rows of several products at once,
+    after writes that send no signals (``bulk_create``, ``bulk_update``,
+    ``QuerySet.update``).
+
+    Args:
+        ids (list): Primary keys of the changed products
+        using (str, optional): Database alias the products were written to
+    """
+    using = using or router.db_for_write(Product)
+    if not _uses_fts(using) or not ids:
+        return
+    ids = list(ids)
+    with connections[using].cursor() as cursor:
+        # Stay below SQLite's limit on query parameters.
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' % (FTS_TABLE, placeholders), chunk)
+            cursor.execute(
+                'INSERT INTO %s (rowid, product_name, description) '
+                'SELECT id, product_name, description FROM store_product WHERE id IN (%s)' % (FTS_TABLE, placeholders),
+                chunk,
+            )
+
+
+def unindex_product(product_id, using = None):
+    """
+    Remove a product from the SQLite full-text index.
+
+    Args:
+        product_id (int): Primary key of the deleted product
+        using (str, optional): Database alias the product was deleted from
+    """
+    using = using or router.db_for_write(Product)
+    if not _uses_fts(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product_id])
+
+
+def rebuild_index(using = None):
+    """
+    Rebuild the SQLite full-text index from ``store_product``.
+
+    Needed after writes that bypass both the model signals and
+    ``ProductQuerySet`` (``bulk_create``, raw SQL).
+
+    Args:
+        using (str, optional): Database alias to rebuild
+
+    Returns:
+        int: Number of indexed products, or None when the backend needs no index
+    """
+    using = using or router.db_for_write(Product)
+    if not _uses_fts(using):
+        return None
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute(
+            'INSERT INTO %s (rowid, product_name, description) '
+            'SELECT id, product_name, description FROM store_product' % FTS_TABLE
+        )
+        cursor.execute('SELECT COUNT(*) FROM %s' % FTS_TABLE)
+        return cursor.fetchone()[0]
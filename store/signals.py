@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from shipshop.cache import bump_version
+from .counters import product_moved
+from .images import schedule_derivatives
+from .models import Product
+from .search import index_product, unindex_product
+
+
+@receiver(pre_save, sender = Product)
+def product_saving(sender, instance, using, **kwargs):
+    """
+    Remember the stored category and availability of the product, for the
+    category counters.
+    """
+    instance._counted = None
+    if instance.pk is not None:
+        instance._counted = (
+            Product._base_manager.using(using).filter(pk = instance.pk)
+            .values_list('category_id', 'is_available').first()
+        )
+
+
+@receiver(post_save, sender = Product)
+def product_saved(sender, instance, using, **kwargs):
+    """
+    Keep the full-text search index, image derivatives, category counters
+    and catalog version in step with the saved product.
+    """
+    product_moved(getattr(instance, '_counted', None), (instance.category_id, instance.is_available), using = using)
+    index_product(instance, using = using)
+    schedule_derivatives(instance.image, using = using)
+    transaction.on_commit(lambda: bump_version('catalog'), using = using)
+
+
+@receiver(post_delete, sender = Product)
+def product_deleted(sender, instance, using, **kwargs):
+    """
+    Drop the deleted product from the full-text search index and the
+    category counters, and bump the catalog version.
+    """
+    product_moved((instance.category_id, instance.is_available), None, using = using)
+    unindex_product(instance.pk, using = using)
+    transaction.on_commit(lambda: bump_version('catalog'), using = using)
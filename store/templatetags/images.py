@@ -0,0 +1,33 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from store.images import FORMATS, derivatives_ready, srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, sizes = '100vw', **attrs):
+    """
+    Render an image with its pre-sized derivatives as ``srcset`` candidates.
+
+    Emits a ``<picture>`` with a WebP source and a JPEG ``srcset`` on the
+    ``<img>``, keeping the original upload as ``src``. Until the derivatives
+    have been rendered it falls back to a plain ``<img>`` of the original.
+
+    Usage::
+
+        {% responsive_image product.image sizes="(min-width: 768px) 25vw, 100vw" class="img-sm" %}
+    """
+    if not image:
+        return ''
+    if not derivatives_ready(image.name):
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+
+    webp, jpeg = (srcset(image.name, extension) for extension, _, _ in FORMATS)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        webp, sizes, image.url, jpeg, sizes, flatatt(attrs),
+    )
@@ -1,3 +1,1245 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.text import slugify
+from PIL import Image
+
+from accounts.models import Account
+from carts.models import Cart, CartItem
+from category.context_processor import get_menu_links
+from category.models import Category
+from store.models import PopularProduct, Product
+from store import views as store_views
+from store.autocomplete import SuggestionIndex
+from store.counters import actual_counts
+from store.facets import facet_rows
+from store.feeds import feed_state
+from store.images import derivative_job, derivative_name, derivatives_ready, has_derivatives, render_derivatives
+from store.pagination import CachedCountPaginator, CursorPaginator
+from store.popularity import popular_products, refresh_popular_products
+from store.search import ProductSearch
+from shipshop.cache import bump_version
+from shipshop.routers import PIN_SESSION_KEY
+from shipshop.timing import QueryBudgetExceeded, TimingMiddleware
 
 # Create your tests here.
+
+
+class ListingQueryCountTests(TestCase):
+    """
+    Rendering a product listing must cost the same number of queries
+    whatever the number of products on the page.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.categories = [
+            Category.objects.create(category_name = 'Category %d' % i, slug = 'category-%d' % i)
+            for i in range(3)
+        ]
+        self.created = 0
+
+    def add_products(self, count):
+        for _ in range(count):
+            self.created += 1
+            Product.objects.create(
+                product_name = 'Shirt %d' % self.created,
+                slug = 'shirt-%d' % self.created,
+                description = 'A cotton shirt',
+                price = 10,
+                image = 'photos/product/shirt.jpg',
+                stock = 5,
+                category = self.categories[self.created % len(self.categories)],
+            )
+
+    def count_queries(self, url):
+        # Warm the menu and session caches so only the page's own queries count.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_products(2)
+        small = self.count_queries(url)
+        self.add_products(20)
+        self.assertEqual(self.count_queries(url), small)
+
+    def test_home(self):
+        self.assertConstantQueries('/')
+
+    def test_store(self):
+        self.assertConstantQueries('/store/')
+
+    def test_search(self):
+        self.assertConstantQueries('/store/search/?keyword=shirt')
+
+    def test_cart(self):
+        self.add_products(2)
+        for product in Product.objects.all():
+            self.client.get('/cart/add_cart/%d/' % product.id)
+        small = self.count_queries('/cart/')
+        self.add_products(20)
+        for product in Product.objects.all()[2:]:
+            self.client.get('/cart/add_cart/%d/' % product.id)
+        self.assertEqual(self.count_queries('/cart/'), small)
+
+    def test_get_url_needs_no_queries(self):
+        self.add_products(5)
+        products = list(Product.objects.select_related('category'))
+        with self.assertNumQueries(0):
+            urls = [product.get_url() for product in products]
+        self.assertEqual(urls[0], '/store/category/%s/%s/' % (products[0].category.slug, products[0].slug))
+
+
+class PaginatorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        for i in range(11):
+            Product.objects.create(
+                product_name = 'Shirt %d' % i, slug = 'shirt-%d' % i, price = (i * 7) % 4, image = 'photos/product/shirt.jpg',
+                stock = 5, category = category,
+            )
+
+    def walk(self, paginator):
+        """
+        Page forward to the end, then back to the start, returning the ids seen.
+        """
+        forward, backward = [], []
+        page = paginator.get_page()
+        self.assertFalse(page.has_previous())
+        while True:
+            forward.append([product.id for product in page])
+            if not page.has_next():
+                break
+            page = paginator.get_page(after = page.next_cursor)
+        while page.has_previous():
+            page = paginator.get_page(before = page.previous_cursor)
+            backward.insert(0, [product.id for product in page])
+        backward.append(forward[-1])
+        self.assertEqual(forward, backward)
+        return [id for ids in forward for id in ids]
+
+    def test_cursor_round_trip(self):
+        for ordering in (('id',), ('price',), ('-price',), ('-created_date', '-id')):
+            paginator = CursorPaginator(Product.objects.all(), 3, ordering)
+            expected = list(Product.objects.order_by(*paginator.ordering).values_list('id', flat = True))
+            self.assertEqual(self.walk(paginator), expected, ordering)
+
+    def test_invalid_cursor_yields_first_page(self):
+        paginator = CursorPaginator(Product.objects.all(), 3, ('price',))
+        first = [product.id for product in paginator.get_page()]
+        token = paginator.get_page().next_cursor
+        for after in ('garbage', token[:-2] + 'xx', CursorPaginator(Product.objects.all(), 3).get_page().next_cursor):
+            page = paginator.get_page(after = after)
+            self.assertEqual([product.id for product in page], first, after)
+            self.assertFalse(page.has_previous())
+
+    def test_cached_count(self):
+        products = Product.objects.order_by('id')
+        self.assertEqual(CachedCountPaginator(products, 3).count, 11)
+        Product.objects.filter(pk = products.first().pk).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(CachedCountPaginator(products, 3).count, 11)
+        # A different query has its own count.
+        self.assertEqual(CachedCountPaginator(products.filter(price = 0), 3).count, products.filter(price = 0).count())
+        cache.clear()
+        self.assertEqual(CachedCountPaginator(products, 3).count, 10)
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Jeans', slug = 'jeans')
+        self.products = {
+            name: Product.objects.create(
+                product_name = name, slug = slugify(name), description = description, price = 10,
+                image = 'photos/product/jeans.jpg', stock = 5, category = category,
+            )
+            for name, description in (
+                ('Blue Jeans', 'Denim trousers'),
+                ('Denim Jacket', 'Goes with blue jeans'),
+                ('Red Shirt', 'Cotton'),
+            )
+        }
+
+    def search(self, keyword):
+        return [product.product_name for product in ProductSearch(keyword)[0:10]]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('jeans'), ['Blue Jeans', 'Denim Jacket'])
+        self.assertEqual(ProductSearch('jeans').count(), 2)
+        self.assertEqual(self.search('denim'), ['Denim Jacket', 'Blue Jeans'])
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search('jea'), ['Blue Jeans', 'Denim Jacket'])
+        self.assertEqual(self.search('blu jea'), ['Blue Jeans', 'Denim Jacket'])
+        self.assertEqual(self.search('shi'), ['Red Shirt'])
+        self.assertEqual(self.search('  '), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        shirt = self.products['Red Shirt']
+        shirt.product_name = 'Green Polo'
+        shirt.save()
+        self.assertEqual(self.search('shirt'), [])
+        self.assertEqual(self.search('polo'), ['Green Polo'])
+
+        shirt.delete()
+        self.assertEqual(self.search('polo'), [])
+        self.assertEqual(ProductSearch('polo').count(), 0)
+
+    def test_search_view(self):
+        response = self.client.get('/store/search/?keyword=jeans')
+        self.assertEqual([product.product_name for product in response.context['products']], ['Blue Jeans', 'Denim Jacket'])
+        self.assertEqual(response.context['product_count'], 2)
+
+
+@override_settings(IMAGE_DERIVATIVE_WIDTHS = [40, 80, 160])
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(MEDIA_ROOT = directory.name)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.name = 'photos/product/shirt.png'
+        os.makedirs(os.path.join(directory.name, 'photos/product'))
+        Image.new('RGBA', (100, 50), (255, 0, 0, 128)).save(os.path.join(directory.name, self.name))
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.product = Product.objects.create(
+            product_name = 'Shirt', slug = 'shirt', price = 10, image = self.name, stock = 5, category = category,
+        )
+
+    def render(self):
+        return Template('{% load images %}{% responsive_image image sizes="50vw" class="img-sm" %}').render(
+            Context({'image': self.product.image})
+        )
+
+    def test_render_derivatives(self):
+        source, targets = derivative_job(self.name)
+        self.assertEqual(render_derivatives(source, targets), 6)
+        sizes = {}
+        for path, width, image_format in targets:
+            with Image.open(path) as image:
+                self.assertEqual(image.format, image_format)
+                sizes[path.rsplit('-', 1)[-1]] = image.size
+        # Scaled down only: the 160px derivatives keep the original size.
+        self.assertEqual(sizes, {
+            '40w.webp': (40, 20), '40w.jpg': (40, 20), '80w.webp': (80, 40), '80w.jpg': (80, 40),
+            '160w.webp': (100, 50), '160w.jpg': (100, 50),
+        })
+        self.assertTrue(has_derivatives(self.name))
+
+    def test_template_tag_falls_back_until_every_size_exists(self):
+        self.assertHTMLEqual(self.render(), '<img src="/media/%s" class="img-sm">' % self.name)
+
+        render_derivatives(*derivative_job(self.name))
+        html = self.render()
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/photos/product/shirt-40w.webp 40w, ', html)
+        self.assertIn('srcset="/media/derivatives/photos/product/shirt-40w.jpg 40w, ', html)
+        self.assertIn('shirt-160w.jpg 160w" sizes="50vw" class="img-sm">', html)
+
+        # One size missing (e.g. a width added later): no srcset with a hole.
+        os.remove(default_storage.path(derivative_name(self.name, 80, 'webp')))
+        self.assertFalse(derivatives_ready(self.name))
+        self.assertHTMLEqual(self.render(), '<img src="/media/%s" class="img-sm">' % self.name)
+
+    def test_command(self):
+        Product.objects.create(
+            product_name = 'Lost', slug = 'lost', price = 10, image = 'photos/product/lost.png', stock = 5,
+            category = self.product.category,
+        )
+        out = io.StringIO()
+        call_command('generate_image_derivatives', workers = 1, stdout = out)
+        self.assertIn('Rendered 6 files for 1 images', out.getvalue())
+        self.assertIn('(0 up to date, 1 missing, 0 failed)', out.getvalue())
+        self.assertTrue(derivatives_ready(self.name))
+
+        out = io.StringIO()
+        call_command('generate_image_derivatives', workers = 1, stdout = out)
+        self.assertIn('Rendered 0 files for 0 images', out.getvalue())
+        self.assertIn('(1 up to date, 1 missing, 0 failed)', out.getvalue())
+
+        call_command('generate_image_derivatives', workers = 1, force = True, stdout = out)
+        self.assertIn('Rendered 6 files for 1 images', out.getvalue())
+
+
+class ConditionalResponseTests(TestCase):
+    """
+    Listings and product pages answer revalidations with 304 until the
+    catalog changes, however it changes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.products = [
+            Product.objects.create(
+                product_name = 'Shirt %d' % i, slug = 'shirt-%d' % i, price = 10, image = 'photos/product/shirt.jpg',
+                stock = 5, category = category,
+            )
+            for i in range(2)
+        ]
+        self.urls = ['/store/', '/store/category/shirts/', self.products[0].get_url()]
+
+    def etags(self):
+        etags = {}
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response['ETag']
+            self.assertEqual(self.client.get(url, headers = {'if-none-match': etags[url]}).status_code, 304)
+        return etags
+
+    def assertRevalidates(self, etags, status):
+        for url, etag in etags.items():
+            self.assertEqual(self.client.get(url, headers = {'if-none-match': etag}).status_code, status, url)
+
+    def test_save(self):
+        etags = self.etags()
+        self.assertRevalidates(etags, 304)
+        with self.captureOnCommitCallbacks(execute = True):
+            self.products[0].price = 12
+            self.products[0].save()
+        self.assertRevalidates(etags, 200)
+
+    def test_queryset_update(self):
+        etags = self.etags()
+        with self.captureOnCommitCallbacks(execute = True):
+            Product.objects.filter(pk = self.products[0].pk).update(price = 12)
+        self.assertRevalidates(etags, 200)
+        self.assertContains(self.client.get('/store/'), '12')
+
+    def test_bulk_update(self):
+        etags = self.etags()
+        self.products[0].description = 'Now in linen'
+        with self.captureOnCommitCallbacks(execute = True):
+            Product.objects.bulk_update(self.products, ['description'])
+        self.assertRevalidates(etags, 200)
+        self.assertEqual(ProductSearch('linen').count(), 1)
+
+    def test_bulk_create(self):
+        etags = self.etags()
+        category = self.products[0].category
+        with self.captureOnCommitCallbacks(execute = True):
+            Product.objects.bulk_create([
+                Product(
+                    product_name = 'Quokka Tee', slug = 'quokka-tee', price = 10, image = 'photos/product/shirt.jpg',
+                    stock = 5, category = category,
+                ),
+            ])
+        self.assertRevalidates({'/store/': etags['/store/']}, 200)
+        self.assertEqual([product.product_name for product in ProductSearch('quokka')[0:5]], ['Quokka Tee'])
+
+        Product.objects.bulk_create([
+            Product(
+                product_name = 'Quokka Hat', slug = 'quokka-tee', price = 10, image = 'photos/product/shirt.jpg',
+                stock = 5, category = category,
+            ),
+        ], update_conflicts = True, unique_fields = ['slug'], update_fields = ['product_name'])
+        self.assertEqual([product.product_name for product in ProductSearch('quokka')[0:5]], ['Quokka Hat'])
+
+    def test_update_refreshes_search_and_modified_date(self):
+        modified = self.products[0].modified_date
+        Product.objects.filter(pk = self.products[0].pk).update(product_name = 'Linen Blouse')
+        self.assertGreater(Product.objects.get(pk = self.products[0].pk).modified_date, modified)
+        self.assertEqual([product.product_name for product in ProductSearch('blouse')[0:5]], ['Linen Blouse'])
+        self.assertEqual(ProductSearch('shirt').count(), 1)
+
+
+@override_settings(REQUEST_TIMING = True, QUERY_BUDGET_STRICT = True)
+class QueryBudgetTests(TestCase):
+    """
+    Every storefront view must stay within its ``query_budget`` with cold
+    caches, for new visitors and for visitors with a cart.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.products = [
+            Product.objects.create(
+                product_name = 'Blue Shirt %d' % i, slug = 'blue-shirt-%d' % i, price = 10,
+                image = 'photos/product/shirt.jpg', stock = 5, category = category,
+            )
+            for i in range(5)
+        ]
+
+    def get(self, url, changes = None):
+        cache.clear()
+        with self.assertLogs('shipshop.timing', 'INFO') as logs:
+            if changes is None:
+                response = self.client.get(url)
+            else:
+                response = self.client.post(url, {'changes': changes}, content_type = 'application/json')
+        self.assertLess(response.status_code, 400, url)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('queries=%d ' % response.timings.queries, logs.output[0])
+        return response
+
+    def test_views_stay_within_budget(self):
+        product = self.products[0]
+        pages = ['/', '/store/', '/store/?page=2', '/store/category/shirts/', product.get_url(), '/store/search/?keyword=blue', '/cart/']
+        for url in pages:
+            self.get(url)
+        self.get('/cart/add_cart/%d/' % product.id)
+        for url in pages:
+            self.get(url)
+        self.get('/cart/remove_cart/%d/' % product.id)
+        self.get('/cart/remove_cart_item/%d/' % product.id)
+        self.get('/cart/api/', [{'action': 'add', 'product': p.id, 'quantity': 2} for p in self.products])
+        self.get('/cart/api/', [
+            {'action': 'add', 'product': product.id},
+            {'action': 'set', 'product': self.products[1].id, 'quantity': 1},
+            {'action': 'remove', 'product': self.products[2].id},
+            {'action': 'decrement', 'product': self.products[3].id},
+            {'action': 'decrement', 'product': self.products[4].id, 'quantity': 5},
+        ])
+        self.get('/cart/api/')
+
+    def test_context_processors_are_timed(self):
+        response = self.get('/')
+        self.assertIn('cp-menu_links;dur=', response['Server-Timing'])
+        self.assertIn('cp-counter;dur=', response['Server-Timing'])
+        self.assertEqual(response.timings.view, 'home')
+        self.assertEqual(response.timings.budget, 6)
+
+    async def test_async_requests_are_timed(self):
+        cache.clear()
+        with self.assertLogs('shipshop.timing', 'INFO'):
+            response = await self.async_client.get('/store/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.timings.view, 'store')
+        self.assertGreater(response.timings.queries, 0)
+        self.assertIn('cp-menu_links;dur=', response['Server-Timing'])
+
+    def test_middleware_is_async_capable(self):
+        async def get_response(request):
+            pass
+        self.assertTrue(iscoroutinefunction(TimingMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(TimingMiddleware(lambda request: None)))
+
+    def test_over_budget_raises(self):
+        with mock.patch.object(store_views.store, 'query_budget', 0):
+            with self.assertLogs('shipshop.timing', 'WARNING'), self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/store/')
+
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite syntax.")
+class QueryPlanTests(TestCase):
+    """
+    Run ``EXPLAIN QUERY PLAN`` on every query of the hot pages against a
+    seeded catalog and fail on full table scans.
+    """
+    # Tables read in full by design: the whole menu, the top-N ranking.
+    scannable = {'category_category', 'store_popularproduct'}
+    # "SCAN t USING INDEX i" walks an index in order (and stops at LIMIT);
+    # a bare "SCAN t" reads every row of the table.
+    full_scan = re.compile(r'^SCAN (\w+)$')
+    # Sorting the whole result set instead of reading an index in order.
+    sort = 'USE TEMP B-TREE FOR ORDER BY'
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_data', categories = 10, products = 500, carts = 50, accounts = 0, stdout = io.StringIO(),
+        )
+        cls.product = Product.objects.filter(is_available = True).select_related('category').first()
+
+    def setUp(self):
+        cache.clear()
+
+    def scans(self, url):
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 400, url)
+
+        scans = []
+        for sql, params in statements:
+            if sql.startswith('SELECT'):
+                scans += ['%s: %s\n  %s' % (url, detail, sql) for detail in self.explain(sql, params)]
+        return scans
+
+    def explain(self, sql, params):
+        """
+        Return the full scans and sorts in the query plan of a SELECT.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        # Relevance-ranked full-text matches have to be sorted.
+        ranked = any('VIRTUAL TABLE' in detail for detail in plan)
+        return [
+            detail for detail in plan
+            if (match := self.full_scan.match(detail)) and match.group(1) not in self.scannable
+            or detail == self.sort and not ranked
+        ]
+
+    def test_hot_paths_use_indexes(self):
+        product = self.product
+        pages = [
+            '/', '/store/', '/store/?page=20', product.category.get_url(), product.get_url(),
+            '/store/search/?keyword=shirt', '/cart/add_cart/%d/' % product.id, '/cart/',
+            '/cart/remove_cart/%d/' % product.id,
+            '/store/?sort=price', '/store/?sort=-price&page=5', '/store/?sort=newest&in_stock=1',
+            '/store/?min_price=50&max_price=200&sort=price', '/store/?min_price=100&after=x',
+            product.category.get_url() + '?sort=price', product.category.get_url() + '?sort=newest&page=3',
+        ]
+        scans = []
+        for url in pages:
+            scans += self.scans(url)
+        self.assertFalse(scans, "\n".join(scans))
+
+
+    def test_category_lookups_use_indexes(self):
+        # Cascades, counters and the admin read unavailable products too,
+        # which the partial listing indexes leave out.
+        category = self.product.category
+        for queryset in (
+            Product.objects.filter(category_id = category.id),
+            Product.objects.filter(category = category, is_available = False).order_by('id'),
+        ):
+            sql, params = queryset.query.sql_with_params()
+            self.assertEqual(self.explain(sql, params), [], sql)
+
+class AsyncViewTests(TestCase):
+    """
+    Serve the async views through the ASGI handler with cold caches; any
+    query left in the render path would raise SynchronousOnlyOperation.
+    """
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.products = [
+            Product.objects.create(
+                product_name = 'Blue Shirt %d' % i, slug = 'blue-shirt-%d' % i, price = 10,
+                image = 'photos/product/shirt.jpg', stock = 5, category = category,
+            )
+            for i in range(4)
+        ]
+
+    async def get(self, url, **headers):
+        await cache.aclear()
+        response = await self.async_client.get(url, headers = headers)
+        self.assertIn(response.status_code, (200, 304), url)
+        return response
+
+    async def test_pages(self):
+        product = self.products[0]
+        response = await self.get(product.get_url())
+        self.assertFalse(response.context['in_cart'])
+
+        await self.async_client.get('/cart/add_cart/%d/' % product.id)
+        response = await self.get(product.get_url())
+        self.assertTrue(response.context['in_cart'])
+        self.assertEqual(response.context['cart_count'], 1)
+        # Revalidate against the same cache: a cleared cache reseeds the
+        # versions, which must not match an ETag issued before.
+        response = await self.async_client.get(product.get_url(), headers = {'if_none_match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = await self.get('/store/?page=2')
+        self.assertEqual(response.context['product_count'], 4)
+        self.assertEqual(list(response.context['products']), self.products[3:])
+        response = await self.get('/store/?after=x')
+        self.assertEqual(list(response.context['products']), self.products[:3])
+        response = await self.get('/store/category/shirts/')
+        self.assertEqual(response.context['product_count'], 4)
+        response = await self.get('/store/search/?keyword=blue&page=2')
+        self.assertEqual(len(response.context['products']), 1)
+        response = await self.get('/cart/')
+        self.assertEqual(response.context['total'], 10)
+        response = await self.get('/')
+        self.assertEqual(len(response.context['products']), 4)
+
+        response = await self.async_client.get('/store/category/missing/')
+        self.assertEqual(response.status_code, 404)
+
+
+class PopularProductsTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.products = [
+            Product.objects.create(
+                product_name = 'Shirt %d' % i, slug = 'shirt-%d' % i, price = 10,
+                image = 'photos/product/shirt.jpg', stock = 5, category = category,
+            )
+            for i in range(4)
+        ]
+
+    def test_ranking_by_carts(self):
+        first, second, third, unavailable = self.products
+        unavailable.is_available = False
+        unavailable.save()
+        for cart_id, products in enumerate([[first, second, unavailable], [second, unavailable], [second, third]]):
+            cart = Cart.objects.create(cart_id = 'cart-%d' % cart_id)
+            for product in products:
+                CartItem.objects.create(cart = cart, products = product, quantity = 1)
+
+        refresh_popular_products(limit = 2)
+
+        self.assertEqual(list(PopularProduct.objects.values_list('product', flat = True)), [second.id, first.id])
+        with self.assertNumQueries(1):
+            self.assertEqual(popular_products(), [second, first])
+
+    def test_falls_back_to_newest_products(self):
+        self.assertEqual(popular_products(limit = 2), self.products[:1:-1])
+
+
+class SeedDataTests(TestCase):
+
+    def seed(self, seed, **options):
+        out = io.StringIO()
+        call_command(
+            'seed_data', categories = 4, products = 60, carts = 12, max_items = 3, accounts = 5, seed = seed,
+            batch_size = 25, stdout = out, **options
+        )
+        return out.getvalue()
+
+    def snapshot(self):
+        return (
+            list(Category.objects.order_by('slug').values_list('category_name', 'slug')),
+            list(Product.objects.order_by('slug').values_list('product_name', 'price', 'stock', 'is_available', 'category__slug')),
+            list(CartItem.objects.order_by('cart__cart_id', 'products__slug').values_list('cart__cart_id', 'products__slug', 'quantity')),
+        )
+
+    def test_counts_and_counters(self):
+        out = self.seed(1)
+        self.assertIn('Products: 60 rows', out)
+        self.assertEqual(Category.objects.count(), 4)
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertEqual(Cart.objects.count(), 12)
+        self.assertTrue(12 <= CartItem.objects.count() <= 36)
+        self.assertEqual(Account.objects.filter(username__startswith = 'seed').count(), 5)
+        self.assertIn('Search index: 60 rows', out)
+
+        counts = actual_counts()
+        self.assertEqual(
+            {category.id: (category.product_count, category.available_count) for category in Category.objects.all()},
+            counts,
+        )
+        self.assertEqual(sum(products for products, _ in counts.values()), 60)
+
+        with self.assertRaises(CommandError):
+            self.seed(1)
+
+    def test_same_seed_same_data(self):
+        self.seed(7)
+        first = self.snapshot()
+        self.seed(7, flush = True)
+        self.assertEqual(self.snapshot(), first)
+        self.seed(8, flush = True)
+        self.assertNotEqual(self.snapshot(), first)
+
+
+class BenchmarkCommandTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        for i in range(4):
+            Product.objects.create(
+                product_name = 'Blue Shirt %d' % i, slug = 'blue-shirt-%d' % i, price = 10,
+                image = 'photos/product/shirt.jpg', stock = 5, category = category,
+            )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'results.json')
+
+    def benchmark(self, **options):
+        call_command('benchmark', requests = 6, warmup = 3, host = 'testserver', stdout = io.StringIO(), **options)
+
+    def test_every_scenario_succeeds(self):
+        self.benchmark(output = self.output)
+        with open(self.output) as output:
+            scenarios = json.load(output)['scenarios']
+        self.assertEqual(set(scenarios), {
+            'home', 'store_first_page', 'store_deep_page', 'category', 'product_detail', 'search', 'cart_flow',
+        })
+        for name, result in scenarios.items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertGreater(result['queries_per_request'], 0, name)
+
+    def test_rejects_empty_runs(self):
+        for option in ('--requests', '--concurrency'):
+            with self.assertRaisesMessage(CommandError, 'must be at least 1'):
+                call_command('benchmark', option, '0', stdout = io.StringIO())
+
+    def test_fails_on_regression(self):
+        self.benchmark(scenario = ['product_detail'], output = self.output)
+        with open(self.output) as output:
+            results = json.load(output)
+        results['scenarios']['product_detail']['queries_per_request'] = 0
+        with open(self.output, 'w') as output:
+            json.dump(results, output)
+
+        with self.assertRaisesMessage(CommandError, 'product_detail'):
+            self.benchmark(scenario = ['product_detail'], baseline = self.output, threshold = 100)
+
+
+class TransferCommandTests(TestCase):
+
+    def setUp(self):
+        self.shirts = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        Category.objects.create(category_name = 'Jeans', slug = 'jeans')
+        self.product = Product.objects.create(
+            product_name = 'Blue Shirt', slug = 'blue-shirt', description = 'Cotton, "slim" fit', price = 10,
+            image = 'photos/product/shirt.jpg', stock = 5, category = self.shirts,
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def path(self, name, content = None):
+        path = os.path.join(self.directory, name)
+        if content is not None:
+            with open(path, 'w') as stream:
+                stream.write(content)
+        return path
+
+    def test_round_trip(self):
+        for name in ('products.csv', 'products.jsonl'):
+            path = self.path(name)
+            call_command('export_products', path, stdout = io.StringIO())
+            Product.objects.all().delete()
+            call_command('import_products', path, stdout = io.StringIO())
+            product = Product.objects.get()
+            self.assertEqual(
+                (product.product_name, product.slug, product.description, product.price, product.category),
+                ('Blue Shirt', 'blue-shirt', 'Cotton, "slim" fit', 10, self.shirts),
+            )
+
+    def test_upsert_in_batches(self):
+        path = self.path('products.jsonl', "\n".join([
+            '{"product_name": "Blue Shirt", "price": 12, "stock": 1, "category": "shirts", "is_available": "no"}',
+            '{"product_name": "Red Jeans", "price": 30, "stock": 2, "category": "jeans"}',
+            'not json',
+            '{"product_name": "Green Hat", "price": 5, "stock": 2, "category": "hats"}',
+            '{"product_name": "Black Jeans", "slug": "black", "price": "x", "stock": 2, "category": "jeans"}',
+            '{"product_name": "Grey Jeans", "price": 35, "stock": 4, "category": "jeans", "image": "a.jpg"}',
+        ]))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', path, batch_size = 2, stdout = stdout, stderr = stderr)
+
+        self.assertIn('3 products (2 created, 1 updated, 3 rejected)', stdout.getvalue())
+        self.assertIn('Row 4 rejected', stderr.getvalue())
+        updated = Product.objects.get(pk = self.product.pk)
+        self.assertEqual((updated.price, updated.stock, updated.is_available), (12, 1, False))
+        self.assertEqual(
+            list(Product.objects.filter(category__slug = 'jeans').values_list('slug', flat = True).order_by('id')),
+            ['red-jeans', 'grey-jeans'],
+        )
+
+    def test_import_indexes_each_chunk(self):
+        path = self.path('products.jsonl', "\n".join([
+            '{"product_name": "Blue Shirt", "description": "Linen", "price": 12, "stock": 1, "category": "shirts"}',
+            '{"product_name": "Red Jeans", "description": "Denim", "price": 30, "stock": 2, "category": "jeans"}',
+            '{"product_name": "Grey Jeans", "description": "Denim", "price": 35, "stock": 4, "category": "jeans"}',
+        ]))
+        with mock.patch('store.search.rebuild_index') as rebuild_index:
+            call_command('import_products', path, batch_size = 2, stdout = io.StringIO())
+
+        rebuild_index.assert_not_called()
+        self.assertEqual(ProductSearch('linen').count(), 1)
+        self.assertEqual(ProductSearch('denim').count(), 2)
+
+    def test_rejects_fractional_prices(self):
+        path = self.path('products.jsonl', "\n".join([
+            '{"product_name": "Red Jeans", "price": 19.99, "stock": 2, "category": "jeans"}',
+            '{"product_name": "Grey Jeans", "price": "19.99", "stock": 2, "category": "jeans"}',
+            '{"product_name": "Black Jeans", "price": 20.0, "stock": " 3 ", "category": "jeans"}',
+            '{"product_name": "White Jeans", "price": true, "stock": 3, "category": "jeans"}',
+        ]))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', path, stdout = stdout, stderr = stderr)
+
+        self.assertIn('1 products (1 created, 0 updated, 3 rejected)', stdout.getvalue())
+        self.assertIn("Row 1 rejected: not a whole number: 19.99", stderr.getvalue())
+        self.assertIn("Row 2 rejected: not a whole number: '19.99'", stderr.getvalue())
+        self.assertEqual(Product.objects.get(slug = 'black-jeans').price, 20)
+        self.assertFalse(Product.objects.filter(slug__in = ['red-jeans', 'grey-jeans', 'white-jeans']).exists())
+
+    def test_rejects_name_conflicts_per_row(self):
+        path = self.path('products.jsonl', "\n".join([
+            '{"product_name": "Red Jeans", "price": 30, "stock": 2, "category": "jeans"}',
+            '{"product_name": "Blue Shirt", "slug": "other-shirt", "price": 12, "stock": 1, "category": "shirts"}',
+            '{"product_name": "Red Jeans", "slug": "red-jeans-2", "price": 31, "stock": 2, "category": "jeans"}',
+            '{"product_name": "Grey Jeans", "price": 35, "stock": 4, "category": "jeans"}',
+        ]))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', path, stdout = stdout, stderr = stderr)
+
+        self.assertIn('2 products (2 created, 0 updated, 2 rejected)', stdout.getvalue())
+        self.assertIn("Row 2 rejected: product_name 'Blue Shirt' is already used by 'blue-shirt'", stderr.getvalue())
+        self.assertIn("Row 3 rejected: product_name 'Red Jeans' is already used by 'red-jeans'", stderr.getvalue())
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat = True)), ['blue-shirt', 'grey-jeans', 'red-jeans'],
+        )
+
+    def test_retries_failed_chunks_row_by_row(self):
+        path = self.path('products.jsonl', "\n".join([
+            '{"product_name": "Red Jeans", "price": 30, "stock": 2, "category": "jeans"}',
+            '{"product_name": "Blue Shirt", "slug": "blue-shirt", "price": 12, "stock": 1, "category": "shirts"}',
+        ]))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch('store.management.commands.import_products.Command.check_names', side_effect = lambda chunk: chunk):
+            Product.objects.filter(pk = self.product.pk).update(slug = 'old-shirt')
+            call_command('import_products', path, stdout = stdout, stderr = stderr)
+
+        self.assertIn('1 products (1 created, 0 updated, 1 rejected)', stdout.getvalue())
+        self.assertIn('Row 2 rejected', stderr.getvalue())
+        self.assertTrue(Product.objects.filter(slug = 'red-jeans').exists())
+
+@override_settings(PRODUCT_FEED_CHUNK_SIZE = 2)
+class ProductFeedTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(category_name = 'Shirts & Tops', slug = 'shirts')
+        self.products = [
+            Product.objects.create(
+                product_name = 'Blue <Shirt> %d' % i, slug = 'blue-shirt-%d' % i, price = 10 + i,
+                image = 'photos/product/shirt.jpg', stock = 5, category = category,
+            )
+            for i in range(5)
+        ]
+        self.products[4].is_available = False
+        self.products[4].save()
+
+    def test_xml_streams_one_piece_per_chunk(self):
+        response = self.client.get('/store/feed.xml')
+        self.assertTrue(response.streaming)
+        pieces = list(response.streaming_content)
+        # Header, two chunks of two products, footer.
+        self.assertEqual(len(pieces), 4)
+        content = b''.join(pieces).decode()
+        self.assertEqual(content.count('<product>'), 4)
+        self.assertIn('<title>Blue &lt;Shirt&gt; 0</title>', content)
+        self.assertIn('<link>http://testserver/store/category/shirts/blue-shirt-0/</link>', content)
+        self.assertIn('<image_link>http://testserver/media/photos/product/shirt.jpg</image_link>', content)
+        self.assertIn('<category>Shirts &amp; Tops</category>', content)
+
+    def test_csv(self):
+        response = self.client.get('/store/feed.csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,title,link,image_link,price,stock,category')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(self.client.get('/store/feed.json').status_code, 404)
+
+    def test_conditional_and_gzip(self):
+        response = self.client.get('/store/feed.xml', headers = {'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get('/store/feed.xml', headers = {'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/store/feed.xml', headers = {'if-modified-since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute = True):
+            self.products[0].delete()
+        response = self.client.get('/store/feed.xml', headers = {'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+
+    def test_category_rename_changes_etag(self):
+        etag = self.client.get('/store/feed.xml')['ETag']
+        category = Category.objects.get()
+        category.category_name = 'Shirts'
+        with self.captureOnCommitCallbacks(execute = True):
+            category.save()
+
+        self.assertNotEqual(feed_state()[0], etag.strip('"'))
+        response = self.client.get('/store/feed.xml', headers = {'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('<category>Shirts</category>', b''.join(response.streaming_content).decode())
+
+    @override_settings(DATABASE_REPLICAS = ['replica'])
+    def test_no_validators_while_replicas_catch_up(self):
+        cache.clear()
+        self.assertIsNotNone(feed_state()[0])
+        bump_version('catalog')
+        self.assertEqual(feed_state(), (None, None))
+
+    async def test_streams_asynchronously_under_asgi(self):
+        response = await self.async_client.get('/store/feed.xml')
+        self.assertTrue(response.is_async)
+        content = b''.join([piece async for piece in response.streaming_content]).decode()
+        self.assertEqual(content.count('<product>'), 4)
+
+
+class StaticFilesTests(TestCase):
+    """
+    collectstatic writes hashed, precompressed assets that are served with
+    immutable caching; media is served from the upload directories only.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(STATIC_ROOT = directory.name)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        call_command('collectstatic', interactive = False, verbosity = 0)
+
+    def test_hashed_precompressed_assets(self):
+        response = self.client.get('/accounts/login/')
+        url = re.search(r'/static/css/ui\.[0-9a-f]{12}\.css', response.content.decode()).group()
+
+        response = self.client.get(url, headers = {'accept-encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertTrue(response['Content-Type'].startswith('text/css'))
+        compressed = b''.join(response.streaming_content)
+
+        response = self.client.get(url, headers = {'accept-encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(gzip.decompress(compressed), b''.join(response.streaming_content))
+
+        response = self.client.get('/static/css/ui.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+        response = self.client.get('/static/css/ui.css', headers = {'if-modified-since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_media_is_limited_to_upload_directories(self):
+        response = self.client.get('/media/photos/categories/shirts.jpg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        for url in ('/media/manage.py', '/media/shipshop/settings.py', '/media/photos/../manage.py'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+
+
+class ListingFacetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        shirts = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        jeans = Category.objects.create(category_name = 'Jeans', slug = 'jeans')
+        self.products = {}
+        for name, category, price, stock in [
+            ('shirt-a', shirts, 20, 5), ('shirt-b', shirts, 60, 0), ('shirt-c', shirts, 120, 5),
+            ('jeans-a', jeans, 70, 5), ('jeans-b', jeans, 2500, 1), ('jeans-c', jeans, 40, 0),
+        ]:
+            self.products[name] = Product.objects.create(
+                product_name = name, slug = name, price = price, image = 'photos/product/shirt.jpg',
+                stock = stock, category = category,
+            )
+        Product.objects.create(
+            product_name = 'hidden', slug = 'hidden', price = 10, image = 'photos/product/shirt.jpg',
+            stock = 5, category = shirts, is_available = False,
+        )
+
+    def listing(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        return (
+            [product.slug for product in context['products']],
+            {facet['category'].slug: facet['count'] for facet in context['category_facets']},
+            [facet['count'] for facet in context['price_facets']],
+            context['product_count'],
+        )
+
+    def test_facet_counts(self):
+        products, categories, prices, total = self.listing('/store/?min_price=50&max_price=150')
+        self.assertEqual(total, 3)
+        self.assertEqual(products, ['shirt-b', 'jeans-a', 'shirt-c'])
+        # Category counts honour the price range, price counts ignore it.
+        self.assertEqual(categories, {'shirts': 2, 'jeans': 1})
+        self.assertEqual(prices, [2, 2, 1, 0, 0, 0, 0, 1])
+
+        products, categories, prices, total = self.listing('/store/category/jeans/?in_stock=1&sort=-price')
+        self.assertEqual(products, ['jeans-b'])
+        self.assertEqual(total, 2)
+        self.assertEqual(categories, {'shirts': 2, 'jeans': 2})
+        self.assertEqual(prices, [0, 1, 0, 0, 0, 0, 0, 1])
+
+    def test_sorts(self):
+        self.assertEqual(self.listing('/store/?sort=price')[0], ['shirt-a', 'jeans-c', 'shirt-b'])
+        self.assertEqual(self.listing('/store/?sort=newest&page=2')[0], ['shirt-c', 'shirt-b', 'shirt-a'])
+        with self.settings(STORE_CURSOR_PAGINATION = True):
+            response = self.client.get('/store/?sort=-price')
+            page = response.context['products']
+            response = self.client.get('/store/?sort=-price&after=%s' % page.next_cursor)
+            self.assertEqual([product.slug for product in response.context['products']], ['shirt-b', 'jeans-c', 'shirt-a'])
+
+    def test_facets_are_cached_per_stock_filter(self):
+        self.client.get('/store/?sort=price')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/store/category/shirts/?min_price=100&page=1')
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/store/?in_stock=1')
+        self.assertEqual(len([query for query in queries if 'GROUP BY' in query['sql']]), 1)
+
+    def test_links_keep_filters_and_drop_page(self):
+        response = self.client.get('/store/?min_price=50&sort=price&page=2')
+        shirts = response.context['category_facets'][0]
+        self.assertEqual(shirts['url'], '/store/category/shirts/?min_price=50&sort=price')
+        bucket = response.context['price_facets'][0]
+        self.assertEqual(bucket['url'], '/store/?sort=price&max_price=50')
+        self.assertEqual(self.client.get('/store/category/missing/').status_code, 404)
+
+
+class CategoryCounterTests(TestCase):
+
+    def setUp(self):
+        self.shirts = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.jeans = Category.objects.create(category_name = 'Jeans', slug = 'jeans')
+        self.created = 0
+
+    def product(self, category, **fields):
+        self.created += 1
+        return Product(
+            product_name = 'Product %d' % self.created, slug = 'product-%d' % self.created, price = 10,
+            image = 'photos/product/shirt.jpg', stock = 5, category = category, **fields,
+        )
+
+    def assertCounts(self, shirts, jeans):
+        self.assertEqual(
+            list(Category.objects.order_by('id').values_list('product_count', 'available_count')),
+            [shirts, jeans],
+        )
+        output = io.StringIO()
+        call_command('reconcile_category_counts', stdout = output)
+        self.assertIn('Fixed 0 categories', output.getvalue())
+
+    def test_save_and_delete(self):
+        first = self.product(self.shirts)
+        first.save()
+        second = self.product(self.shirts, is_available = False)
+        second.save()
+        self.assertCounts((2, 1), (0, 0))
+
+        second.is_available = True
+        second.save()
+        first.category = self.jeans
+        first.save()
+        self.assertCounts((1, 1), (1, 1))
+
+        second.delete()
+        self.assertCounts((0, 0), (1, 1))
+        self.jeans.delete()
+        self.assertEqual(list(Category.objects.values_list('product_count', 'available_count')), [(0, 0)])
+
+    def test_bulk_operations(self):
+        products = Product.objects.bulk_create(
+            [self.product(self.shirts) for _ in range(3)] + [self.product(self.jeans, is_available = False)]
+        )
+        self.assertCounts((3, 3), (1, 0))
+
+        products[0].category = self.jeans
+        products[1].is_available = False
+        products[3].is_available = True
+        Product.objects.bulk_update(products, ['category', 'is_available'], batch_size = 2)
+        self.assertCounts((2, 1), (2, 2))
+
+        Product.objects.filter(category = self.shirts).update(is_available = True)
+        self.assertCounts((2, 2), (2, 2))
+        Product.objects.filter(pk__in = [products[1].pk, products[2].pk]).update(category = self.jeans, stock = 1)
+        self.assertCounts((0, 0), (4, 4))
+        Product.objects.filter(pk = products[0].pk).update(is_available = Q(stock__gt = 10))
+        self.assertCounts((0, 0), (4, 3))
+        Product.objects.filter(category = self.jeans, is_available = True).delete()
+        self.assertCounts((0, 0), (1, 0))
+
+    def test_reconcile_fixes_drift(self):
+        Product.objects.bulk_create([self.product(self.shirts) for _ in range(2)])
+        Category.objects.filter(pk = self.shirts.pk).update(product_count = 7)
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE store_product SET category_id = %s', [self.jeans.pk])
+        output = io.StringIO()
+        call_command('reconcile_category_counts', stdout = output)
+        self.assertIn('shirts: 7/2 available -> 0/0 available', output.getvalue())
+        self.assertIn('Fixed 2 categories', output.getvalue())
+        self.assertCounts((0, 0), (2, 2))
+
+
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.index = SuggestionIndex()
+        self.jeans = Category.objects.create(category_name = 'Jeans', slug = 'jeans')
+        self.products = [
+            Product.objects.create(
+                product_name = name, slug = slugify(name), price = 10, image = 'photos/product/shirt.jpg',
+                stock = 5, category = self.jeans,
+            )
+            for name in ('Blue Jeans', 'Black Jeans', 'Jeté Skirt', 'Red Shirt')
+        ]
+
+    def suggest(self, query):
+        # The signal handlers bump the versions on commit, which TestCase never reaches.
+        bump_version('catalog')
+        bump_version('category')
+        self.index.refresh()
+        return [result['name'] for result in self.index.suggest(query, limit = 8)]
+
+    def test_prefix_matches_any_word(self):
+        self.assertEqual(self.suggest('je'), ['Jeans', 'Blue Jeans', 'Black Jeans', 'Jeté Skirt'])
+        self.assertEqual(self.suggest('JETE s'), ['Jeté Skirt'])
+        self.assertEqual(self.suggest('bl'), ['Black Jeans', 'Blue Jeans'])
+        self.assertEqual(self.suggest(' '), [])
+
+    def test_incremental_refresh(self):
+        self.suggest('je')
+        blue, black, skirt, shirt = self.products
+        blue.product_name = 'Blue Denim'
+        blue.save()
+        black.is_available = False
+        black.save()
+        Product.objects.create(
+            product_name = 'Jersey', slug = 'jersey', price = 10, image = 'photos/product/shirt.jpg',
+            stock = 5, category = self.jeans,
+        )
+        with mock.patch.object(self.index.products, 'rebuild', side_effect = AssertionError):
+            self.assertEqual(self.suggest('je'), ['Jeans', 'Jersey', 'Jeté Skirt'])
+        self.assertEqual(self.suggest('denim'), ['Blue Denim'])
+
+        # A deletion leaves nothing to fetch; the counters reveal it.
+        skirt.delete()
+        self.assertEqual(self.suggest('je'), ['Jeans', 'Jersey'])
+
+    def test_refresh_after_queryset_update(self):
+        self.suggest('je')
+        with self.captureOnCommitCallbacks(execute = True):
+            Product.objects.filter(pk = self.products[0].pk).update(product_name = 'Blue Denim')
+        self.index.refresh()
+        self.assertEqual([result['name'] for result in self.index.suggest('denim', limit = 8)], ['Blue Denim'])
+        self.assertEqual(
+            [result['name'] for result in self.index.suggest('je', limit = 8)], ['Jeans', 'Black Jeans', 'Jeté Skirt'],
+        )
+
+    def test_endpoint_skips_the_database_when_current(self):
+        response = self.client.get('/store/autocomplete/?q=blu')
+        with self.assertNumQueries(0):
+            response = self.client.get('/store/autocomplete/?q=blu&limit=x')
+        self.assertEqual(response.json(), {
+            'query': 'blu',
+            'results': [{'type': 'product', 'name': 'Blue Jeans', 'url': self.products[0].get_url()}],
+        })
+        self.assertEqual(len(self.client.get('/store/autocomplete/?q=j&limit=2').json()['results']), 2)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Catalog reads go to a replica (here a file copy of the test database)
+    unless the visitor wrote something in the last few seconds, or they
+    fill a cache under a version the replica may not have caught up with.
+
+    The copy needs committed data, hence TransactionTestCase.
+    """
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Set up outside connections.settings, like a connection created at
+        # run time, so TestCase lets it through without a test database.
+        primary = connections['default']
+        connections['replica'] = type(primary)(
+            dict(primary.settings_dict, NAME = os.path.join(directory.name, 'replica.sqlite3')), 'replica',
+        )
+        self.addCleanup(self.remove_replica)
+        self.settings = override_settings(DATABASE_REPLICAS = ['replica'])
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+        category = Category.objects.create(category_name = 'Shirts', slug = 'shirts')
+        self.product = Product.objects.create(
+            product_name = 'Red Shirt', slug = 'red-shirt', price = 10, image = 'photos/product/shirt.jpg',
+            stock = 5, category = category,
+        )
+        call_command('sync_replicas', stdout = io.StringIO())
+        Product.objects.filter(pk = self.product.pk).update(product_name = 'Blue Shirt')
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+
+    def product_name(self):
+        cache.clear()
+        response = self.client.get(self.product.get_url())
+        self.assertEqual(response.status_code, 200)
+        return 'Blue Shirt' if 'Blue Shirt' in response.content.decode() else 'Red Shirt'
+
+    def test_catalog_reads_use_the_replica(self):
+        self.assertEqual(Product.objects.get(pk = self.product.pk).product_name, 'Red Shirt')
+        self.assertEqual(Product.objects.get(pk = self.product.pk)._state.db, 'replica')
+        self.assertEqual(Cart.objects.db, 'default')
+        with transaction.atomic():
+            self.assertEqual(Product.objects.get(pk = self.product.pk).product_name, 'Blue Shirt')
+        self.assertEqual(self.product_name(), 'Red Shirt')
+
+    def test_cart_change_pins_the_session_to_the_primary(self):
+        self.client.get(reverse('add_cart', args = [self.product.pk]))
+        self.assertEqual(self.product_name(), 'Blue Shirt')
+        self.assertEqual(Product.objects.get(pk = self.product.pk).product_name, 'Red Shirt')
+
+        session = self.client.session
+        session[PIN_SESSION_KEY] = 0
+        session.save()
+        self.assertEqual(self.product_name(), 'Red Shirt')
+
+    async def test_async_requests_honour_the_pin(self):
+        await self.async_client.get(reverse('add_cart', args = [self.product.pk]))
+        await sync_to_async(cache.clear)()
+        response = await self.async_client.get(self.product.get_url())
+        self.assertContains(response, 'Blue Shirt')
+
+    def test_admin_save_pins_the_session(self):
+        admin = Account.objects.create_superuser('Ada', 'Admin', 'ada@example.com', 'ada', 'secret')
+        self.client.force_login(admin)
+        category = self.product.category
+        response = self.client.post('/admin/store/product/%d/change/' % self.product.pk, {
+            'product_name': 'Green Shirt', 'slug': 'red-shirt', 'description': '', 'price': 10,
+            'stock': 5, 'is_available': 'on', 'category': category.pk,
+        })
+        self.assertRedirects(response, '/admin/store/product/', fetch_redirect_response = False)
+        self.assertGreater(self.client.session[PIN_SESSION_KEY], time.time())
+        cache.clear()
+        self.assertContains(self.client.get(self.product.get_url()), 'Green Shirt')
+
+    def test_cache_fills_read_the_primary(self):
+        category = Category.objects.using('default').get()
+        category.category_name = 'Tops'
+        category.save()
+        self.assertEqual(Category.objects.get().category_name, 'Shirts')
+        self.assertEqual([link.category_name for link in get_menu_links()], ['Tops'])
+        Product.objects.filter(pk = self.product.pk).update(is_available = False)
+        self.assertEqual(facet_rows(), [])
+
+    def test_listing_reads_the_primary_after_a_bump(self):
+        cache.clear()
+        self.assertContains(self.client.get('/store/'), 'Red Shirt')
+        bump_version('catalog')
+        self.assertContains(self.client.get('/store/'), 'Blue Shirt')
+        with override_settings(REPLICA_PIN_SECONDS = 0):
+            bump_version('catalog')
+            self.assertContains(self.client.get('/store/'), 'Red Shirt')
@@ -0,0 +1,99 @@
+"""
+Streaming product import and export (``manage.py import_products`` and
+``manage.py export_products``).
+
+Products travel as CSV or JSON Lines with the columns in ``FIELDS``; the
+category is given by its slug. Both directions handle one row at a time,
+so files of any size are read and written in constant memory.
+"""
+import csv
+import json
+import posixpath
+
+FIELDS = ('product_name', 'slug', 'description', 'price', 'stock', 'is_available', 'image', 'category')
+FORMATS = ('csv', 'jsonl')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+def guess_format(path, default = 'csv'):
+    """
+    Return the format implied by a file name: ``jsonl`` for ``.jsonl`` and
+    ``.ndjson``, ``csv`` for ``.csv``, ``default`` otherwise.
+    """
+    extension = posixpath.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension == '.csv':
+        return 'csv'
+    return default
+
+
+def read_rows(stream, format):
+    """
+    Yield one ``dict`` per product in a CSV or JSON Lines text stream.
+
+    Blank JSON lines are skipped. A row that is not valid JSON is yielded
+    as a ``ValueError`` so the caller can report it and go on.
+    """
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield ValueError('invalid JSON: %s' % exc)
+            continue
+        yield row if isinstance(row, dict) else ValueError('expected a JSON object')
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError('not a boolean: %r' % value)
+
+
+def parse_int(value):
+    """
+    Parse a whole number from CSV text or a JSON number. Fractions such as
+    ``19.99`` are an error, never rounded.
+    """
+    if isinstance(value, bool):
+        raise ValueError('not a whole number: %r' % value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError('not a whole number: %r' % value)
+        return int(value)
+    try:
+        return int(value.strip() if isinstance(value, str) else value)
+    except (TypeError, ValueError):
+        raise ValueError('not a whole number: %r' % value) from None
+
+
+class RowWriter:
+    """
+    Write product rows (tuples in ``FIELDS`` order) as CSV or JSON Lines.
+    """
+
+    def __init__(self, stream, format):
+        self.stream = stream
+        self.format = format
+        if format == 'csv':
+            self.csv = csv.writer(stream)
+            self.csv.writerow(FIELDS)
+
+    def write(self, row):
+        if self.format == 'csv':
+            self.csv.writerow(row)
+        else:
+            self.stream.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii = False))
+            self.stream.write('\n')
@@ -6,4 +6,6 @@ urlpatterns = [
     path('category/<slug:category_slug>/', views.store, name='category_slug'),
     path('category/<slug:category_slug>/<slug:product_slug>/', views.product_detail , name='product_detail'),
     path('search/', views.search , name='search'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('feed.<str:format>', views.feed, name='product_feed'),
 ]
\ No newline at end of file
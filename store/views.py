@@ -1,22 +1,103 @@
-from django.http import HttpResponse
-from django.shortcuts import render, get_object_or_404
-from django.db.models import Q
+import asyncio
+import hashlib
+from functools import wraps
 
-from carts.models import CartItem
-from carts.views import _cart_id
-from .models import Product, Category
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
 
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from carts.storage import get_cart_store
+from carts.views import _acart_version, _cart_id
+from shipshop.cache import aget_version
+from shipshop.routers import apin_after_bump
+from category.context_processor import aget_menu_links
+from shipshop.shortcuts import arender
+from shipshop.timing import query_budget
+from .autocomplete import acurrent_versions, suggestion_index
+from .facets import PRICE_BOUNDARIES, PRICE_BUCKETS, SORTS, Facets, ListingFilters, afacet_rows, filter_url
+from .feeds import CONTENT_TYPES, aiter_feed, feed_state, iter_feed
+from .models import Product
+from .pagination import CachedCountPaginator, CursorPaginator
+from .search import ProductSearch, SearchPaginator
 
 # Create your views here.
 
-def store(request, category_slug = None):
+def _acondition(etag_func):
+    """
+    Async ``django.views.decorators.http.condition`` for ETags.
+
+    Django's decorator accepts async views but calls ``etag_func``
+    synchronously; this one awaits it, so the ETag may be computed with the
+    async ORM.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = await etag_func(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+            response = get_conditional_response(request, etag = etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if etag and request.method in ('GET', 'HEAD'):
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+async def _etag(request, *parts):
+    """
+    Build an ETag for a page from the state it was rendered from.
+
+    Besides the given parts, every page depends on the category menu and on
+    the visitor's cart (navbar badge, "Added to cart"), so their versions
+    are always included. None of this needs a database query.
+    """
+    parts += (request.get_full_path(), await aget_version('category'), await _acart_version(request))
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+async def _store_etag(request, category_slug = None):
+    # The listing is read after this ETag is built: read it from the primary
+    # while a replica may still hold the state before the version changed.
+    await apin_after_bump('catalog', 'category')
+    return await _etag(request, 'store', await aget_version('catalog'))
+
+async def _product_etag(request, category_slug = None, product_slug = None):
+    # Slice instead of afirst(): the slugs are unique, so no ORDER BY is needed.
+    modified = [
+        modified async for modified in Product.objects.filter(
+            category__slug = category_slug, slug = product_slug,
+        ).values_list('modified_date', flat = True)[:1]
+    ]
+    if not modified:
+        return None
+    return await _etag(request, 'product', modified[0].isoformat())
+
+@query_budget(6)
+@_acondition(_store_etag)
+async def store(request, category_slug = None):
     """
     Display products in the store, optionally filtered by category.
     
     This view handles both the main store page and category-specific product listings.
     It retrieves all available products or filters them by a specific category slug.
-    
+    The ``min_price``, ``max_price`` and ``in_stock`` query parameters
+    narrow the listing further and ``sort`` orders it by price or newest
+    first (see ``store.facets``). The sidebar shows facet counts per
+    category and price bucket, summed from one cached grouped aggregate,
+    which also provides the total.
+
+    Listings are paged by page number, or by opaque ``after``/``before``
+    cursor tokens when ``settings.STORE_CURSOR_PAGINATION`` is enabled or a
+    token is present in the query string. Cursor pages seek on the sort
+    columns instead of using OFFSET, so deep pages cost the same as the
+    first one. Repeat visits are answered with 304 Not Modified until the
+    catalog, the category menu or the visitor's cart changes.
+
     Args:
         request (HttpRequest): The HTTP request object
         category_slug (str, optional): The slug of the category to filter products by.
@@ -26,38 +107,84 @@ def store(request, category_slug = None):
         HttpResponse: Rendered store template with products and product count
     
     Context:
-        products (QuerySet): Available products (filtered by category if specified)
+        products (Page | CursorPage): The current page of available products
+            (filtered by category if specified)
         product_count (int): Total number of products in the result set
+        filters (ListingFilters): The selected filters and sort order
+        category_facets (list): ``category``, ``count`` and ``url`` per category
+        price_facets (list): ``min``, ``max``, ``count``, ``url`` and
+            ``active`` per price bucket
+        page_range (iterable): Page numbers to link, with ellipses
     """
-    categories = None
-    products = None
-
+    # The category comes from the cached menu, the facet counts from the cache.
+    categories, rows = await asyncio.gather(aget_menu_links(), afacet_rows(request.GET.get('in_stock') == '1'))
+    category = None
     if category_slug != None:
-        categories = get_object_or_404(Category, slug = category_slug)
-        products = Product.objects.all().filter(category = categories, is_available = True)
-        paginator = Paginator(products, 1)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
+        category = next((category for category in categories if category.slug == category_slug), None)
+        if category is None:
+            raise Http404("No Category matches the given query.")
+        per_page = 1
     else:
-        products = Product.objects.all().filter(is_available = True).order_by("id")
-        paginator = Paginator(products, 3)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
-    product_count = products.count()
+        per_page = 3
+    filters = ListingFilters.from_request(request, category)
+    facets = Facets(rows, filters)
+    products = filters.apply(Product.objects.filter(is_available = True)).select_related('category')
+
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    page_range = None
+    if settings.STORE_CURSOR_PAGINATION or after or before:
+        paginator = CursorPaginator(products, per_page, ordering = filters.ordering)
+        paginator.count = facets.total
+        paged_products = await paginator.aget_page(after = after, before = before)
+    else:
+        paginator = CachedCountPaginator(products.order_by(*filters.ordering), per_page)
+        paginator.count = facets.total
+        paged_products = await paginator.aget_page(request.GET.get('page'))
+        page_range = paginator.get_elided_page_range(paged_products.number, on_each_side = 2, on_ends = 1)
 
     context = {
         'products' : paged_products, 
-        'product_count':product_count, 
+        'product_count': facets.total,
+        'filters': filters,
+        'all_products_url': filter_url(request, reverse('store')),
+        'category_facets': [
+            {
+                'category': category,
+                'count': facets.categories.get(category.id, 0),
+                'url': filter_url(request, category.get_url()),
+            }
+            for category in categories
+        ],
+        'price_facets': [
+            {
+                'min': low,
+                'max': high,
+                'count': count,
+                'url': filter_url(request, request.path, min_price = low or None, max_price = high),
+                'active': (filters.min_price or 0) == low and filters.max_price == high,
+            }
+            for (low, high), count in zip(PRICE_BUCKETS, facets.prices)
+        ],
+        'price_options': PRICE_BOUNDARIES,
+        'sort_options': [(value, label) for value, (label, _) in SORTS.items()],
+        'page_range': page_range,
     }
 
-    return render(request, 'store/store.html', context=context)
+    return await arender(request, 'store/store.html', context=context)
 
-def product_detail(request, category_slug = None, product_slug = None):
+@query_budget(7)
+@_acondition(_product_etag)
+async def product_detail(request, category_slug = None, product_slug = None):
     """
     Display detailed information for a specific product.
     
     This view retrieves a single product based on its category and product slugs,
     and displays detailed product information including description, price, and image.
+    The ETag is derived from the product's ``modified_date`` (one narrow
+    query) plus the menu and cart versions, so revalidations are answered
+    with 304 Not Modified without loading the product or rendering.
+    The product and the visitor's cart are fetched concurrently.
     
     Args:
         request (HttpRequest): The HTTP request object
@@ -74,8 +201,12 @@ def product_detail(request, category_slug = None, product_slug = None):
         Exception: Re-raises any exception that occurs during product retrieval
     """
     try:
-        product = Product.objects.get(category__slug = category_slug, slug = product_slug)
-        in_cart = CartItem.objects.filter(cart__cart_id = _cart_id(request), products = product).exists()
+        cart_id = _cart_id(request)
+        lookups = [Product.objects.select_related('category').aget(category__slug = category_slug, slug = product_slug)]
+        if cart_id is not None:
+            lookups.append(get_cart_store().aquantities(cart_id))
+        product, *quantities = await asyncio.gather(*lookups)
+        in_cart = bool(quantities) and product.id in quantities[0]
     except Exception as e:
         raise e
 
@@ -83,20 +214,114 @@ def product_detail(request, category_slug = None, product_slug = None):
         'single_product' : product,
         'in_cart': in_cart, 
     }
-    return render(request, "store/product_detail.html", context)
+    return await arender(request, "store/product_detail.html", context)
 
 
-def search(request):
-    if "keyword" in request.GET:
-        context = None
-        keyword = request.GET['keyword']
-        if keyword:
-            products = Product.objects.order_by('-created_date').filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
-            product_count = products.count()
+@query_budget(7)
+async def search(request):
+    """
+    Display ranked, paginated full-text search results.
 
-            context = {
-                'products': products,
-                'product_count': products.count(),
-            }
+    Matches the ``keyword`` query parameter against product names and
+    descriptions through the search index in ``store.search``. Every term
+    is prefix matched and results are ordered by relevance.
 
-    return render(request, "store/store.html", context)
\ No newline at end of file
+    Args:
+        request (HttpRequest): The HTTP request object
+
+    Returns:
+        HttpResponse: Rendered store template with the requested result page
+
+    Context:
+        products (Page): The current page of matching products
+        product_count (int): Total number of matching products
+        keyword (str): The search keyword
+        page_range (iterable): Page numbers to link, with ellipses
+    """
+    context = None
+    keyword = request.GET.get('keyword', '').strip()
+    if keyword:
+        paginator = SearchPaginator(ProductSearch(keyword), 3)
+        paged_products = await paginator.aget_page(request.GET.get('page'))
+
+        context = {
+            'products': paged_products,
+            'product_count': paginator.count,
+            'keyword': keyword,
+            'page_range': paginator.get_elided_page_range(paged_products.number, on_each_side = 2, on_ends = 1),
+        }
+
+    return await arender(request, "store/store.html", context)
+
+
+def _feed_state(request, format):
+    # condition() asks for the ETag and Last-Modified separately; both come
+    # from the same cache reads.
+    if not hasattr(request, '_feed_state'):
+        request._feed_state = feed_state()
+    return request._feed_state
+
+@gzip_page
+@condition(
+    etag_func = lambda request, format: _feed_state(request, format)[0],
+    last_modified_func = lambda request, format: _feed_state(request, format)[1],
+)
+def feed(request, format):
+    """
+    Stream the catalog of available products as XML or CSV.
+
+    The document is generated chunk by chunk while it is sent (see
+    ``store.feeds``), gzip-compressed on the fly for clients that accept it.
+    Revalidations with ``If-None-Match`` or ``If-Modified-Since`` are
+    answered with 304 Not Modified until a product changes.
+
+    Args:
+        request (HttpRequest): The HTTP request object
+        format (str): ``'xml'`` or ``'csv'``
+
+    Returns:
+        StreamingHttpResponse: The feed document
+
+    Raises:
+        Http404: If the format is not supported
+    """
+    if format not in CONTENT_TYPES:
+        raise Http404("Unknown feed format.")
+    base_url = request.build_absolute_uri('/')[:-1]
+    # Under ASGI a synchronous iterator would be read in full before sending.
+    content = aiter_feed(format, base_url) if isinstance(request, ASGIRequest) else iter_feed(format, base_url)
+    response = StreamingHttpResponse(content, content_type = CONTENT_TYPES[format])
+    if format == 'csv':
+        response['Content-Disposition'] = 'inline; filename="products.csv"'
+    return response
+
+
+AUTOCOMPLETE_LIMIT = 8
+
+async def autocomplete(request):
+    """
+    Suggest categories and products for the navbar search box as JSON.
+
+    Answered from the per-process prefix index in ``store.autocomplete``;
+    the database is only read when the catalog or the categories changed
+    since the index was last refreshed.
+
+    Args:
+        request (HttpRequest): The HTTP request object, with the typed text
+            in ``q`` and optionally ``limit`` (at most 20)
+
+    Returns:
+        JsonResponse: ``query`` and ``results``, a list of ``type``
+            (``category`` or ``product``), ``name`` and ``url``
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', AUTOCOMPLETE_LIMIT)), 1), 20)
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    versions = await acurrent_versions()
+    if not suggestion_index.is_current(versions):
+        await suggestion_index.arefresh(versions)
+    response = JsonResponse({'query': query, 'results': suggestion_index.suggest(query[:100], limit)})
+    patch_cache_control(response, public = True, max_age = 60)
+    return response